@@ -0,0 +1,187 @@
+"""Сравнение Database.get_detailed_stats с прежней реализацией (13 запросов).
+
+Строит синтетическую базу во временном файле, проверяет, что результаты
+совпадают, и печатает время обоих вариантов. Отдельно сравнивает подсчеты
+по users и sent_mailings: скалярные подзапросы по индексу (как в
+get_detailed_stats) и один проход с SUM(CASE ...):
+
+    python -m benchmarks.bench_detailed_stats --users 200000 --activity 2000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from database.db import Database
+from database.pool import ConnectionPool
+
+
+def legacy_detailed_stats(db: Database):
+    """get_detailed_stats до перехода на условные агрегаты"""
+    with db.pool.read() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM users')
+        total_users = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM users WHERE joined_date >= datetime('now', '-1 day')")
+        new_users_today = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM users WHERE joined_date >= datetime('now', '-7 day')")
+        new_users_week = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM users WHERE joined_date >= datetime('now', '-30 day')")
+        new_users_month = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(DISTINCT user_id) FROM user_activity WHERE timestamp >= datetime('now', '-7 day')")
+        active_users_week = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(DISTINCT user_id) FROM user_activity WHERE timestamp >= datetime('now', '-1 day')")
+        active_users_today = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM mailings')
+        total_mailings = cursor.fetchone()[0]
+        cursor.execute('SELECT SUM(sent_count) FROM mailings')
+        total_sent_messages = cursor.fetchone()[0] or 0
+        cursor.execute('SELECT COUNT(*) FROM mailings WHERE is_template = 1')
+        total_templates = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM sent_mailings WHERE status = 'sent'")
+        successful_deliveries = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM sent_mailings WHERE status = 'failed'")
+        failed_deliveries = cursor.fetchone()[0]
+        cursor.execute('''
+            SELECT CASE WHEN COUNT(DISTINCT user_id) > 0
+                        THEN CAST(COUNT(*) AS FLOAT) / COUNT(DISTINCT user_id) ELSE 0 END
+            FROM user_activity WHERE timestamp >= datetime('now', '-7 day')
+        ''')
+        avg = cursor.fetchone()[0]
+        avg_activity_per_user = round(avg, 2) if avg else 0
+        cursor.execute('''
+            SELECT media_type, COUNT(*) as count FROM mailings
+            WHERE media_type IS NOT NULL GROUP BY media_type
+        ''')
+        media_type_stats = {row['media_type']: row['count'] for row in cursor.fetchall()}
+        return {
+            'total_users': total_users,
+            'new_users_today': new_users_today,
+            'new_users_week': new_users_week,
+            'new_users_month': new_users_month,
+            'active_users_week': active_users_week,
+            'active_users_today': active_users_today,
+            'total_mailings': total_mailings,
+            'total_templates': total_templates,
+            'total_sent_messages': total_sent_messages,
+            'successful_deliveries': successful_deliveries,
+            'failed_deliveries': failed_deliveries,
+            'avg_activity_per_user': avg_activity_per_user,
+            'media_type_stats': media_type_stats
+        }
+
+
+# Подсчеты по users и sent_mailings: по подзапросу на цифру (поиск по индексу)
+# и один проход по таблице с условными суммами
+INDEX_COUNTS = {
+    'users': '''
+        SELECT (SELECT COUNT(*) FROM users),
+               (SELECT COUNT(*) FROM users WHERE joined_date >= datetime('now', '-1 day')),
+               (SELECT COUNT(*) FROM users WHERE joined_date >= datetime('now', '-7 day')),
+               (SELECT COUNT(*) FROM users WHERE joined_date >= datetime('now', '-30 day'))
+    ''',
+    'sent_mailings': '''
+        SELECT (SELECT COUNT(*) FROM sent_mailings WHERE status = 'sent'),
+               (SELECT COUNT(*) FROM sent_mailings WHERE status = 'failed')
+    ''',
+}
+SINGLE_PASS_COUNTS = {
+    'users': '''
+        SELECT COUNT(*),
+               SUM(CASE WHEN joined_date >= datetime('now', '-1 day') THEN 1 ELSE 0 END),
+               SUM(CASE WHEN joined_date >= datetime('now', '-7 day') THEN 1 ELSE 0 END),
+               SUM(CASE WHEN joined_date >= datetime('now', '-30 day') THEN 1 ELSE 0 END)
+        FROM users
+    ''',
+    'sent_mailings': '''
+        SELECT COALESCE(SUM(CASE WHEN status = 'sent' THEN 1 ELSE 0 END), 0),
+               COALESCE(SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END), 0)
+        FROM sent_mailings
+    ''',
+}
+
+
+def run_query(db: Database, sql: str):
+    with db.pool.read() as conn:
+        return tuple(conn.execute(sql).fetchone())
+
+
+def fill(db: Database, users: int, activity: int, mailings: int, deliveries: int):
+    """Заполнить базу: время равномерно за последние 90 дней"""
+    now = datetime.utcnow()
+    rnd = random.Random(42)
+
+    def ago():
+        return (now - timedelta(seconds=rnd.randrange(90 * 24 * 3600))).strftime('%Y-%m-%d %H:%M:%S')
+
+    with db.pool.write() as conn:
+        conn.executemany(
+            'INSERT INTO users (user_id, username, joined_date) VALUES (?, ?, ?)',
+            ((1000 + i, f'user{i}' if i % 3 else None, ago()) for i in range(users))
+        )
+        conn.executemany(
+            'INSERT INTO user_activity (user_id, action_type, timestamp) VALUES (?, ?, ?)',
+            ((1000 + rnd.randrange(users), rnd.choice(('start', 'message', 'callback')), ago())
+             for _ in range(activity))
+        )
+        conn.executemany(
+            'INSERT INTO mailings (title, media_type, sent_count, is_template) VALUES (?, ?, ?, ?)',
+            ((f'mailing {i}', rnd.choice((None, 'photo', 'video', 'document')),
+              rnd.randrange(users), i % 2) for i in range(mailings))
+        )
+        conn.executemany(
+            'INSERT INTO sent_mailings (mailing_id, user_id, status) VALUES (?, ?, ?)',
+            ((rnd.randrange(1, mailings + 1), 1000 + rnd.randrange(users),
+              'sent' if rnd.random() < 0.9 else 'failed') for _ in range(deliveries))
+        )
+        conn.execute('ANALYZE')
+
+
+def measure(func, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--activity', type=int, default=1000000)
+    parser.add_argument('--mailings', type=int, default=500)
+    parser.add_argument('--deliveries', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    pool = ConnectionPool(path)
+    db = Database(pool)
+    try:
+        started = time.perf_counter()
+        fill(db, args.users, args.activity, args.mailings, args.deliveries)
+        print(f'База заполнена за {time.perf_counter() - started:.1f} сек')
+
+        legacy_time, legacy = measure(lambda: legacy_detailed_stats(db), args.repeat)
+        current_time, current = measure(db.get_detailed_stats, args.repeat)
+        assert legacy == current, f'Результаты различаются:\n{legacy}\n{current}'
+
+        print(f'Прежняя реализация: {legacy_time * 1000:.1f} мс')
+        print(f'Текущая реализация: {current_time * 1000:.1f} мс')
+        print(f'Ускорение: x{legacy_time / current_time:.2f}')
+
+        for table in INDEX_COUNTS:
+            index_time, index_result = measure(lambda: run_query(db, INDEX_COUNTS[table]), args.repeat)
+            single_time, single_result = measure(lambda: run_query(db, SINGLE_PASS_COUNTS[table]), args.repeat)
+            assert index_result == single_result, f'{table}: {index_result} != {single_result}'
+            print(f'{table}: подзапросы по индексу {index_time * 1000:.1f} мс, '
+                  f'один проход SUM(CASE) {single_time * 1000:.1f} мс')
+    finally:
+        pool.close()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
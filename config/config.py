@@ -7,6 +7,56 @@ class Config:
     BOT_TOKEN = os.getenv('BOT_TOKEN')
     ADMIN_IDS = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',') if id.strip()]
     DATABASE_PATH = os.getenv('DATABASE_PATH', 'bot_database.db')
+    # Количество соединений на чтение в общем пуле
+    DB_READERS = int(os.getenv('DB_READERS', '4'))
+    # Пакетная запись активности: интервал сброса (сек) и размер пачки
+    ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '1.0'))
+    ACTIVITY_BATCH_SIZE = int(os.getenv('ACTIVITY_BATCH_SIZE', '500'))
+    # Как часто (сек) сохранять users.last_activity - допустимая задержка этого поля
+    LAST_ACTIVITY_WINDOW = float(os.getenv('LAST_ACTIVITY_WINDOW', '60'))
+    # Рассылки: общий лимит сообщений в секунду, интервал для одного чата (сек)
+    # и число параллельных воркеров отправки
+    MAILING_RATE_LIMIT = float(os.getenv('MAILING_RATE_LIMIT', '30'))
+    MAILING_PER_CHAT_INTERVAL = float(os.getenv('MAILING_PER_CHAT_INTERVAL', '1.0'))
+    MAILING_WORKERS = int(os.getenv('MAILING_WORKERS', '20'))
+    # Размер порции получателей при постраничном чтении аудитории
+    AUDIENCE_CHUNK_SIZE = int(os.getenv('AUDIENCE_CHUNK_SIZE', '1000'))
+    # Сколько секунд показывать размер аудитории из кэша
+    AUDIENCE_COUNT_TTL = float(os.getenv('AUDIENCE_COUNT_TTL', '30'))
+    # Индекс сегментов: как часто (сек) подхватывать новых пользователей и
+    # как часто перестраивать целиком
+    SEGMENT_INDEX_REFRESH = float(os.getenv('SEGMENT_INDEX_REFRESH', '60'))
+    SEGMENT_INDEX_REBUILD = float(os.getenv('SEGMENT_INDEX_REBUILD', '3600'))
+    # Снимки статистики для админ-панели: как часто (сек) пересчитывать и
+    # сколько дней хранить историю снимков
+    STATS_SNAPSHOT_INTERVAL = float(os.getenv('STATS_SNAPSHOT_INTERVAL', '60'))
+    STATS_SNAPSHOT_KEEP_DAYS = int(os.getenv('STATS_SNAPSHOT_KEEP_DAYS', '7'))
+    # Сколько дней хранить user_daily_activity (кто был активен в какой день):
+    # самые старые когорты удержания (90 дней) плюс D30 и запас
+    USER_DAILY_ACTIVITY_KEEP_DAYS = int(os.getenv('USER_DAILY_ACTIVITY_KEEP_DAYS', '125'))
+    # Скетчи активных пользователей (HyperLogLog): как часто (сек) сохранять
+    # и сколько дней хранить часовые и дневные скетчи
+    ACTIVE_USERS_SAVE_INTERVAL = float(os.getenv('ACTIVE_USERS_SAVE_INTERVAL', '60'))
+    ACTIVE_USERS_HOURLY_DAYS = int(os.getenv('ACTIVE_USERS_HOURLY_DAYS', '8'))
+    ACTIVE_USERS_DAILY_DAYS = int(os.getenv('ACTIVE_USERS_DAILY_DAYS', '90'))
+    # Топ активных пользователей (Space-Saving): счетчиков на день, сколько
+    # дней хранить и как часто (сек) сохранять
+    TOP_USERS_CAPACITY = int(os.getenv('TOP_USERS_CAPACITY', '1000'))
+    TOP_USERS_KEEP_DAYS = int(os.getenv('TOP_USERS_KEEP_DAYS', '31'))
+    TOP_USERS_SAVE_INTERVAL = float(os.getenv('TOP_USERS_SAVE_INTERVAL', '60'))
+    # Почасовые ряды активности для графиков: сколько дней хранить и как
+    # часто (сек) записывать DAU/WAU/MAU и сохранять ряды
+    TIMESERIES_DAYS = int(os.getenv('TIMESERIES_DAYS', '90'))
+    TIMESERIES_SAVE_INTERVAL = float(os.getenv('TIMESERIES_SAVE_INTERVAL', '60'))
+    # Как часто (сек) обновлять сообщение с прогрессом рассылки
+    MAILING_PROGRESS_INTERVAL = float(os.getenv('MAILING_PROGRESS_INTERVAL', '5'))
+    # Через сколько часов удалять неподтвержденные черновики списка получателей
+    MAILING_DRAFT_TTL = int(os.getenv('MAILING_DRAFT_TTL', '24'))
+    # Через сколько дней после завершения рассылки удалять ее список получателей
+    MAILING_RECIPIENTS_KEEP_DAYS = int(os.getenv('MAILING_RECIPIENTS_KEEP_DAYS', '7'))
+    # Пакетная запись результатов рассылки: интервал сброса (сек) и размер пачки
+    DELIVERY_FLUSH_INTERVAL = float(os.getenv('DELIVERY_FLUSH_INTERVAL', '1.0'))
+    DELIVERY_BATCH_SIZE = int(os.getenv('DELIVERY_BATCH_SIZE', '200'))
     
     @classmethod
     def validate_config(cls):
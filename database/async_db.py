@@ -0,0 +1,111 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config.config import Config
+from database.db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabase:
+    """Асинхронный доступ к Database без блокировки event loop.
+
+    Все запросы выполняются в потоках БД, поэтому медленный запрос
+    статистики не останавливает polling и идущие рассылки. Методы повторяют
+    API Database, только их нужно вызывать через await:
+
+        users = await db.get_all_users()
+
+    Синхронный Database остается доступен для скриптов и отчетов.
+    """
+
+    def __init__(self, db: Database = None):
+        self.db = db or Database()
+        # По потоку на каждое соединение пула: чтения идут параллельно,
+        # записи сериализуются блокировкой писателя
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.db.pool.readers + 1,
+            thread_name_prefix="database"
+        )
+        self._listeners = {}
+
+    def add_listener(self, event: str, callback):
+        """Подписаться на записи, важные для индексов в памяти.
+
+        callback вызывается в event loop после успешной записи:
+        - 'users' - callback(rows): пользователь добавлен или снова нажал
+          /start, rows - строки get_segment_index_rows;
+        - 'unreachable' - callback(user_ids): рассылка отметила пользователей
+          недоступными.
+        """
+        self._listeners.setdefault(event, []).append(callback)
+
+    def _notify(self, event: str, payload):
+        for callback in self._listeners.get(event, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика записи {event}: {e}")
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнить произвольную синхронную функцию в потоке БД"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _iter_chunks(self, fetch_chunk, *args, chunk_size=None):
+        """Постранично читать user_id через fetch_chunk(*args, after_user_id, limit)"""
+        chunk_size = chunk_size or Config.AUDIENCE_CHUNK_SIZE
+        after_user_id = 0
+        while True:
+            chunk = await self.run(fetch_chunk, *args, after_user_id, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            after_user_id = chunk[-1]
+
+    def iter_audience(self, audience_type, chunk_size=None, include_unreachable=False):
+        """Порции user_id аудитории - без загрузки всей таблицы users в память:
+
+            async for user_ids in db.iter_audience('all'):
+                ...
+        """
+        return self._iter_chunks(
+            functools.partial(self.db.fetch_audience_chunk, include_unreachable=include_unreachable),
+            audience_type, chunk_size=chunk_size
+        )
+
+    def iter_pending_recipients(self, job_id, chunk_size=None):
+        """Порции получателей задания, которым рассылка еще не отправлялась"""
+        return self._iter_chunks(self.db.fetch_pending_recipients_chunk, job_id, chunk_size=chunk_size)
+
+    async def add_user(self, user_id, username, first_name, last_name):
+        added = await self.run(self.db.add_user, user_id, username, first_name, last_name)
+        if added and self._listeners.get('users'):
+            self._notify('users', await self.run(self.db.get_segment_index_rows_by_user_ids, [user_id]))
+        return added
+
+    async def record_mailing_results(self, job_id, mailing_id, results):
+        await self.run(self.db.record_mailing_results, job_id, mailing_id, results)
+        unreachable = [user_id for user_id, _, _, reason in results if reason]
+        if unreachable:
+            self._notify('unreachable', unreachable)
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        # Кэшируем обертку, чтобы не создавать ее при каждом вызове
+        setattr(self, name, method)
+        return method
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.db.close()
@@ -1,562 +1,1047 @@
+import json
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from config.config import Config
+from database.pool import ConnectionPool
+from database.migrations import apply_migrations
+from database.segments import Segment, compile_audience
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Общий пул соединений процесса (создается при первом обращении)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(Config.DATABASE_PATH, readers=Config.DB_READERS)
+        return _pool
 
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect(Config.DATABASE_PATH, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
-        self.create_tables()
+    def __init__(self, pool: ConnectionPool = None):
+        self.pool = pool or get_pool()
+        # DDL выполняется один раз на пул, а не при каждом создании Database
+        if not self.pool.schema_ready:
+            self.create_tables()
+            self.pool.schema_ready = True
+        # Кэш размеров аудиторий: (sql, params) -> (expires_at, count)
+        self._audience_counts = {}
 
     def create_tables(self):
-        cursor = self.conn.cursor()
-        
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Обновленная таблица рассылок с поддержкой медиа и шаблонов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS mailings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT,
-                message_text TEXT,
-                message_type TEXT DEFAULT 'text',
-                media_type TEXT,
-                media_file_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                sent_count INTEGER DEFAULT 0,
-                audience_type TEXT DEFAULT 'all',
-                is_template BOOLEAN DEFAULT 1
-            )
-        ''')
-        
-        # Таблица отправленных рассылок
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sent_mailings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                mailing_id INTEGER,
-                user_id INTEGER,
-                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'sent',
-                FOREIGN KEY (mailing_id) REFERENCES mailings (id),
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Таблица активности пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_activity (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                action_type TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        self.conn.commit()
+        """Создать или обновить схему БД (см. database/migrations.py)"""
+        with self.pool.write() as conn:
+            apply_migrations(conn)
 
     def add_user(self, user_id, username, first_name, last_name):
-        cursor = self.conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name))
-            self.conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error adding user: {e}")
-            return False
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, username, first_name, last_name))
+                if cursor.rowcount == 1:
+                    cursor.execute('''
+                        INSERT INTO daily_signups (date, count) VALUES (date('now'), 1)
+                        ON CONFLICT (date) DO UPDATE SET count = count + 1
+                    ''')
+                # /start после блокировки - пользователь снова доступен для рассылок
+                cursor.execute('''
+                    UPDATE users
+                    SET is_reachable = 1, unreachable_reason = NULL, unreachable_at = NULL
+                    WHERE user_id = ? AND is_reachable = 0
+                ''', (user_id,))
+                return True
+            except Exception as e:
+                print(f"Error adding user: {e}")
+                return False
 
     def update_user_activity(self, user_id):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE users 
-            SET last_activity = CURRENT_TIMESTAMP 
-            WHERE user_id = ?
-        ''', (user_id,))
-        self.conn.commit()
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE users 
+                SET last_activity = CURRENT_TIMESTAMP 
+                WHERE user_id = ?
+            ''', (user_id,))
 
     def record_user_activity(self, user_id, action_type="message"):
         """Записать активность пользователя"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO user_activity (user_id, action_type)
-            VALUES (?, ?)
-        ''', (user_id, action_type))
-        self.update_user_activity(user_id)
-        self.conn.commit()
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO user_activity (user_id, action_type, timestamp)
+                VALUES (?, ?, ?)
+            ''', (user_id, action_type, timestamp))
+            cursor.execute('''
+                UPDATE users
+                SET last_activity = ?
+                WHERE user_id = ?
+            ''', (timestamp, user_id))
+            self._rollup_activity(cursor, [(user_id, action_type, timestamp)])
+
+    def _rollup_activity(self, cursor, events):
+        """Добавить события [(user_id, action_type, timestamp), ...] в агрегаты.
+
+        Выполняется в транзакции записи событий, поэтому daily_activity и
+        activity_heatmap всегда согласованы с user_activity.
+        """
+        days = {}
+        hours_of_week = {}
+        for user_id, action_type, timestamp in events:
+            day = days.setdefault(timestamp[:10], [0, set()])
+            day[0] += 1
+            day[1].add(user_id)
+            key = (action_type or 'message', timestamp[:10], int(timestamp[11:13]))
+            hours_of_week[key] = hours_of_week.get(key, 0) + 1
+
+        weekdays = {date: datetime.strptime(date, '%Y-%m-%d').weekday() for date in days}
+        cursor.executemany('''
+            INSERT INTO activity_heatmap (action_type, weekday, hour, count) VALUES (?, ?, ?, ?)
+            ON CONFLICT (action_type, weekday, hour) DO UPDATE SET count = count + excluded.count
+        ''', [(action_type, weekdays[date], hour, count)
+              for (action_type, date, hour), count in hours_of_week.items()])
+
+        for date, (actions, user_ids) in days.items():
+            # rowcount - сколько пользователей впервые активны в этот день
+            cursor.executemany(
+                'INSERT OR IGNORE INTO user_daily_activity (date, user_id) VALUES (?, ?)',
+                [(date, user_id) for user_id in user_ids]
+            )
+            cursor.execute('''
+                INSERT INTO daily_activity (date, actions, active_users) VALUES (?, ?, ?)
+                ON CONFLICT (date) DO UPDATE SET
+                    actions = actions + excluded.actions,
+                    active_users = active_users + excluded.active_users
+            ''', (date, actions, cursor.rowcount))
+
+    def record_activity_batch(self, events, last_seen=()):
+        """Записать пачку событий одной транзакцией.
+
+        events - [(user_id, action_type, timestamp), ...]
+        last_seen - [(timestamp, user_id), ...] для users.last_activity
+        """
+        if not events and not last_seen:
+            return
+
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO user_activity (user_id, action_type, timestamp)
+                VALUES (?, ?, ?)
+            ''', events)
+            self._rollup_activity(cursor, events)
+            # Время только сдвигается вперед, даже если обновления пришли не по порядку
+            cursor.executemany('''
+                UPDATE users
+                SET last_activity = ?1
+                WHERE user_id = ?2 AND (last_activity IS NULL OR last_activity < ?1)
+            ''', last_seen)
+            # Пользователь пишет боту - значит, снова его не блокирует
+            cursor.executemany('''
+                UPDATE users
+                SET is_reachable = 1, unreachable_reason = NULL, unreachable_at = NULL
+                WHERE user_id = ?2 AND is_reachable = 0 AND unreachable_at < ?1
+            ''', last_seen)
 
     def get_all_users(self):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM users ORDER BY joined_date DESC')
-        return [dict(row) for row in cursor.fetchall()]
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users ORDER BY joined_date DESC')
+            return [dict(row) for row in cursor.fetchall()]
 
     def get_user_count(self):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM users')
-        return cursor.fetchone()[0]
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM users')
+            return cursor.fetchone()[0]
 
-    def get_users_by_audience(self, audience_type):
-        cursor = self.conn.cursor()
-        
-        if audience_type == 'all':
-            cursor.execute('SELECT * FROM users')
-        elif audience_type == 'active_week':
-            cursor.execute('''
-                SELECT DISTINCT u.* FROM users u
-                JOIN user_activity ua ON u.user_id = ua.user_id
-                WHERE ua.timestamp >= datetime('now', '-7 days')
-            ''')
-        elif audience_type == 'new_today':
-            cursor.execute('''
-                SELECT * FROM users 
-                WHERE joined_date >= datetime('now', '-1 day')
-            ''')
-        elif audience_type == 'new_week':
-            cursor.execute('''
-                SELECT * FROM users 
-                WHERE joined_date >= datetime('now', '-7 days')
-            ''')
-        else:
+    def get_users_by_audience(self, audience_type, include_unreachable=False):
+        where = compile_audience(audience_type, include_unreachable)
+        if where is None:
             return []
-            
-        return [dict(row) for row in cursor.fetchall()]
+        condition, params = where
+
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT u.* FROM users u WHERE {condition}', params)
+            return [dict(row) for row in cursor.fetchall()]
 
-    def get_audience_count(self, audience_type):
-        users = self.get_users_by_audience(audience_type)
-        return len(users)
+    def fetch_audience_chunk(self, audience_type, after_user_id=0, limit=1000, include_unreachable=False):
+        """Следующая порция user_id аудитории (keyset-пагинация по user_id).
+
+        Возвращает только id, отсортированные по возрастанию; следующую
+        порцию запрашивают с after_user_id = последнему id предыдущей.
+        """
+        where = compile_audience(audience_type, include_unreachable)
+        if where is None:
+            return []
+        condition, params = where
+
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT u.user_id FROM users u
+                WHERE u.user_id > ? AND ({condition})
+                ORDER BY u.user_id
+                LIMIT ?
+            """, (after_user_id, *params, limit))
+            return [row[0] for row in cursor.fetchall()]
+
+    def get_audience_count(self, audience_type, include_unreachable=False):
+        """Размер аудитории одним COUNT(*) с кэшем на AUDIENCE_COUNT_TTL секунд"""
+        where = compile_audience(audience_type, include_unreachable)
+        if where is None:
+            return 0
+        return self._count_where(*where)
+
+    def count_segment(self, segment: Segment, include_unreachable=False):
+        """Размер произвольного сегмента (см. database/segments.py) без выборки строк"""
+        return self._count_where(*segment.compile(include_unreachable))
+
+    def _count_where(self, condition, params):
+        key = (condition, params)
+        cached = self._audience_counts.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT COUNT(*) FROM users u WHERE {condition}', params)
+            count = cursor.fetchone()[0]
+
+        self._audience_counts[key] = (time.monotonic() + Config.AUDIENCE_COUNT_TTL, count)
+        return count
 
     def save_mailing(self, title, message_text, message_type='text', media_type=None, media_file_id=None, audience_type='all', is_template=True):
         """Сохранить рассылку с медиа"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO mailings (title, message_text, message_type, media_type, media_file_id, audience_type, is_template)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (title, message_text, message_type, media_type, media_file_id, audience_type, is_template))
-        self.conn.commit()
-        return cursor.lastrowid
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO mailings (title, message_text, message_type, media_type, media_file_id, audience_type, is_template)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (title, message_text, message_type, media_type, media_file_id, audience_type, is_template))
+            return cursor.lastrowid
 
     def update_mailing_stats(self, mailing_id, sent_count):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE mailings 
-            SET sent_count = ? 
-            WHERE id = ?
-        ''', (sent_count, mailing_id))
-        self.conn.commit()
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE mailings 
+                SET sent_count = ? 
+                WHERE id = ?
+            ''', (sent_count, mailing_id))
 
     def get_mailing_stats(self, mailing_id):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT COUNT(*) FROM sent_mailings 
-            WHERE mailing_id = ? AND status = 'sent'
-        ''', (mailing_id,))
-        return cursor.fetchone()[0]
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*) FROM sent_mailings 
+                WHERE mailing_id = ? AND status = 'sent'
+            ''', (mailing_id,))
+            return cursor.fetchone()[0]
 
     def record_sent_mailing(self, mailing_id, user_id, status='sent'):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO sent_mailings (mailing_id, user_id, status)
-            VALUES (?, ?, ?)
-        ''', (mailing_id, user_id, status))
-        self.conn.commit()
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO sent_mailings (mailing_id, user_id, status)
+                VALUES (?, ?, ?)
+            ''', (mailing_id, user_id, status))
 
     def get_all_mailings(self):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT m.*, 
-                   COUNT(CASE WHEN sm.status = 'sent' THEN 1 END) as delivered_count 
-            FROM mailings m 
-            LEFT JOIN sent_mailings sm ON m.id = sm.mailing_id 
-            GROUP BY m.id 
-            ORDER BY m.created_at DESC
-        ''')
-        return [dict(row) for row in cursor.fetchall()]
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT m.*, 
+                       COUNT(CASE WHEN sm.status = 'sent' THEN 1 END) as delivered_count 
+                FROM mailings m 
+                LEFT JOIN sent_mailings sm ON m.id = sm.mailing_id 
+                GROUP BY m.id 
+                ORDER BY m.created_at DESC
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
 
     def get_mailing_by_id(self, mailing_id):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM mailings WHERE id = ?', (mailing_id,))
-        result = cursor.fetchone()
-        return dict(result) if result else None
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM mailings WHERE id = ?', (mailing_id,))
+            result = cursor.fetchone()
+            return dict(result) if result else None
 
     def get_all_templates(self):
         """Получить все шаблоны рассылок"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM mailings 
-            WHERE is_template = 1 
-            ORDER BY created_at DESC
-        ''')
-        return [dict(row) for row in cursor.fetchall()]
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM mailings 
+                WHERE is_template = 1 
+                ORDER BY created_at DESC
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
 
     def get_template_by_id(self, template_id):
         """Получить шаблон по ID"""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM mailings WHERE id = ? AND is_template = 1', (template_id,))
-        result = cursor.fetchone()
-        return dict(result) if result else None
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM mailings WHERE id = ? AND is_template = 1', (template_id,))
+            result = cursor.fetchone()
+            return dict(result) if result else None
 
     def update_template_status(self, template_id, is_template):
         """Обновить статус шаблона"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE mailings 
-            SET is_template = ? 
-            WHERE id = ?
-        ''', (is_template, template_id))
-        self.conn.commit()
-
-    def get_detailed_stats(self):
-        cursor = self.conn.cursor()
-        
-        # Общее количество пользователей
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        # Новые пользователи за разные периоды
-        cursor.execute('''
-            SELECT COUNT(*) FROM users 
-            WHERE joined_date >= datetime('now', '-1 day')
-        ''')
-        new_users_today = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM users 
-            WHERE joined_date >= datetime('now', '-7 day')
-        ''')
-        new_users_week = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM users 
-            WHERE joined_date >= datetime('now', '-30 day')
-        ''')
-        new_users_month = cursor.fetchone()[0]
-        
-        # Активные пользователи (которые проявляли активность в последние 7 дней)
-        cursor.execute('''
-            SELECT COUNT(DISTINCT user_id) FROM user_activity 
-            WHERE timestamp >= datetime('now', '-7 day')
-        ''')
-        active_users_week = cursor.fetchone()[0]
-        
-        # Пользователи с активностью за последние 24 часа
-        cursor.execute('''
-            SELECT COUNT(DISTINCT user_id) FROM user_activity 
-            WHERE timestamp >= datetime('now', '-1 day')
-        ''')
-        active_users_today = cursor.fetchone()[0]
-        
-        # Статистика по рассылкам
-        cursor.execute('SELECT COUNT(*) FROM mailings')
-        total_mailings = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT SUM(sent_count) FROM mailings')
-        total_sent_messages = cursor.fetchone()[0] or 0
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE mailings 
+                SET is_template = ? 
+                WHERE id = ?
+            ''', (is_template, template_id))
+
+    def get_detailed_stats(self, active_counts=None):
+        """Сводная статистика для дашборда, экранов статистики и отчета.
+
+        По одному обращению к базе на таблицу вместо запроса на каждую цифру.
+        Однопроходные агрегаты - только user_activity (неделя читается один
+        раз, активные за день - через COUNT(DISTINCT CASE ...)) и mailings
+        (один GROUP BY). По users и sent_mailings это по-прежнему отдельный
+        подсчет по диапазону индекса на каждую цифру, объединенный в один
+        SELECT: он быстрее прохода по таблице с SUM(CASE ...). Замеры обоих
+        вариантов - benchmarks/bench_detailed_stats.py.
+
+        active_counts - оценки активных пользователей {'day', 'week', ...}
+        (services/active_users.py); с ними COUNT(DISTINCT) не выполняется.
+        Без них (отчеты) числа точные.
+        """
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
         
-        # Статистика по шаблонам
-        cursor.execute('SELECT COUNT(*) FROM mailings WHERE is_template = 1')
-        total_templates = cursor.fetchone()[0]
+            # Пользователи: всего и новые за день / неделю / месяц. Каждый подсчет -
+            # поиск по покрывающему индексу joined_date, это быстрее одного
+            # прохода с SUM(условие) по всей таблице
+            cursor.execute('''
+                SELECT (SELECT COUNT(*) FROM users),
+                       (SELECT COUNT(*) FROM users WHERE joined_date >= datetime('now', '-1 day')),
+                       (SELECT COUNT(*) FROM users WHERE joined_date >= datetime('now', '-7 day')),
+                       (SELECT COUNT(*) FROM users WHERE joined_date >= datetime('now', '-30 day'))
+            ''')
+            total_users, new_users_today, new_users_week, new_users_month = cursor.fetchone()
         
-        # Статистика доставки
-        cursor.execute('SELECT COUNT(*) FROM sent_mailings WHERE status = "sent"')
-        successful_deliveries = cursor.fetchone()[0]
+            if active_counts:
+                # Только число действий за неделю - подсчет по диапазону индекса
+                cursor.execute('''
+                    SELECT COUNT(*) FROM user_activity WHERE timestamp >= datetime('now', '-7 day')
+                ''')
+                actions_week = cursor.fetchone()[0]
+                active_users_week, active_users_today = active_counts['week'], active_counts['day']
+            else:
+                # Активность за неделю (по индексу timestamp): активные за неделю и
+                # за сутки, число действий для средней активности
+                cursor.execute('''
+                    SELECT COUNT(DISTINCT user_id),
+                           COUNT(DISTINCT CASE WHEN timestamp >= (SELECT datetime('now', '-1 day'))
+                                               THEN user_id END),
+                           COUNT(*)
+                    FROM user_activity 
+                    WHERE timestamp >= datetime('now', '-7 day')
+                ''')
+                active_users_week, active_users_today, actions_week = cursor.fetchone()
+            avg_activity_per_user = round(actions_week / active_users_week, 2) if active_users_week else 0
         
-        cursor.execute('SELECT COUNT(*) FROM sent_mailings WHERE status = "failed"')
-        failed_deliveries = cursor.fetchone()[0]
+            # Рассылки: итоги и типы медиа за один GROUP BY
+            cursor.execute('''
+                SELECT media_type, COUNT(*) as count,
+                       SUM(sent_count) as sent, SUM(is_template = 1) as templates
+                FROM mailings 
+                GROUP BY media_type
+            ''')
+            media_stats = cursor.fetchall()
+            total_mailings = sum(row['count'] for row in media_stats)
+            total_sent_messages = sum(row['sent'] or 0 for row in media_stats)
+            total_templates = sum(row['templates'] or 0 for row in media_stats)
+            media_type_stats = {row['media_type']: row['count'] for row in media_stats
+                                if row['media_type'] is not None}
         
-        # Средняя активность пользователей
-        cursor.execute('''
-            SELECT 
-                CASE 
-                    WHEN COUNT(DISTINCT user_id) > 0 THEN 
-                        CAST(COUNT(*) AS FLOAT) / COUNT(DISTINCT user_id)
-                    ELSE 0
-                END as avg_activity 
-            FROM user_activity 
-            WHERE timestamp >= datetime('now', '-7 day')
-        ''')
-        avg_activity_result = cursor.fetchone()
-        avg_activity_per_user = round(avg_activity_result[0], 2) if avg_activity_result and avg_activity_result[0] else 0
-
-        # Статистика по типам медиа в рассылках
-        cursor.execute('''
-            SELECT media_type, COUNT(*) as count 
-            FROM mailings 
-            WHERE media_type IS NOT NULL 
-            GROUP BY media_type
-        ''')
-        media_stats = cursor.fetchall()
-        media_type_stats = {row['media_type']: row['count'] for row in media_stats}
+            # Статистика доставки (по индексу status)
+            cursor.execute('''
+                SELECT (SELECT COUNT(*) FROM sent_mailings WHERE status = 'sent'),
+                       (SELECT COUNT(*) FROM sent_mailings WHERE status = 'failed')
+            ''')
+            successful_deliveries, failed_deliveries = cursor.fetchone()
 
-        return {
-            'total_users': total_users,
-            'new_users_today': new_users_today,
-            'new_users_week': new_users_week,
-            'new_users_month': new_users_month,
-            'active_users_week': active_users_week,
-            'active_users_today': active_users_today,
-            'total_mailings': total_mailings,
-            'total_templates': total_templates,
-            'total_sent_messages': total_sent_messages,
-            'successful_deliveries': successful_deliveries,
-            'failed_deliveries': failed_deliveries,
-            'avg_activity_per_user': avg_activity_per_user,
-            'media_type_stats': media_type_stats
-        }
+            return {
+                'total_users': total_users,
+                'new_users_today': new_users_today,
+                'new_users_week': new_users_week,
+                'new_users_month': new_users_month,
+                'active_users_week': active_users_week,
+                'active_users_today': active_users_today,
+                'total_mailings': total_mailings,
+                'total_templates': total_templates,
+                'total_sent_messages': total_sent_messages,
+                'successful_deliveries': successful_deliveries,
+                'failed_deliveries': failed_deliveries,
+                'avg_activity_per_user': avg_activity_per_user,
+                'media_type_stats': media_type_stats
+            }
 
     def get_user_growth_data(self, days=30):
-        """Получить данные о росте пользователей за период"""
-        cursor = self.conn.cursor()
-        cursor.execute(f'''
-            SELECT date(joined_date) as date, COUNT(*) as count 
-            FROM users 
-            WHERE joined_date >= datetime('now', '-{days} day')
-            GROUP BY date(joined_date)
-            ORDER BY date
-        ''')
-        return cursor.fetchall()
+        """Получить данные о росте пользователей за период (из дневных агрегатов)"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT date, count
+                FROM daily_signups
+                WHERE date >= date('now', ?)
+                ORDER BY date
+            ''', (f'-{days} day',))
+            return cursor.fetchall()
 
     def get_activity_data(self, days=7):
-        """Получить данные об активности пользователей за период"""
-        cursor = self.conn.cursor()
-        cursor.execute(f'''
-            SELECT date(timestamp) as date, COUNT(*) as activity_count 
-            FROM user_activity 
-            WHERE timestamp >= datetime('now', '-{days} day')
-            GROUP BY date(timestamp)
-            ORDER BY date
-        ''')
-        return cursor.fetchall()
+        """Получить данные об активности пользователей за период (из дневных агрегатов)"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT date, actions as activity_count
+                FROM daily_activity
+                WHERE date >= date('now', ?)
+                ORDER BY date
+            ''', (f'-{days} day',))
+            return cursor.fetchall()
 
     def get_top_active_users(self, limit=10):
         """Получить самых активных пользователей"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT u.user_id, u.username, u.first_name, COUNT(ua.id) as activity_count
-            FROM users u
-            JOIN user_activity ua ON u.user_id = ua.user_id
-            WHERE ua.timestamp >= datetime('now', '-30 day')
-            GROUP BY u.user_id
-            ORDER BY activity_count DESC
-            LIMIT ?
-        ''', (limit,))
-        return [dict(row) for row in cursor.fetchall()]
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT u.user_id, u.username, u.first_name, COUNT(ua.id) as activity_count
+                FROM users u
+                JOIN user_activity ua ON u.user_id = ua.user_id
+                WHERE ua.timestamp >= datetime('now', '-30 day')
+                GROUP BY u.user_id
+                ORDER BY activity_count DESC
+                LIMIT ?
+            ''', (limit,))
+            return [dict(row) for row in cursor.fetchall()]
 
     def get_mailing_performance(self):
         """Получить статистику эффективности рассылок"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT 
-                m.id,
-                m.title,
-                m.message_type,
-                m.media_type,
-                m.created_at,
-                m.sent_count,
-                COUNT(CASE WHEN sm.status = 'sent' THEN 1 END) as delivered_count,
-                CASE 
-                    WHEN m.sent_count > 0 THEN 
-                        ROUND((COUNT(CASE WHEN sm.status = 'sent' THEN 1 END) * 100.0 / m.sent_count), 2)
-                    ELSE 0
-                END as delivery_rate
-            FROM mailings m
-            LEFT JOIN sent_mailings sm ON m.id = sm.mailing_id
-            GROUP BY m.id
-            ORDER BY m.created_at DESC
-        ''')
-        return [dict(row) for row in cursor.fetchall()]
-
-    def get_user_segments(self):
-        """Получить сегменты пользователей для маркетинга"""
-        cursor = self.conn.cursor()
-        
-        # Новые пользователи (последние 7 дней)
-        cursor.execute('SELECT COUNT(*) FROM users WHERE joined_date >= datetime("now", "-7 days")')
-        new_users = cursor.fetchone()[0]
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    m.id,
+                    m.title,
+                    m.message_type,
+                    m.media_type,
+                    m.created_at,
+                    m.sent_count,
+                    COUNT(CASE WHEN sm.status = 'sent' THEN 1 END) as delivered_count,
+                    CASE 
+                        WHEN m.sent_count > 0 THEN 
+                            ROUND((COUNT(CASE WHEN sm.status = 'sent' THEN 1 END) * 100.0 / m.sent_count), 2)
+                        ELSE 0
+                    END as delivery_rate
+                FROM mailings m
+                LEFT JOIN sent_mailings sm ON m.id = sm.mailing_id
+                GROUP BY m.id
+                ORDER BY m.created_at DESC
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_user_segments(self, active_counts=None):
+        """Получить сегменты пользователей для маркетинга.
+
+        active_counts - см. get_detailed_stats: активные и неактивные
+        пользователи считаются по оценкам {'week', 'month'} без чтения user_activity.
+        """
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
         
-        # Активные пользователи (активность в последние 7 дней)
-        cursor.execute('SELECT COUNT(DISTINCT user_id) FROM user_activity WHERE timestamp >= datetime("now", "-7 days")')
-        active_users = cursor.fetchone()[0]
+            # Новые пользователи (последние 7 дней)
+            cursor.execute('SELECT COUNT(*) FROM users WHERE joined_date >= datetime("now", "-7 days")')
+            new_users = cursor.fetchone()[0]
         
-        # Неактивные пользователи (нет активности 30+ дней)
-        cursor.execute('''
-            SELECT COUNT(*) FROM users 
-            WHERE user_id NOT IN (
-                SELECT DISTINCT user_id FROM user_activity 
-                WHERE timestamp >= datetime("now", "-30 days")
-            )
-        ''')
-        inactive_users = cursor.fetchone()[0]
+            cursor.execute('SELECT COUNT(*) FROM users')
+            total_users = cursor.fetchone()[0]
         
-        # Пользователи с username
-        cursor.execute('SELECT COUNT(*) FROM users WHERE username IS NOT NULL AND username != ""')
-        users_with_username = cursor.fetchone()[0]
+            if active_counts:
+                active_users = active_counts['week']
+                inactive_users = max(total_users - active_counts['month'], 0)
+            else:
+                # Активные пользователи (активность в последние 7 дней)
+                cursor.execute('SELECT COUNT(DISTINCT user_id) FROM user_activity WHERE timestamp >= datetime("now", "-7 days")')
+                active_users = cursor.fetchone()[0]
+            
+                # Неактивные пользователи (нет активности 30+ дней)
+                cursor.execute('''
+                    SELECT COUNT(*) FROM users 
+                    WHERE user_id NOT IN (
+                        SELECT DISTINCT user_id FROM user_activity 
+                        WHERE timestamp >= datetime("now", "-30 days")
+                    )
+                ''')
+                inactive_users = cursor.fetchone()[0]
         
-        total_users = self.get_user_count()
+            # Пользователи с username
+            cursor.execute('SELECT COUNT(*) FROM users WHERE username IS NOT NULL AND username != ""')
+            users_with_username = cursor.fetchone()[0]
         
+            return {
+                'new_users': new_users,
+                'active_users': active_users,
+                'inactive_users': inactive_users,
+                'users_with_username': users_with_username,
+                'users_without_username': total_users - users_with_username
+            }
+
+    def build_stats_snapshot(self, active_counts=None):
+        """Вся статистика админ-панели одним словарем (для stats_snapshots)"""
         return {
-            'new_users': new_users,
-            'active_users': active_users,
-            'inactive_users': inactive_users,
-            'users_with_username': users_with_username,
-            'users_without_username': total_users - users_with_username
+            'stats': self.get_detailed_stats(active_counts),
+            'activity': [list(row) for row in self.get_activity_data(30)],
+            'growth': [list(row) for row in self.get_user_growth_data(30)],
+            'segments': self.get_user_segments(active_counts),
         }
 
+    def save_stats_snapshot(self, data, keep_days=None):
+        """Сохранить снимок статистики и удалить снимки старше keep_days дней.
+
+        Заодно по тому же расписанию чистится user_daily_activity - кто был
+        активен в какой день нужен только за USER_DAILY_ACTIVITY_KEEP_DAYS
+        дней (удержание когорт и первое заполнение скетчей).
+        Возвращает created_at нового снимка.
+        """
+        keep_days = keep_days or Config.STATS_SNAPSHOT_KEEP_DAYS
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT INTO stats_snapshots (data) VALUES (?)', (json.dumps(data),))
+            snapshot_id = cursor.lastrowid
+            cursor.execute(
+                "DELETE FROM stats_snapshots WHERE created_at < datetime('now', ?)",
+                (f'-{keep_days} days',)
+            )
+            # Диапазон по первичному ключу (date, user_id) - без прохода по таблице
+            cursor.execute(
+                "DELETE FROM user_daily_activity WHERE date < date('now', ?)",
+                (f'-{Config.USER_DAILY_ACTIVITY_KEEP_DAYS} days',)
+            )
+            cursor.execute('SELECT created_at FROM stats_snapshots WHERE id = ?', (snapshot_id,))
+            return cursor.fetchone()[0]
+
+    def get_latest_stats_snapshot(self):
+        """(created_at, data) последнего снимка или None"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT created_at, data FROM stats_snapshots ORDER BY id DESC LIMIT 1')
+            row = cursor.fetchone()
+            return (row['created_at'], json.loads(row['data'])) if row else None
+
+    def get_activity_sketches(self):
+        """[(period, bucket, registers), ...] - скетчи активных пользователей"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT period, bucket, registers FROM activity_sketches')
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def save_activity_sketches(self, rows, hourly_before, daily_before):
+        """Сохранить скетчи [(period, bucket, registers), ...] и удалить устаревшие"""
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO activity_sketches (period, bucket, registers) VALUES (?, ?, ?)
+                ON CONFLICT (period, bucket) DO UPDATE SET
+                    registers = excluded.registers, updated_at = CURRENT_TIMESTAMP
+            ''', rows)
+            cursor.execute("DELETE FROM activity_sketches WHERE period = 'hour' AND bucket < ?", (hourly_before,))
+            cursor.execute("DELETE FROM activity_sketches WHERE period = 'day' AND bucket < ?", (daily_before,))
+
+    def get_hourly_active_users(self, since):
+        """[('YYYY-MM-DD HH', user_id), ...] без повторов - активность начиная с since (UTC)"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute('''
+                SELECT DISTINCT substr(timestamp, 1, 13), user_id
+                FROM user_activity
+                WHERE timestamp >= ?
+            ''', (since,))
+            return cursor.fetchall()
+
+    def get_daily_active_users(self, since):
+        """[('YYYY-MM-DD', user_id), ...] - кто был активен по дням начиная с since"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute('SELECT date, user_id FROM user_daily_activity WHERE date >= ?', (since,))
+            return cursor.fetchall()
+
+    def get_top_users_sketches(self):
+        """([(date, data), ...], through) - сводки топа активных пользователей"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT date, data FROM top_users_sketches')
+            rows = [tuple(row) for row in cursor.fetchall()]
+            cursor.execute('SELECT MAX(through) FROM top_users_sketches')
+            return rows, cursor.fetchone()[0]
+
+    def save_top_users_sketches(self, rows, through, before):
+        """Сохранить сводки [(date, data), ...] и удалить сводки раньше before"""
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO top_users_sketches (date, data, through) VALUES (?, ?, ?)
+                ON CONFLICT (date) DO UPDATE SET data = excluded.data, through = excluded.through
+            ''', [(date, data, through) for date, data in rows])
+            cursor.execute('DELETE FROM top_users_sketches WHERE date < ?', (before,))
+
+    def get_activity_counts_after(self, since):
+        """([(date, user_id, count), ...], время последнего события) для событий позже since"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute('''
+                SELECT substr(timestamp, 1, 10), user_id, COUNT(*)
+                FROM user_activity
+                WHERE timestamp > ?
+                GROUP BY 1, 2
+            ''', (since,))
+            counts = cursor.fetchall()
+            cursor.execute('SELECT MAX(timestamp) FROM user_activity WHERE timestamp > ?', (since,))
+            return counts, cursor.fetchone()[0]
+
+    def get_activity_heatmap(self):
+        """[(action_type, weekday, hour, count), ...] - действия по часу недели (UTC)"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute('SELECT action_type, weekday, hour, count FROM activity_heatmap')
+            return cursor.fetchall()
+
+    def get_timeseries(self):
+        """[(metric, head, data), ...] - сохраненные почасовые ряды активности"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute('SELECT metric, head, data FROM timeseries')
+            return cursor.fetchall()
+
+    def save_timeseries(self, rows):
+        """Сохранить ряды [(metric, head, data), ...]"""
+        with self.pool.write() as conn:
+            conn.executemany('''
+                INSERT INTO timeseries (metric, head, data) VALUES (?, ?, ?)
+                ON CONFLICT (metric) DO UPDATE SET
+                    head = excluded.head, data = excluded.data, updated_at = CURRENT_TIMESTAMP
+            ''', rows)
+
+    def get_hourly_action_counts(self, since):
+        """[('YYYY-MM-DD HH', число действий), ...] начиная с since (UTC)"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute('''
+                SELECT substr(timestamp, 1, 13), COUNT(*)
+                FROM user_activity
+                WHERE timestamp >= ?
+                GROUP BY 1
+            ''', (since,))
+            return cursor.fetchall()
+
+    def get_users_by_ids(self, user_ids):
+        """[{'user_id', 'username', 'first_name'}, ...] для списка user_id"""
+        user_ids = list(user_ids)
+        result = []
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            # Порциями - у SQLite ограничено число параметров запроса
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                cursor.execute(f'''
+                    SELECT user_id, username, first_name FROM users
+                    WHERE user_id IN ({', '.join('?' * len(chunk))})
+                ''', chunk)
+                result.extend(dict(row) for row in cursor.fetchall())
+        return result
+
+    # Строка индекса сегментов: (id, user_id, username, joined, is_reachable, last_active)
+    SEGMENT_INDEX_COLUMNS = '''
+        SELECT u.id, u.user_id, u.username,
+               CAST(strftime('%s', u.joined_date) AS INTEGER),
+               u.is_reachable,
+               CAST(strftime('%s', (
+                   SELECT MAX(ua.timestamp) FROM user_activity ua WHERE ua.user_id = u.user_id
+               )) AS INTEGER)
+        FROM users u
+    '''
+
+    def get_segment_index_rows(self, after_id=0):
+        """Данные для индекса сегментов (services/segment_index.py).
+
+        [(id, user_id, username, joined, is_reachable, last_active), ...],
+        время - unix timestamp; after_id - только пользователи с users.id > after_id
+        """
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.SEGMENT_INDEX_COLUMNS + ' WHERE u.id > ? ORDER BY u.id', (after_id,))
+            return cursor.fetchall()
+
+    def get_segment_index_rows_by_user_ids(self, user_ids):
+        """То же, что get_segment_index_rows, для списка telegram id"""
+        user_ids = list(user_ids)
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self.SEGMENT_INDEX_COLUMNS + f" WHERE u.user_id IN ({', '.join('?' * len(user_ids))})",
+                user_ids
+            )
+            return cursor.fetchall()
+
     def get_user_messages_stats(self, user_id):
         """Получить статистику сообщений пользователя"""
-        cursor = self.conn.cursor()
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
         
-        # Общее количество сообщений
-        cursor.execute('''
-            SELECT COUNT(*) FROM user_activity 
-            WHERE user_id = ? AND action_type = 'message'
-        ''', (user_id,))
-        total_messages = cursor.fetchone()[0]
+            # Общее количество сообщений
+            cursor.execute('''
+                SELECT COUNT(*) FROM user_activity 
+                WHERE user_id = ? AND action_type = 'message'
+            ''', (user_id,))
+            total_messages = cursor.fetchone()[0]
         
-        # Сообщения за последние 7 дней
-        cursor.execute('''
-            SELECT COUNT(*) FROM user_activity 
-            WHERE user_id = ? AND action_type = 'message' 
-            AND timestamp >= datetime('now', '-7 days')
-        ''', (user_id,))
-        recent_messages = cursor.fetchone()[0]
+            # Сообщения за последние 7 дней
+            cursor.execute('''
+                SELECT COUNT(*) FROM user_activity 
+                WHERE user_id = ? AND action_type = 'message' 
+                AND timestamp >= datetime('now', '-7 days')
+            ''', (user_id,))
+            recent_messages = cursor.fetchone()[0]
         
-        # Первое и последнее сообщение
-        cursor.execute('''
-            SELECT MIN(timestamp), MAX(timestamp) FROM user_activity 
-            WHERE user_id = ? AND action_type = 'message'
-        ''', (user_id,))
-        first_last = cursor.fetchone()
+            # Первое и последнее сообщение
+            cursor.execute('''
+                SELECT MIN(timestamp), MAX(timestamp) FROM user_activity 
+                WHERE user_id = ? AND action_type = 'message'
+            ''', (user_id,))
+            first_last = cursor.fetchone()
         
-        return {
-            'total_messages': total_messages,
-            'recent_messages': recent_messages,
-            'first_message': first_last[0] if first_last else None,
-            'last_message': first_last[1] if first_last else None
-        }
+            return {
+                'total_messages': total_messages,
+                'recent_messages': recent_messages,
+                'first_message': first_last[0] if first_last else None,
+                'last_message': first_last[1] if first_last else None
+            }
 
     def get_daily_stats(self, date=None):
         """Получить статистику за конкретный день"""
         if date is None:
-            date = datetime.now().strftime('%Y-%m-%d')
+            # Агрегаты ведутся по дням UTC
+            date = datetime.now(timezone.utc).strftime('%Y-%m-%d')
             
-        cursor = self.conn.cursor()
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
         
-        # Новые пользователи за день
-        cursor.execute('''
-            SELECT COUNT(*) FROM users 
-            WHERE date(joined_date) = ?
-        ''', (date,))
-        new_users = cursor.fetchone()[0]
-        
-        # Активные пользователи за день
-        cursor.execute('''
-            SELECT COUNT(DISTINCT user_id) FROM user_activity 
-            WHERE date(timestamp) = ?
-        ''', (date,))
-        active_users = cursor.fetchone()[0]
+            # Новые пользователи за день
+            cursor.execute('SELECT count FROM daily_signups WHERE date = ?', (date,))
+            row = cursor.fetchone()
+            new_users = row[0] if row else 0
         
-        # Количество действий за день
-        cursor.execute('''
-            SELECT COUNT(*) FROM user_activity 
-            WHERE date(timestamp) = ?
-        ''', (date,))
-        total_actions = cursor.fetchone()[0]
+            # Активные пользователи и количество действий за день
+            cursor.execute('SELECT active_users, actions FROM daily_activity WHERE date = ?', (date,))
+            row = cursor.fetchone()
+            active_users, total_actions = (row[0], row[1]) if row else (0, 0)
         
-        return {
-            'date': date,
-            'new_users': new_users,
-            'active_users': active_users,
-            'total_actions': total_actions
-        }
+            return {
+                'date': date,
+                'new_users': new_users,
+                'active_users': active_users,
+                'total_actions': total_actions
+            }
 
-    def get_retention_data(self, cohort_days=30):
-        """Получить данные по удержанию пользователей"""
-        cursor = self.conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                date(joined_date) as cohort_date,
-                COUNT(*) as cohort_size,
-                COUNT(CASE WHEN EXISTS (
-                    SELECT 1 FROM user_activity 
-                    WHERE user_id = users.user_id 
-                    AND date(timestamp) = date(users.joined_date, '+1 day')
-                ) THEN 1 END) as day_1_active,
-                COUNT(CASE WHEN EXISTS (
-                    SELECT 1 FROM user_activity 
-                    WHERE user_id = users.user_id 
-                    AND date(timestamp) = date(users.joined_date, '+7 day')
-                ) THEN 1 END) as day_7_active,
-                COUNT(CASE WHEN EXISTS (
-                    SELECT 1 FROM user_activity 
-                    WHERE user_id = users.user_id 
-                    AND date(timestamp) = date(users.joined_date, '+30 day')
-                ) THEN 1 END) as day_30_active
-            FROM users
-            WHERE joined_date >= datetime('now', '-? day')
-            GROUP BY date(joined_date)
-            ORDER BY cohort_date DESC
-        ''', (cohort_days,))
-        
-        return [dict(row) for row in cursor.fetchall()]
+    def get_retention_rows(self, cohort_days: int):
+        """Данные для расчета удержания (services/retention.py).
+
+        Возвращает (users, activity): users - [(user_id, 'YYYY-MM-DD')] с
+        датой регистрации за последние cohort_days дней, activity -
+        [(user_id, 'YYYY-MM-DD')] из user_daily_activity за тот же период.
+        Сопоставление пар с пользователями - в NumPy: без JOIN оба запроса
+        читают только диапазон индекса.
+        """
+        since = f'-{cohort_days} day'
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            # Сотни тысяч строк: обычные кортежи заметно быстрее sqlite3.Row
+            cursor.row_factory = None
+            cursor.execute('''
+                SELECT user_id, substr(joined_date, 1, 10)
+                FROM users
+                WHERE joined_date >= date('now', ?)
+            ''', (since,))
+            users = cursor.fetchall()
+
+            cursor.execute(
+                "SELECT user_id, date FROM user_daily_activity WHERE date >= date('now', ?)",
+                (since,)
+            )
+            activity = cursor.fetchall()
+            return users, activity
 
     def get_mailing_templates_by_type(self):
         """Получить статистику шаблонов по типам контента"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT 
-                CASE 
-                    WHEN media_type IS NULL THEN 'text'
-                    ELSE media_type
-                END as content_type,
-                COUNT(*) as count
-            FROM mailings
-            WHERE is_template = 1
-            GROUP BY content_type
-            ORDER BY count DESC
-        ''')
-        return [dict(row) for row in cursor.fetchall()]
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    CASE 
+                        WHEN media_type IS NULL THEN 'text'
+                        ELSE media_type
+                    END as content_type,
+                    COUNT(*) as count
+                FROM mailings
+                WHERE is_template = 1
+                GROUP BY content_type
+                ORDER BY count DESC
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
 
     def search_templates(self, search_term):
         """Поиск шаблонов по заголовку"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM mailings 
-            WHERE is_template = 1 AND title LIKE ?
-            ORDER BY created_at DESC
-        ''', (f'%{search_term}%',))
-        return [dict(row) for row in cursor.fetchall()]
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM mailings 
+                WHERE is_template = 1 AND title LIKE ?
+                ORDER BY created_at DESC
+            ''', (f'%{search_term}%',))
+            return [dict(row) for row in cursor.fetchall()]
 
     def get_recent_mailings(self, limit=10):
         """Получить последние рассылки"""
-        cursor = self.conn.cursor()
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT m.*, 
+                       COUNT(CASE WHEN sm.status = 'sent' THEN 1 END) as delivered_count 
+                FROM mailings m 
+                LEFT JOIN sent_mailings sm ON m.id = sm.mailing_id 
+                WHERE m.is_template = 0
+                GROUP BY m.id 
+                ORDER BY m.created_at DESC
+                LIMIT ?
+            ''', (limit,))
+            return [dict(row) for row in cursor.fetchall()]
+
+    # --- Задания рассылок (возобновление после перезапуска) ---
+
+    def _create_job(self, cursor, mailing_id, audience_type, status):
+        """Создать задание и зафиксировать список получателей (в транзакции вызывающего)"""
+        # Неизвестная аудитория - пустой список получателей
+        condition, params = compile_audience(audience_type) or ('0', ())
+
         cursor.execute('''
-            SELECT m.*, 
-                   COUNT(CASE WHEN sm.status = 'sent' THEN 1 END) as delivered_count 
-            FROM mailings m 
-            LEFT JOIN sent_mailings sm ON m.id = sm.mailing_id 
-            WHERE m.is_template = 0
-            GROUP BY m.id 
-            ORDER BY m.created_at DESC
-            LIMIT ?
-        ''', (limit,))
-        return [dict(row) for row in cursor.fetchall()]
+            INSERT INTO mailing_jobs (mailing_id, audience_type, status)
+            VALUES (?, ?, ?)
+        ''', (mailing_id, audience_type, status))
+        job_id = cursor.lastrowid
 
-    def close(self):
-        self.conn.close()
+        cursor.execute(f'''
+            INSERT INTO mailing_recipients (job_id, user_id)
+            SELECT ?, u.user_id FROM users u WHERE {condition}
+        ''', (job_id, *params))
+        total_count = cursor.rowcount
+
+        cursor.execute('UPDATE mailing_jobs SET total_count = ? WHERE id = ?', (total_count, job_id))
+        return job_id, total_count
+
+    def _delete_draft_jobs(self, cursor, select_ids, params=()):
+        """Удалить черновики, id которых выбирает подзапрос select_ids"""
+        cursor.execute(f'DELETE FROM mailing_recipients WHERE job_id IN ({select_ids})', params)
+        cursor.execute(f'DELETE FROM mailing_jobs WHERE id IN ({select_ids})', params)
+
+    def _purge_finished_recipients(self, cursor):
+        """Удалить списки получателей заданий, завершенных больше MAILING_RECIPIENTS_KEEP_DAYS дней назад.
+
+        Результаты отправки к этому времени уже в sent_mailings (пишутся той же
+        транзакцией, что и статус получателя), а итоги - в mailing_jobs.
+        """
+        cursor.execute('''
+            DELETE FROM mailing_recipients WHERE job_id IN (
+                SELECT id FROM mailing_jobs
+                WHERE status IN ('completed', 'cancelled') AND finished_at < datetime('now', ?)
+            )
+        ''', (f'-{Config.MAILING_RECIPIENTS_KEEP_DAYS} days',))
+
+    def create_mailing_job(self, mailing_id, audience_type='all'):
+        """Создать задание рассылки и зафиксировать список получателей.
+
+        Задание и получатели создаются в одной транзакции, поэтому после
+        перезапуска задание либо есть целиком, либо его нет.
+        """
+        with self.pool.write() as conn:
+            job_id, _ = self._create_job(conn.cursor(), mailing_id, audience_type, 'pending')
+            return job_id
+
+    def create_recipient_snapshot(self, audience_type='all'):
+        """Зафиксировать аудиторию на экране подтверждения - черновик задания без рассылки.
+
+        Число получателей черновика показывается в предпросмотре, а после
+        подтверждения черновик становится заданием (attach_mailing_to_job),
+        так что рассылка уходит ровно тем, кого посчитали. Заодно удаляются
+        брошенные черновики старше MAILING_DRAFT_TTL часов и списки получателей
+        давно завершенных заданий.
+        Возвращает (job_id, total_count).
+        """
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            self._delete_draft_jobs(
+                cursor,
+                "SELECT id FROM mailing_jobs WHERE status = 'draft' AND created_at < datetime('now', ?)",
+                (f'-{Config.MAILING_DRAFT_TTL} hours',)
+            )
+            self._purge_finished_recipients(cursor)
+            return self._create_job(cursor, None, audience_type, 'draft')
+
+    def attach_mailing_to_job(self, job_id, mailing_id):
+        """Превратить черновик в задание рассылки. False - черновика уже нет"""
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE mailing_jobs
+                SET mailing_id = ?, status = 'pending', updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'draft'
+            ''', (mailing_id, job_id))
+            return cursor.rowcount == 1
+
+    def delete_draft_job(self, job_id):
+        """Удалить черновик, если рассылку не подтвердили"""
+        with self.pool.write() as conn:
+            self._delete_draft_jobs(
+                conn.cursor(),
+                "SELECT id FROM mailing_jobs WHERE id = ? AND status = 'draft'",
+                (job_id,)
+            )
+
+    def get_mailing_job(self, job_id):
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM mailing_jobs WHERE id = ?', (job_id,))
+            result = cursor.fetchone()
+            return dict(result) if result else None
+
+    def get_unfinished_mailing_jobs(self):
+        """Задания, прерванные перезапуском бота (в том числе стоящие на паузе)"""
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM mailing_jobs
+                WHERE status IN ('pending', 'running', 'paused')
+                ORDER BY id
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
+
+    def fetch_pending_recipients_chunk(self, job_id, after_user_id=0, limit=1000):
+        """Следующая порция получателей задания, которым рассылка еще не отправлялась.
+
+        Keyset-пагинация по индексу (job_id, status, user_id) - как в fetch_audience_chunk.
+        """
+        with self.pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id FROM mailing_recipients
+                WHERE job_id = ? AND status = 'pending' AND user_id > ?
+                ORDER BY user_id
+                LIMIT ?
+            ''', (job_id, after_user_id, limit))
+            return [row[0] for row in cursor.fetchall()]
+
+    def update_mailing_job_status(self, job_id, status):
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE mailing_jobs
+                SET status = ?,
+                    updated_at = CURRENT_TIMESTAMP,
+                    finished_at = CASE WHEN ? IN ('completed', 'cancelled') THEN CURRENT_TIMESTAMP END
+                WHERE id = ?
+            ''', (status, status, job_id))
+
+    def set_mailing_job_paused(self, job_id, paused):
+        """Поставить задание на паузу или снять с нее.
 
-    def __del__(self):
-        self.close()
\ No newline at end of file
+        Меняет статус только у незавершенных заданий (pending/running/paused):
+        завершенное или отмененное задание не должно снова стать
+        незавершенным. Возвращает True, если статус изменен.
+        """
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE mailing_jobs
+                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ('pending', 'running', 'paused')
+            ''', ('paused' if paused else 'running', job_id))
+            return cursor.rowcount > 0
+
+    def cancel_mailing_job(self, job_id):
+        """Сразу отметить незавершенное задание отмененным.
+
+        Статус пишется до того, как run_job завершит отправки, чтобы после
+        остановки бота resume_unfinished не возобновил отмененную рассылку.
+        """
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE mailing_jobs
+                SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ('pending', 'running', 'paused')
+            ''', (job_id,))
+            return cursor.rowcount > 0
+
+    def record_mailing_result(self, job_id, mailing_id, user_id, status='sent', unreachable_reason=None):
+        """Записать результат одной отправки и отметить получателя в задании (чекпоинт)"""
+        self.record_mailing_results(job_id, mailing_id, [(user_id, status, None, unreachable_reason)])
+
+    def record_mailing_results(self, job_id, mailing_id, results):
+        """Записать пачку результатов отправки одной транзакцией.
+
+        results - [(user_id, status, sent_at, unreachable_reason), ...];
+        sent_at=None - текущее время, unreachable_reason - причина, по которой
+        пользователь исключается из следующих рассылок (None - доступен)
+        """
+        if not results:
+            return
+
+        sent = sum(1 for _, status, _, _ in results if status == 'sent')
+        unreachable = [
+            (reason, sent_at, user_id)
+            for user_id, _, sent_at, reason in results if reason
+        ]
+
+        with self.pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO sent_mailings (mailing_id, user_id, status, sent_at)
+                VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            ''', [(mailing_id, user_id, status, sent_at) for user_id, status, sent_at, _ in results])
+            cursor.executemany('''
+                UPDATE mailing_recipients SET status = ?
+                WHERE job_id = ? AND user_id = ?
+            ''', [(status, job_id, user_id) for user_id, status, _, _ in results])
+            cursor.executemany('''
+                UPDATE users
+                SET is_reachable = 0,
+                    unreachable_reason = ?,
+                    unreachable_at = COALESCE(?, CURRENT_TIMESTAMP)
+                WHERE user_id = ?
+            ''', unreachable)
+            cursor.execute('''
+                UPDATE mailing_jobs
+                SET sent_count = sent_count + ?,
+                    failed_count = failed_count + ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (sent, len(results) - sent, job_id))
+
+    def close(self):
+        self.pool.close()
\ No newline at end of file
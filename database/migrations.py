@@ -0,0 +1,271 @@
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Шаг миграции - SQL-строка или функция fn(conn) для переноса данных
+Migration = namedtuple('Migration', ['version', 'description', 'steps'])
+
+MIGRATIONS = [
+    Migration(1, 'Базовые таблицы', [
+        # Таблица пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Таблица рассылок с поддержкой медиа и шаблонов
+        '''
+        CREATE TABLE IF NOT EXISTS mailings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            message_text TEXT,
+            message_type TEXT DEFAULT 'text',
+            media_type TEXT,
+            media_file_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_count INTEGER DEFAULT 0,
+            audience_type TEXT DEFAULT 'all',
+            is_template BOOLEAN DEFAULT 1
+        )
+        ''',
+        # Таблица отправленных рассылок
+        '''
+        CREATE TABLE IF NOT EXISTS sent_mailings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mailing_id INTEGER,
+            user_id INTEGER,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'sent',
+            FOREIGN KEY (mailing_id) REFERENCES mailings (id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        # Таблица активности пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS user_activity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            action_type TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+    ]),
+    Migration(2, 'Индексы для запросов статистики', [
+        # Окна активности: COUNT(DISTINCT user_id) WHERE timestamp >= ... читается из индекса
+        'CREATE INDEX IF NOT EXISTS idx_user_activity_timestamp ON user_activity (timestamp, user_id)',
+        # Активность конкретного пользователя и JOIN с users
+        'CREATE INDEX IF NOT EXISTS idx_user_activity_user_timestamp ON user_activity (user_id, timestamp)',
+        # Доставки по рассылке и общие счетчики по статусу
+        'CREATE INDEX IF NOT EXISTS idx_sent_mailings_mailing_status ON sent_mailings (mailing_id, status)',
+        'CREATE INDEX IF NOT EXISTS idx_sent_mailings_status ON sent_mailings (status)',
+        # Новые пользователи за период
+        'CREATE INDEX IF NOT EXISTS idx_users_joined_date ON users (joined_date)',
+    ]),
+    Migration(3, 'Задания рассылок с фиксированным списком получателей', [
+        # status: [draft ->] pending -> running (<-> paused) -> completed / cancelled
+        # draft - список получателей зафиксирован на экране подтверждения, mailing_id еще NULL
+        '''
+        CREATE TABLE IF NOT EXISTS mailing_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mailing_id INTEGER,
+            audience_type TEXT,
+            status TEXT DEFAULT 'pending',
+            total_count INTEGER DEFAULT 0,
+            sent_count INTEGER DEFAULT 0,
+            failed_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (mailing_id) REFERENCES mailings (id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_mailing_jobs_status ON mailing_jobs (status)',
+        # status получателя: pending -> sent / failed (это и есть чекпоинт задания)
+        '''
+        CREATE TABLE IF NOT EXISTS mailing_recipients (
+            job_id INTEGER,
+            user_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            PRIMARY KEY (job_id, user_id),
+            FOREIGN KEY (job_id) REFERENCES mailing_jobs (id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_mailing_recipients_status ON mailing_recipients (job_id, status, user_id)',
+    ]),
+    Migration(4, 'Доступность пользователей для рассылок', [
+        # is_reachable = 0: пользователь заблокировал бота или удалил аккаунт
+        'ALTER TABLE users ADD COLUMN is_reachable INTEGER DEFAULT 1',
+        'ALTER TABLE users ADD COLUMN unreachable_reason TEXT',
+        'ALTER TABLE users ADD COLUMN unreachable_at TIMESTAMP',
+    ]),
+    Migration(5, 'Снимки статистики для админ-панели', [
+        # data - JSON со статистикой (services/stats_snapshots.py), последний снимок - MAX(id)
+        '''
+        CREATE TABLE IF NOT EXISTS stats_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_stats_snapshots_created ON stats_snapshots (created_at)',
+    ]),
+    Migration(6, 'Дневные агрегаты активности и регистраций', [
+        # Ведутся при записи событий (Database._rollup_activity, add_user), даты - UTC
+        '''
+        CREATE TABLE IF NOT EXISTS daily_activity (
+            date TEXT PRIMARY KEY,
+            actions INTEGER DEFAULT 0,
+            active_users INTEGER DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_signups (
+            date TEXT PRIMARY KEY,
+            count INTEGER DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        # Кто был активен в какой день - для инкрементального подсчета active_users
+        '''
+        CREATE TABLE IF NOT EXISTS user_daily_activity (
+            date TEXT,
+            user_id INTEGER,
+            PRIMARY KEY (date, user_id)
+        ) WITHOUT ROWID
+        ''',
+        # Заполнение по уже накопленной истории
+        '''
+        INSERT OR IGNORE INTO user_daily_activity (date, user_id)
+        SELECT DISTINCT date(timestamp), user_id FROM user_activity
+        ''',
+        '''
+        INSERT OR REPLACE INTO daily_activity (date, actions, active_users)
+        SELECT date(timestamp), COUNT(*), COUNT(DISTINCT user_id)
+        FROM user_activity
+        GROUP BY date(timestamp)
+        ''',
+        '''
+        INSERT OR REPLACE INTO daily_signups (date, count)
+        SELECT date(joined_date), COUNT(*) FROM users GROUP BY date(joined_date)
+        ''',
+    ]),
+    Migration(7, 'Скетчи HyperLogLog активных пользователей', [
+        # period: 'hour' (bucket 'YYYY-MM-DD HH') или 'day' (bucket 'YYYY-MM-DD'), время UTC
+        '''
+        CREATE TABLE IF NOT EXISTS activity_sketches (
+            period TEXT,
+            bucket TEXT,
+            registers BLOB,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (period, bucket)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    Migration(8, 'Сводки Space-Saving самых активных пользователей', [
+        # data - JSON [[user_id, count, error], ...] за день (UTC);
+        # through - время последнего учтенного события на момент сохранения
+        '''
+        CREATE TABLE IF NOT EXISTS top_users_sketches (
+            date TEXT PRIMARY KEY,
+            data TEXT,
+            through TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    Migration(9, 'Почасовые ряды активности', [
+        # data - кольцевой буфер int32 по часам (UTC), head - номер последнего
+        # часа от эпохи; см. services.activity_timeseries.HourlyRing
+        '''
+        CREATE TABLE IF NOT EXISTS timeseries (
+            metric TEXT PRIMARY KEY,
+            head INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    Migration(10, 'Активность по часу недели', [
+        # Ведется при записи событий (Database._rollup_activity), время UTC;
+        # weekday - 0 = понедельник, как datetime.weekday()
+        '''
+        CREATE TABLE IF NOT EXISTS activity_heatmap (
+            action_type TEXT,
+            weekday INTEGER,
+            hour INTEGER,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (action_type, weekday, hour)
+        ) WITHOUT ROWID
+        ''',
+        # Заполнение по уже накопленной истории (%w: 0 = воскресенье)
+        '''
+        INSERT OR REPLACE INTO activity_heatmap (action_type, weekday, hour, count)
+        SELECT COALESCE(action_type, 'message'),
+               (CAST(strftime('%w', timestamp) AS INTEGER) + 6) % 7,
+               CAST(strftime('%H', timestamp) AS INTEGER),
+               COUNT(*)
+        FROM user_activity
+        GROUP BY 1, 2, 3
+        ''',
+    ]),
+]
+
+
+def get_schema_version(conn):
+    """Текущая версия схемы (0 - база еще не создана)"""
+    cursor = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+
+def apply_migrations(conn, migrations=MIGRATIONS):
+    """Применить недостающие миграции по порядку.
+
+    Каждая миграция выполняется в отдельной транзакции BEGIN IMMEDIATE:
+    другие процессы не смогут писать в базу во время миграции, а при
+    ошибке схема останется на предыдущей версии.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    for migration in sorted(migrations, key=lambda m: m.version):
+        if migration.version <= get_schema_version(conn):
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Миграцию мог успеть применить другой процесс
+            if migration.version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+
+            for step in migration.steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+
+            conn.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (migration.version, migration.description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Ошибка применения миграции {migration.version}: {migration.description}")
+            raise
+
+        logger.info(f"Применена миграция {migration.version}: {migration.description}")
+
+    return get_schema_version(conn)
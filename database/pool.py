@@ -0,0 +1,66 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """Общий пул соединений SQLite на весь процесс.
+
+    Одно соединение на запись (под блокировкой) и ограниченный набор
+    соединений на чтение. База переводится в режим WAL, чтобы читатели
+    не ждали писателя.
+    """
+
+    def __init__(self, path: str, readers: int = 4, timeout: float = 30):
+        self.path = path
+        self.readers = readers
+        self.timeout = timeout
+        # Схема создается один раз на пул, а не при каждом Database()
+        self.schema_ready = False
+
+        self._write_lock = threading.RLock()
+        self._writer = self._connect()
+        self._writer.execute('PRAGMA journal_mode=WAL')
+
+        self._readers = queue.Queue(maxsize=readers)
+        self._all_readers = []
+        for _ in range(readers):
+            conn = self._connect()
+            self._all_readers.append(conn)
+            self._readers.put(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=self.timeout)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def read(self):
+        """Взять соединение на чтение (ждет, если все заняты)"""
+        try:
+            conn = self._readers.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError("Нет свободных соединений с базой данных")
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def write(self):
+        """Соединение на запись: одна транзакция, commit при выходе, rollback при ошибке"""
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        for conn in self._all_readers:
+            conn.close()
@@ -0,0 +1,118 @@
+class Segment:
+    """SQL-условие на пользователя (алиас таблицы users - u) с параметрами.
+
+    Сегменты комбинируются через &, | и ~ и компилируются в одно
+    WHERE-выражение, поэтому выборка, подсчет и снимок получателей -
+    это один индексированный запрос:
+
+        segment = joined_since(7) & active_within(1, 'start') & has_username()
+        sql, params = segment.compile()
+    """
+
+    def __init__(self, sql: str, params=()):
+        self.sql = sql
+        self.params = tuple(params)
+
+    def __and__(self, other):
+        return Segment(f'({self.sql}) AND ({other.sql})', self.params + other.params)
+
+    def __or__(self, other):
+        return Segment(f'({self.sql}) OR ({other.sql})', self.params + other.params)
+
+    def __invert__(self):
+        return Segment(f'NOT ({self.sql})', self.params)
+
+    def compile(self, include_unreachable: bool = False):
+        """(sql, params) для WHERE; по умолчанию только доступные для доставки"""
+        segment = self if include_unreachable else self & reachable()
+        return segment.sql, segment.params
+
+
+def _days_ago(days: float):
+    # Модификатор datetime('now', ?) для SQLite
+    return f'-{days} days'
+
+
+def everyone():
+    return Segment('1')
+
+
+def joined_since(days: float):
+    """Зарегистрировались за последние days дней (использует idx_users_joined_date)"""
+    return Segment("u.joined_date >= datetime('now', ?)", (_days_ago(days),))
+
+
+def joined_before(days: float):
+    """Зарегистрировались раньше, чем days дней назад"""
+    return Segment("u.joined_date < datetime('now', ?)", (_days_ago(days),))
+
+
+def active_within(days: float, action_type: str = None):
+    """Были активны за последние days дней (по индексу user_activity (user_id, timestamp))"""
+    if action_type is None:
+        return Segment('''EXISTS (
+            SELECT 1 FROM user_activity ua
+            WHERE ua.user_id = u.user_id AND ua.timestamp >= datetime('now', ?)
+        )''', (_days_ago(days),))
+    return Segment('''EXISTS (
+        SELECT 1 FROM user_activity ua
+        WHERE ua.user_id = u.user_id AND ua.timestamp >= datetime('now', ?)
+          AND ua.action_type = ?
+    )''', (_days_ago(days), action_type))
+
+
+def inactive_for(days: float):
+    """Не проявляли активности последние days дней"""
+    return ~active_within(days)
+
+
+def performed(action_type: str):
+    """Хотя бы раз совершали действие action_type (например, 'start')"""
+    return Segment('''EXISTS (
+        SELECT 1 FROM user_activity ua
+        WHERE ua.user_id = u.user_id AND ua.action_type = ?
+    )''', (action_type,))
+
+
+def reachable():
+    """Не заблокировали бота и не удалили аккаунт"""
+    return Segment('u.is_reachable = 1')
+
+
+def has_username():
+    return Segment("u.username IS NOT NULL AND u.username != ''")
+
+
+class Audience:
+    """Именованный сегмент, который можно выбрать в админ-панели"""
+
+    def __init__(self, key: str, title: str, segment: Segment):
+        self.key = key
+        self.title = title
+        self.segment = segment
+
+
+# Аудитории в порядке отображения на клавиатуре выбора
+AUDIENCES = {
+    audience.key: audience for audience in [
+        Audience('all', '👥 Все пользователи', everyone()),
+        Audience('active_week', '🔥 Активные (неделя)', active_within(7)),
+        Audience('new_today', '🆕 Новые (сегодня)', joined_since(1)),
+        Audience('new_week', '📈 Новые (неделя)', joined_since(7)),
+        Audience('inactive_month', '💤 Неактивные (месяц)', inactive_for(30)),
+        Audience('with_username', '🔗 С username', has_username()),
+    ]
+}
+
+
+def get_audience_title(audience_type: str):
+    audience = AUDIENCES.get(audience_type)
+    return audience.title if audience else audience_type
+
+
+def compile_audience(audience_type: str, include_unreachable: bool = False):
+    """(sql, params) условия аудитории или None, если такой аудитории нет"""
+    audience = AUDIENCES.get(audience_type)
+    if audience is None:
+        return None
+    return audience.segment.compile(include_unreachable)
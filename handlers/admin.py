@@ -2,10 +2,9 @@ from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config.config import Config
-from database.db import Database
+from database.async_db import AsyncDatabase
 
 router = Router()
-db = Database()
 
 def is_admin(user_id: int) -> bool:
     print(f"🔍 Проверка админских прав для {user_id}, ADMIN_IDS: {Config.ADMIN_IDS}")
@@ -32,13 +31,13 @@ async def admin_panel(message: types.Message):
     await message.answer("🛠️ Панель администратора:", reply_markup=keyboard)
 
 @router.callback_query(F.data == "admin_stats")
-async def show_stats(callback: types.CallbackQuery):
+async def show_stats(callback: types.CallbackQuery, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа")
         return
 
-    user_count = db.get_user_count()
-    mailings = db.get_all_mailings()
+    user_count = await db.get_user_count()
+    mailings = await db.get_all_mailings()
     total_mailings = len(mailings)
     
     stats_text = f"""
@@ -56,12 +55,12 @@ async def show_stats(callback: types.CallbackQuery):
     await callback.message.edit_text(stats_text)
 
 @router.callback_query(F.data == "admin_mailing_history")
-async def show_mailing_history(callback: types.CallbackQuery):
+async def show_mailing_history(callback: types.CallbackQuery, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа")
         return
 
-    mailings = db.get_all_mailings()
+    mailings = await db.get_all_mailings()
     
     if not mailings:
         await callback.message.edit_text("История рассылок пуста.")
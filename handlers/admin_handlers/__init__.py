@@ -1,11 +1,12 @@
 from .main_menu import router as admin_main_router
-from .admin import router as admin_router
+from ..admin import router as admin_router
 from .statistics import router as stats_router
 from .excel_reports import router as excel_reports_router
 from .mailing_creator import router as mailing_creator_router
 from .templates_manager import router as templates_router
 from .mailing_history import router as mailing_history_router
 from .user_mailing import router as user_mailing_router
+from .mailing_control import router as mailing_control_router
 
 all_routers = [
     admin_main_router,
@@ -15,5 +16,6 @@ all_routers = [
     mailing_creator_router,
     templates_router,
     mailing_history_router,
-    user_mailing_router
+    user_mailing_router,
+    mailing_control_router
 ]
\ No newline at end of file
@@ -1,7 +1,9 @@
 from aiogram import Router, types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from config.config import Config
+from database.async_db import AsyncDatabase
 from services.excel_report_service import ExcelReportService
+from services.top_users import TopActiveUsers
 import os
 import asyncio
 from datetime import datetime
@@ -23,7 +25,7 @@ async def safe_edit_message(callback: types.CallbackQuery, text: str, keyboard:
             await callback.answer("Произошла ошибка", show_alert=True)
 
 @router.callback_query(F.data == "admin_excel_report")
-async def generate_excel_report(callback: types.CallbackQuery):
+async def generate_excel_report(callback: types.CallbackQuery, db: AsyncDatabase, top_users: TopActiveUsers):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
@@ -38,7 +40,7 @@ async def generate_excel_report(callback: types.CallbackQuery):
     )
 
     # Генерируем отчет в отдельном потоке
-    report_service = ExcelReportService()
+    report_service = ExcelReportService(db.db, top_users)
     
     try:
         # Запускаем генерацию отчета
@@ -0,0 +1,88 @@
+from aiogram import Router, types, F
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from config.config import Config
+from services.mailing_tasks import MailingTaskRegistry
+
+router = Router()
+
+def is_admin(user_id: int) -> bool:
+    return user_id in Config.ADMIN_IDS
+
+@router.callback_query(F.data == "admin_active_mailings")
+async def show_active_mailings(callback: types.CallbackQuery, mailing_tasks: MailingTaskRegistry):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
+
+    active = mailing_tasks.active()
+    text = "⏯ <b>Активные рассылки</b>\n\n"
+    buttons = []
+
+    if not active:
+        text += "Сейчас рассылки не выполняются."
+
+    for mailing_task in active:
+        progress = mailing_task.progress
+        state = "⏸ на паузе" if mailing_task.control.paused else "📨 идет"
+        text += f"<b>Задание {mailing_task.job_id}</b> ({state})\n"
+        text += f"• <b>Заголовок:</b> {mailing_task.mailing['title'] or 'Без заголовка'}\n"
+        text += f"• <b>Отправлено:</b> {progress.sent}/{progress.total}, ошибок: {progress.failed}\n\n"
+
+        if mailing_task.control.paused:
+            toggle = InlineKeyboardButton(text=f"▶️ Продолжить {mailing_task.job_id}",
+                                          callback_data=f"mailing_resume_{mailing_task.job_id}")
+        else:
+            toggle = InlineKeyboardButton(text=f"⏸ Пауза {mailing_task.job_id}",
+                                          callback_data=f"mailing_pause_{mailing_task.job_id}")
+        buttons.append([
+            toggle,
+            InlineKeyboardButton(text=f"⛔ Отменить {mailing_task.job_id}",
+                                 callback_data=f"mailing_cancel_{mailing_task.job_id}")
+        ])
+
+    buttons.append([InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_active_mailings")])
+    buttons.append([InlineKeyboardButton(text="🔙 В админ-панель", callback_data="admin_refresh")])
+
+    try:
+        await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+                                         parse_mode="HTML")
+    except Exception as e:
+        if "message is not modified" not in str(e):
+            print(f"Ошибка при редактировании сообщения: {e}")
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("mailing_pause_"))
+async def pause_mailing(callback: types.CallbackQuery, mailing_tasks: MailingTaskRegistry):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
+
+    job_id = int(callback.data.split("_")[2])
+    if await mailing_tasks.pause(job_id):
+        await callback.answer("⏸ Рассылка приостановлена")
+    else:
+        await callback.answer("Рассылка уже завершена", show_alert=True)
+
+@router.callback_query(F.data.startswith("mailing_resume_"))
+async def resume_mailing(callback: types.CallbackQuery, mailing_tasks: MailingTaskRegistry):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
+
+    job_id = int(callback.data.split("_")[2])
+    if await mailing_tasks.resume(job_id):
+        await callback.answer("▶️ Рассылка продолжена")
+    else:
+        await callback.answer("Рассылка уже завершена", show_alert=True)
+
+@router.callback_query(F.data.startswith("mailing_cancel_"))
+async def cancel_running_mailing(callback: types.CallbackQuery, mailing_tasks: MailingTaskRegistry):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
+
+    job_id = int(callback.data.split("_")[2])
+    if await mailing_tasks.cancel(job_id):
+        await callback.answer("⛔ Рассылка отменяется...")
+    else:
+        await callback.answer("Рассылка уже завершена", show_alert=True)
@@ -4,13 +4,14 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from config.config import Config
-from services.mailing_service import MailingService
-from database.db import Database
+from services.mailing_tasks import MailingTaskRegistry
+from database.segments import get_audience_title
+from utils.keyboards import get_audience_keyboard
+from database.async_db import AsyncDatabase
 from datetime import datetime
 import os
 
 router = Router()
-db = Database()
 
 def is_admin(user_id: int) -> bool:
     return user_id in Config.ADMIN_IDS
@@ -58,21 +59,6 @@ def get_confirmation_keyboard():
         ]
     ])
 
-def get_audience_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="👥 Все пользователи", callback_data="audience_all"),
-            InlineKeyboardButton(text="🔥 Активные", callback_data="audience_active_week")
-        ],
-        [
-            InlineKeyboardButton(text="🆕 Новые (сегодня)", callback_data="audience_new_today"),
-            InlineKeyboardButton(text="📈 Новые (неделя)", callback_data="audience_new_week")
-        ],
-        [
-            InlineKeyboardButton(text="🔙 Назад", callback_data="admin_create_mailing")
-        ]
-    ])
-
 @router.callback_query(F.data == "admin_create_mailing")
 async def start_mailing_creation(callback: types.CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
@@ -209,23 +195,22 @@ async def process_audience_selection(update, state: FSMContext):
     
     await message.answer(
         preview_text,
-        reply_markup=get_audience_keyboard(),
+        reply_markup=get_audience_keyboard("audience_", "admin_create_mailing"),
         parse_mode="HTML"
     )
 
 @router.callback_query(MailingCreation.waiting_for_audience, F.data.startswith("audience_"))
-async def select_audience(callback: types.CallbackQuery, state: FSMContext):
+async def select_audience(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase):
     audience_type = callback.data.replace("audience_", "")
-    audience_names = {
-        "all": "👥 Все пользователи",
-        "active_week": "🔥 Активные за неделю", 
-        "new_today": "🆕 Новые сегодня",
-        "new_week": "📈 Новые за неделю"
-    }
     
-    audience_count = await get_audience_count(audience_type)
+    data = await state.get_data()
+    
+    # Фиксируем получателей сразу: в предпросмотре то же число, что получит рассылку
+    if data.get('draft_job_id'):
+        await db.delete_draft_job(data['draft_job_id'])
+    draft_job_id, audience_count = await db.create_recipient_snapshot(audience_type)
     
-    await state.update_data(audience_type=audience_type)
+    await state.update_data(audience_type=audience_type, draft_job_id=draft_job_id)
     await state.set_state(MailingCreation.waiting_for_confirmation)
     
     data = await state.get_data()
@@ -246,13 +231,7 @@ async def generate_preview_text(data, audience_type=None, audience_count=None):
     text += f"<b>Заголовок:</b> {data['title']}\n"
     
     if audience_type and audience_count is not None:
-        audience_names = {
-            "all": "👥 Все пользователи",
-            "active_week": "🔥 Активные за неделю", 
-            "new_today": "🆕 Новые сегодня",
-            "new_week": "📈 Новые за неделю"
-        }
-        text += f"<b>Аудитория:</b> {audience_names.get(audience_type)} ({audience_count} пользователей)\n"
+        text += f"<b>Аудитория:</b> {get_audience_title(audience_type)} ({audience_count} пользователей)\n"
     
     media_type = data.get('media_type')
     if media_type:
@@ -275,26 +254,8 @@ async def generate_preview_text(data, audience_type=None, audience_count=None):
     
     return text
 
-async def get_audience_count(audience_type):
-    """Получить количество пользователей в выбранной аудитории"""
-    from database.db import Database
-    db = Database()
-    
-    if audience_type == "all":
-        return db.get_user_count()
-    elif audience_type == "active_week":
-        stats = db.get_detailed_stats()
-        return stats['active_users_week']
-    elif audience_type == "new_today":
-        stats = db.get_detailed_stats()
-        return stats['new_users_today']
-    elif audience_type == "new_week":
-        stats = db.get_detailed_stats()
-        return stats['new_users_week']
-    return 0
-
 @router.callback_query(F.data == "save_template")
-async def save_as_template(callback: types.CallbackQuery, state: FSMContext):
+async def save_as_template(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
@@ -302,7 +263,7 @@ async def save_as_template(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     
     # Сохраняем как шаблон
-    template_id = db.save_mailing(
+    template_id = await db.save_mailing(
         title=data['title'],
         message_text=data['message_text'],
         message_type=data.get('message_type', 'text'),
@@ -328,13 +289,13 @@ async def save_as_template(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
 
 @router.callback_query(F.data == "send_now")
-async def send_mailing_now(callback: types.CallbackQuery, state: FSMContext, bot):
+async def send_mailing_now(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase,
+                           mailing_tasks: MailingTaskRegistry):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
     data = await state.get_data()
-    mailing_service = MailingService(bot)
     
     # Показываем уведомление о начале рассылки
     await callback.message.edit_text(
@@ -344,7 +305,7 @@ async def send_mailing_now(callback: types.CallbackQuery, state: FSMContext, bot
     )
     
     # Сохраняем рассылку (не как шаблон)
-    mailing_id = db.save_mailing(
+    mailing_id = await db.save_mailing(
         title=data['title'],
         message_text=data['message_text'],
         message_type=data.get('message_type', 'text'),
@@ -354,34 +315,17 @@ async def send_mailing_now(callback: types.CallbackQuery, state: FSMContext, bot
         is_template=False
     )
     
-    # Отправляем рассылку
-    success_count, total_count = await mailing_service.send_mailing(
-        mailing_id, 
-        data['message_text'],
-        data.get('message_type', 'text'),
-        data.get('media_type'),
-        data.get('media_file_id'),
-        data.get('audience_type', 'all')
-    )
-    
-    delivery_rate = round((success_count/total_count)*100, 2) if total_count > 0 else 0
-    
-    await callback.message.edit_text(
-        f"✅ <b>Рассылка завершена!</b>\n\n"
-        f"📨 <b>Заголовок:</b> {data['title']}\n"
-        f"🎯 <b>Аудитория:</b> {data.get('audience_type', 'all')}\n"
-        f"✅ <b>Успешно отправлено:</b> {success_count}/{total_count}\n"
-        f"📊 <b>Процент доставки:</b> {delivery_rate}%\n\n"
-        f"📅 <b>Время отправки:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📊 Статистика рассылок", callback_data="stats_mailings")],
-            [InlineKeyboardButton(text="📨 Новая рассылка", callback_data="admin_create_mailing")],
-            [InlineKeyboardButton(text="🔙 В админ-панель", callback_data="admin_refresh")]
-        ]),
-        parse_mode="HTML"
+    # Рассылка идет в фоне, прогресс и итог обновляются в этом же сообщении
+    await mailing_tasks.start(
+        mailing_id,
+        data.get('audience_type', 'all'),
+        chat_id=callback.message.chat.id,
+        message_id=callback.message.message_id,
+        draft_job_id=data.get('draft_job_id')
     )
     
     await state.clear()
+    await callback.answer()
 
 @router.callback_query(F.data == "edit_text")
 async def edit_mailing_text(callback: types.CallbackQuery, state: FSMContext):
@@ -403,7 +347,10 @@ async def edit_mailing_media(callback: types.CallbackQuery, state: FSMContext):
     )
 
 @router.callback_query(F.data == "cancel_mailing")
-async def cancel_mailing(callback: types.CallbackQuery, state: FSMContext):
+async def cancel_mailing(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase):
+    data = await state.get_data()
+    if data.get('draft_job_id'):
+        await db.delete_draft_job(data['draft_job_id'])
     await state.clear()
     await callback.message.edit_text(
         "❌ <b>Создание рассылки отменено</b>",
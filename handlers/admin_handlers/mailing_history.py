@@ -1,10 +1,9 @@
 from aiogram import Router, types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database.db import Database
+from database.async_db import AsyncDatabase
 from config.config import Config
 
 router = Router()
-db = Database()
 
 def is_admin(user_id: int) -> bool:
     return user_id in Config.ADMIN_IDS
@@ -21,12 +20,12 @@ async def safe_edit_message(callback: types.CallbackQuery, text: str, keyboard:
             await callback.answer("Произошла ошибка", show_alert=True)
 
 @router.callback_query(F.data == "admin_mailing_history")
-async def show_mailing_history(callback: types.CallbackQuery):
+async def show_mailing_history(callback: types.CallbackQuery, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
-    mailings = db.get_all_mailings()
+    mailings = await db.get_all_mailings()
     
     if not mailings:
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -68,12 +67,12 @@ async def show_mailing_history(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "admin_mailing_stats")
-async def show_mailing_detailed_stats(callback: types.CallbackQuery):
+async def show_mailing_detailed_stats(callback: types.CallbackQuery, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
-    mailing_performance = db.get_mailing_performance()
+    mailing_performance = await db.get_mailing_performance()
     
     if not mailing_performance:
         await safe_edit_message(
@@ -2,12 +2,11 @@ from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config.config import Config
-from database.db import Database
+from services.stats_snapshots import StatsSnapshotService
 from datetime import datetime, timedelta
 import asyncio
 
 router = Router()
-db = Database()
 
 def is_admin(user_id: int) -> bool:
     return user_id in Config.ADMIN_IDS
@@ -28,18 +27,19 @@ def get_admin_main_menu():
             InlineKeyboardButton(text="📈 Excel отчет", callback_data="admin_excel_report")
         ],
         [
+            InlineKeyboardButton(text="⏯ Активные рассылки", callback_data="admin_active_mailings"),
             InlineKeyboardButton(text="🔄 Обновить данные", callback_data="admin_refresh")
         ]
     ])
     return keyboard
 
-async def get_dashboard_stats():
-    """Получить данные для дашборда"""
-    stats = db.get_detailed_stats()
+async def get_dashboard_stats(stats_snapshots: StatsSnapshotService):
+    """Получить данные для дашборда из последнего снимка статистики"""
+    snapshot = await stats_snapshots.get()
+    stats = snapshot.stats
     
-    # Получаем данные за последние 7 дней для графика активности
-    activity_data = db.get_activity_data(7)
-    user_growth = db.get_user_growth_data(7)
+    # Данные за последние 7 дней для графика активности
+    activity_data = snapshot.activity_for(7)
     
     # Формируем текст дашборда
     dashboard_text = (
@@ -60,19 +60,19 @@ async def get_dashboard_stats():
             bar = "█" * min(count // 3, 10)  # Простой текстовый график
             dashboard_text += f"• {date}: {bar} {count}\n"
     
-    dashboard_text += f"\n🕒 <b>Обновлено:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+    dashboard_text += f"\n🕒 <b>Обновлено:</b> {snapshot.updated_text}"
     
     return dashboard_text
 
 @router.message(Command("admin"))
-async def admin_panel(message: types.Message):
+async def admin_panel(message: types.Message, stats_snapshots: StatsSnapshotService):
     print(f"🎯 Получена команда /admin от пользователя {message.from_user.id}")  # Отладочная информация
     
     if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет доступа к админ-панели")
         return
 
-    dashboard_text = await get_dashboard_stats()
+    dashboard_text = await get_dashboard_stats(stats_snapshots)
     
     await message.answer(
         dashboard_text,
@@ -81,12 +81,12 @@ async def admin_panel(message: types.Message):
     )
 
 @router.callback_query(F.data == "admin_refresh")
-async def refresh_admin_panel(callback: types.CallbackQuery):
+async def refresh_admin_panel(callback: types.CallbackQuery, stats_snapshots: StatsSnapshotService):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
-    dashboard_text = await get_dashboard_stats()
+    dashboard_text = await get_dashboard_stats(stats_snapshots)
     
     await callback.message.edit_text(
         dashboard_text,
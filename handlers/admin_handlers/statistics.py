@@ -1,11 +1,16 @@
 from aiogram import Router, types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database.db import Database
+from database.async_db import AsyncDatabase
+from services.segment_index import SegmentIndex
+from services.stats_snapshots import StatsSnapshotService
+from services.retention import load_retention, RETENTION_DAYS, COHORT_DAYS
+from services.top_users import TopActiveUsers
+from services.activity_timeseries import ActivityTimeSeries, VIEWS
+from services.activity_heatmap import load_heatmap, action_title, WEEKDAYS
 from config.config import Config
 from datetime import datetime
 
 router = Router()
-db = Database()
 
 def is_admin(user_id: int) -> bool:
     return user_id in Config.ADMIN_IDS
@@ -25,6 +30,10 @@ def get_stats_keyboard():
             InlineKeyboardButton(text="📈 Графики", callback_data="stats_charts"),
             InlineKeyboardButton(text="🎯 Сегменты", callback_data="stats_segments")
         ],
+        [
+            InlineKeyboardButton(text="📉 Удержание", callback_data="stats_retention"),
+            InlineKeyboardButton(text="🕒 Часы активности", callback_data="stats_heatmap")
+        ],
         [
             InlineKeyboardButton(text="🔙 Назад", callback_data="admin_refresh")
         ]
@@ -44,12 +53,13 @@ async def show_detailed_stats_menu(callback: types.CallbackQuery):
     )
 
 @router.callback_query(F.data == "stats_general")
-async def show_general_stats(callback: types.CallbackQuery):
+async def show_general_stats(callback: types.CallbackQuery, stats_snapshots: StatsSnapshotService):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
-    stats = db.get_detailed_stats()
+    snapshot = await stats_snapshots.get()
+    stats = snapshot.stats
     
     text = (
         "📊 <b>Общая статистика бота</b>\n\n"
@@ -64,7 +74,7 @@ async def show_general_stats(callback: types.CallbackQuery):
         f"✅ <b>Успешных доставок:</b> {stats['successful_deliveries']}\n"
         f"❌ <b>Неудачных отправок:</b> {stats['failed_deliveries']}\n"
         f"📊 <b>Средняя активность на пользователя:</b> {stats['avg_activity_per_user']}\n\n"
-        f"📅 <b>Дата обновления:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+        f"📅 <b>Дата обновления:</b> {snapshot.updated_text}"
     )
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -76,13 +86,14 @@ async def show_general_stats(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "stats_users")
-async def show_users_stats(callback: types.CallbackQuery):
+async def show_users_stats(callback: types.CallbackQuery, stats_snapshots: StatsSnapshotService):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
-    stats = db.get_detailed_stats()
-    growth_data = db.get_user_growth_data(7)  # Рост за 7 дней
+    snapshot = await stats_snapshots.get()
+    stats = snapshot.stats
+    growth_data = snapshot.growth_for(7)  # Рост за 7 дней
     
     growth_text = "\n".join([f"• {date}: +{count}" for date, count in growth_data[-5:]])  # Последние 5 дней
     
@@ -93,7 +104,8 @@ async def show_users_stats(callback: types.CallbackQuery):
         f"📈 <b>Новых за неделю:</b> {stats['new_users_week']}\n"
         f"🗓️ <b>Новых за месяц:</b> {stats['new_users_month']}\n\n"
         "📊 <b>Рост пользователей (последние 5 дней):</b>\n"
-        f"{growth_text if growth_text else '• Нет данных'}"
+        f"{growth_text if growth_text else '• Нет данных'}\n\n"
+        f"🕒 <b>Обновлено:</b> {snapshot.updated_text}"
     )
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -108,18 +120,24 @@ async def show_users_stats(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "stats_activity")
-async def show_activity_stats(callback: types.CallbackQuery):
+async def show_activity_stats(callback: types.CallbackQuery, db: AsyncDatabase,
+                              stats_snapshots: StatsSnapshotService, top_users: TopActiveUsers):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
-    stats = db.get_detailed_stats()
-    activity_data = db.get_activity_data(7)  # Активность за 7 дней
-    top_users = db.get_top_active_users(5)  # Топ 5 активных пользователей
+    snapshot = await stats_snapshots.get()
+    stats = snapshot.stats
+    activity_data = snapshot.activity_for(7)  # Активность за 7 дней
+    # Топ 5 активных пользователей за 30 дней - из сводок Space-Saving
+    top_active = await top_users.fetch_top_active_users(5)
     
     activity_text = "\n".join([f"• {date}: {count} действий" for date, count in activity_data[-5:]])
     
-    top_users_text = "\n".join([f"• {user[2] or user[3] or user[1]}: {user[4]} действий" for user in top_users])
+    top_users_text = "\n".join([
+        f"• {user['first_name'] or user['username'] or user['user_id']}: {user['activity_count']} действий"
+        for user in top_active
+    ])
     
     text = (
         "📊 <b>Статистика активности</b>\n\n"
@@ -129,7 +147,8 @@ async def show_activity_stats(callback: types.CallbackQuery):
         "📊 <b>Активность по дням (последние 5 дней):</b>\n"
         f"{activity_text if activity_text else '• Нет данных'}\n\n"
         "🏆 <b>Топ-5 активных пользователей:</b>\n"
-        f"{top_users_text if top_users_text else '• Нет данных'}"
+        f"{top_users_text if top_users_text else '• Нет данных'}\n\n"
+        f"🕒 <b>Обновлено:</b> {snapshot.updated_text}"
     )
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -141,13 +160,14 @@ async def show_activity_stats(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "stats_mailings")
-async def show_mailings_stats(callback: types.CallbackQuery):
+async def show_mailings_stats(callback: types.CallbackQuery, db: AsyncDatabase,
+                              stats_snapshots: StatsSnapshotService):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
-    stats = db.get_detailed_stats()
-    mailing_performance = db.get_mailing_performance()
+    stats = (await stats_snapshots.get()).stats
+    mailing_performance = await db.get_mailing_performance()
     
     mailings_text = ""
     for mailing in mailing_performance[:5]:  # Последние 5 рассылок
@@ -174,12 +194,15 @@ async def show_mailings_stats(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "stats_segments")
-async def show_segments_stats(callback: types.CallbackQuery):
+async def show_segments_stats(callback: types.CallbackQuery, segment_index: SegmentIndex):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
-    segments = db.get_user_segments()
+    # Считается по битовому индексу, без запросов к базе
+    segments = segment_index.get_user_segments()
+    active_new = segment_index.bitmap('active_week') & segment_index.bitmap('new_month')
+    unreachable = segment_index.bitmap('unreachable')
     
     text = (
         "🎯 <b>Сегменты пользователей</b>\n\n"
@@ -188,6 +211,8 @@ async def show_segments_stats(callback: types.CallbackQuery):
         f"💤 <b>Неактивные пользователи (30+ дней):</b> {segments['inactive_users']}\n"
         f"👤 <b>С username:</b> {segments['users_with_username']}\n"
         f"👥 <b>Без username:</b> {segments['users_without_username']}\n\n"
+        f"🌱 <b>Активные за неделю из новых за месяц:</b> {(active_new - unreachable).count()}\n"
+        f"🚫 <b>Заблокировали бота:</b> {unreachable.count()}\n\n"
         "💡 <i>Используйте эти сегменты для таргетированных рассылок</i>"
     )
     
@@ -199,39 +224,171 @@ async def show_segments_stats(callback: types.CallbackQuery):
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
     await callback.answer()
 
-@router.callback_query(F.data == "stats_charts")
-async def show_charts_info(callback: types.CallbackQuery):
+def format_retention(value):
+    return "—" if value is None else f"{value:.1f}%"
+
+@router.callback_query(F.data.startswith("stats_retention"))
+async def show_retention_stats(callback: types.CallbackQuery, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
+    # stats_retention или stats_retention_{дней}
+    parts = callback.data.split("_")
+    cohort_days = int(parts[-1]) if len(parts) == 3 else COHORT_DAYS
+    report = await load_retention(db, cohort_days)
+    
+    overall_text = " · ".join(
+        f"D{day}: {format_retention(report.overall(day))}" for day in RETENTION_DAYS
+    )
+    
+    cohorts_text = ""
+    for row in report.rows()[:7]:  # Последние 7 когорт
+        rates = []
+        for day in RETENTION_DAYS[:2]:
+            active = row[f'day_{day}_active']
+            rates.append(f"D{day} {format_retention(None if active is None else active * 100 / row['cohort_size'])}")
+        cohorts_text += f"• {row['cohort_date']} ({row['cohort_size']}): {' · '.join(rates)}\n"
+    
     text = (
-        "📈 <b>Графики и аналитика</b>\n\n"
-        "📊 <b>Доступные графики:</b>\n"
-        "• Рост пользователей по дням\n"
-        "• Активность пользователей\n"
-        "• Эффективность рассылок\n"
-        "• Retention пользователей\n\n"
-        "💡 <i>Для просмотра детальных графиков используйте веб-панель аналитики</i>"
+        f"📉 <b>Удержание пользователей (когорты за {cohort_days} дней)</b>\n\n"
+        f"📊 <b>Возвращаются через N дней:</b>\n{overall_text}\n\n"
+        "🗓️ <b>Последние когорты:</b>\n"
+        f"{cohorts_text if cohorts_text else '• Нет данных за выбранный период'}\n"
+        "💡 <i>D1/D7/D30 - доля пользователей, активных через 1, 7 и 30 дней после регистрации</i>"
     )
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔄 Обновить", callback_data="stats_charts")],
+        [
+            InlineKeyboardButton(text="30 дней", callback_data="stats_retention_30"),
+            InlineKeyboardButton(text="60 дней", callback_data="stats_retention_60"),
+            InlineKeyboardButton(text="90 дней", callback_data="stats_retention_90")
+        ],
         [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_detailed_stats")]
     ])
     
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
     await callback.answer()
 
+def get_charts_keyboard(view: str):
+    """Выбор периода графика активных пользователей"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=("• " if name == view else "") + title,
+                                 callback_data=f"stats_charts_{name}")
+            for name, (_, _, _, title) in VIEWS.items()
+        ],
+        [InlineKeyboardButton(text="🔄 Обновить", callback_data=f"stats_charts_{view}")],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_detailed_stats")]
+    ])
+
+def _format_value(value):
+    return "—" if value is None else str(value)
+
+@router.callback_query(F.data.startswith("stats_charts"))
+async def show_charts(callback: types.CallbackQuery, activity_timeseries: ActivityTimeSeries):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
+
+    # stats_charts - по умолчанию 7 дней
+    view = callback.data[len("stats_charts_"):] or "7d"
+    if view not in VIEWS:
+        view = "7d"
+    _, _, label_format, title = VIEWS[view]
+
+    points = activity_timeseries.view(view)
+    current = activity_timeseries.current()
+    max_dau = max([values['dau'] or 0 for _, values in points] + [1])
+
+    lines = []
+    for point_end, values in points:
+        label = point_end.astimezone().strftime(label_format)
+        bar = "█" * round((values['dau'] or 0) * 10 / max_dau)
+        lines.append(
+            f"• {label}: {bar} {_format_value(values['dau'])} / {_format_value(values['wau'])} / "
+            f"{_format_value(values['mau'])} · {values['actions'] or 0}"
+        )
+
+    stickiness = (
+        f"{round(current['dau'] * 100 / current['mau'], 1)}%"
+        if current['dau'] is not None and current['mau'] else "—"
+    )
+    text = (
+        f"📈 <b>Активные пользователи за {title}</b>\n\n"
+        f"🔥 <b>Сейчас:</b> DAU {_format_value(current['dau'])} · "
+        f"WAU {_format_value(current['wau'])} · MAU {_format_value(current['mau'])}\n"
+        f"📌 <b>DAU/MAU:</b> {stickiness}\n\n"
+        f"<b>DAU / WAU / MAU · действий:</b>\n"
+        + "\n".join(lines)
+        + "\n\n💡 <i>DAU, WAU, MAU - активные за 24 часа, 7 и 30 дней на конец точки (оценка)</i>"
+    )
+
+    try:
+        await callback.message.edit_text(text, reply_markup=get_charts_keyboard(view), parse_mode="HTML")
+    except Exception as e:
+        if "message is not modified" not in str(e):
+            print(f"Ошибка при редактировании сообщения: {e}")
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("stats_heatmap"))
+async def show_activity_heatmap(callback: types.CallbackQuery, db: AsyncDatabase):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
+
+    # stats_heatmap - все действия, stats_heatmap_<action_type> - один тип
+    action_type = callback.data[len("stats_heatmap_"):] or None
+    heatmap = await load_heatmap(db)
+    if action_type not in heatmap.by_type:
+        action_type = None
+
+    grid = heatmap.grid(action_type)
+    by_hour = grid.sum(axis=0)
+    best_hours = [hour for hour in by_hour.argsort()[::-1][:3] if by_hour[hour] > 0]
+
+    peaks_text = "\n".join([
+        f"• {WEEKDAYS[weekday]} {hour:02d}:00 - {count} действий"
+        for weekday, hour, count in heatmap.best_hours(action_type, limit=5)
+    ]) or "• Нет данных"
+
+    text = (
+        f"🕒 <b>Активность по часам недели</b> ({action_title(action_type) if action_type else 'все действия'})\n\n"
+        f"<pre>{heatmap.render(action_type)}</pre>\n"
+        f"🔥 <b>Пиковые часы:</b>\n{peaks_text}\n\n"
+        f"⏰ <b>Лучшие часы для рассылки:</b> "
+        f"{', '.join(f'{hour:02d}:00' for hour in best_hours) or 'нет данных'}\n\n"
+        f"💡 <i>Время {heatmap.time_zone_text}, действий всего: {int(grid.sum())}</i>"
+    )
+
+    buttons = [[
+        InlineKeyboardButton(text=("• " if action_type is None else "") + "Все",
+                             callback_data="stats_heatmap")
+    ] + [
+        InlineKeyboardButton(text=("• " if name == action_type else "") + action_title(name),
+                             callback_data=f"stats_heatmap_{name}")
+        for name in heatmap.action_types[:4]
+    ]]
+    buttons.append([InlineKeyboardButton(text="🔄 Обновить", callback_data=callback.data)])
+    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="admin_detailed_stats")])
+
+    try:
+        await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+                                         parse_mode="HTML")
+    except Exception as e:
+        if "message is not modified" not in str(e):
+            print(f"Ошибка при редактировании сообщения: {e}")
+    await callback.answer()
+
 # Обработчики для разных периодов
 @router.callback_query(F.data.startswith("stats_users_"))
-async def show_users_stats_period(callback: types.CallbackQuery):
+async def show_users_stats_period(callback: types.CallbackQuery, stats_snapshots: StatsSnapshotService):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
     days = int(callback.data.split("_")[-1])
-    growth_data = db.get_user_growth_data(days)
+    growth_data = (await stats_snapshots.get()).growth_for(days)
     
     growth_text = "\n".join([f"• {date}: +{count}" for date, count in growth_data])
     
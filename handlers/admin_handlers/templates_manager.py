@@ -1,13 +1,13 @@
 from aiogram import Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database.db import Database
+from database.async_db import AsyncDatabase
 from config.config import Config
-from services.mailing_service import MailingService
+from services.mailing_tasks import MailingTaskRegistry
+from utils.keyboards import get_audience_keyboard
 from datetime import datetime
 
 router = Router()
-db = Database()
 
 def is_admin(user_id: int) -> bool:
     return user_id in Config.ADMIN_IDS
@@ -54,12 +54,12 @@ def get_templates_keyboard(templates, page=0, templates_per_page=5):
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 @router.callback_query(F.data == "admin_templates")
-async def show_templates_list(callback: types.CallbackQuery):
+async def show_templates_list(callback: types.CallbackQuery, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
-    templates = db.get_all_templates()
+    templates = await db.get_all_templates()
     
     if not templates:
         await safe_edit_message(
@@ -84,13 +84,13 @@ async def show_templates_list(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("templates_page_"))
-async def show_templates_page(callback: types.CallbackQuery):
+async def show_templates_page(callback: types.CallbackQuery, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
     page = int(callback.data.split("_")[-1])
-    templates = db.get_all_templates()
+    templates = await db.get_all_templates()
     
     await safe_edit_message(
         callback,
@@ -102,13 +102,13 @@ async def show_templates_page(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("template_"))
-async def show_template_details(callback: types.CallbackQuery):
+async def show_template_details(callback: types.CallbackQuery, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
     template_id = int(callback.data.split("_")[1])
-    template = db.get_template_by_id(template_id)
+    template = await db.get_template_by_id(template_id)
     
     if not template:
         await callback.answer("❌ Шаблон не найден")
@@ -146,13 +146,13 @@ async def show_template_details(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("preview_template_"))
-async def preview_template(callback: types.CallbackQuery, bot):
+async def preview_template(callback: types.CallbackQuery, bot, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
     template_id = int(callback.data.split("_")[2])
-    template = db.get_template_by_id(template_id)
+    template = await db.get_template_by_id(template_id)
     
     if not template:
         await callback.answer("❌ Шаблон не найден")
@@ -192,13 +192,13 @@ async def preview_template(callback: types.CallbackQuery, bot):
         await callback.answer(f"❌ Ошибка предпросмотра: {str(e)}")
 
 @router.callback_query(F.data.startswith("send_template_"))
-async def send_template_mailing(callback: types.CallbackQuery, state: FSMContext):
+async def send_template_mailing(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
     template_id = int(callback.data.split("_")[2])
-    template = db.get_template_by_id(template_id)
+    template = await db.get_template_by_id(template_id)
     
     if not template:
         await callback.answer("❌ Шаблон не найден")
@@ -215,7 +215,7 @@ async def send_template_mailing(callback: types.CallbackQuery, state: FSMContext
     )
     
     # Показываем выбор аудитории
-    audience_count = await get_audience_count('all')
+    audience_count = await db.get_audience_count('all')
     
     text = (
         f"📨 <b>Отправка шаблона:</b> {template['title']}\n\n"
@@ -224,37 +224,27 @@ async def send_template_mailing(callback: types.CallbackQuery, state: FSMContext
         "🎯 <b>Выберите целевую аудиторию:</b>"
     )
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="👥 Все пользователи", callback_data=f"send_audience_all_{template_id}"),
-            InlineKeyboardButton(text="🔥 Активные", callback_data=f"send_audience_active_week_{template_id}")
-        ],
-        [
-            InlineKeyboardButton(text="🆕 Новые (сегодня)", callback_data=f"send_audience_new_today_{template_id}"),
-            InlineKeyboardButton(text="📈 Новые (неделя)", callback_data=f"send_audience_new_week_{template_id}")
-        ],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data=f"template_{template_id}")]
-    ])
+    keyboard = get_audience_keyboard("send_audience_", f"template_{template_id}", f"_{template_id}")
     
     await safe_edit_message(callback, text, keyboard)
     await callback.answer()
 
 @router.callback_query(F.data.startswith("send_audience_"))
-async def send_template_to_audience(callback: types.CallbackQuery, bot):
+async def send_template_to_audience(callback: types.CallbackQuery, db: AsyncDatabase,
+                                    mailing_tasks: MailingTaskRegistry):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
-    parts = callback.data.split("_")
-    audience_type = parts[2]
-    template_id = int(parts[3])
+    # send_audience_<audience_type>_<template_id>, audience_type сам может содержать "_"
+    prefix, template_id = callback.data.rsplit("_", 1)
+    audience_type = prefix[len("send_audience_"):]
+    template_id = int(template_id)
     
-    template = db.get_template_by_id(template_id)
+    template = await db.get_template_by_id(template_id)
     if not template:
         await callback.answer("❌ Шаблон не найден")
         return
-
-    mailing_service = MailingService(bot)
     
     # Показываем уведомление о начале рассылки
     await callback.message.edit_text(
@@ -264,7 +254,7 @@ async def send_template_to_audience(callback: types.CallbackQuery, bot):
     )
     
     # Сохраняем рассылку (не как шаблон)
-    mailing_id = db.save_mailing(
+    mailing_id = await db.save_mailing(
         title=template['title'],
         message_text=template['message_text'],
         message_type=template['message_type'],
@@ -274,63 +264,30 @@ async def send_template_to_audience(callback: types.CallbackQuery, bot):
         is_template=False
     )
     
-    # Отправляем рассылку
-    success_count, total_count = await mailing_service.send_mailing(
-        mailing_id, 
-        template['message_text'],
-        template['message_type'],
-        template['media_type'],
-        template['media_file_id'],
-        audience_type
-    )
-    
-    delivery_rate = round((success_count/total_count)*100, 2) if total_count > 0 else 0
-    
-    await callback.message.edit_text(
-        f"✅ <b>Рассылка завершена!</b>\n\n"
-        f"📨 <b>Шаблон:</b> {template['title']}\n"
-        f"🎯 <b>Аудитория:</b> {audience_type}\n"
-        f"✅ <b>Успешно отправлено:</b> {success_count}/{total_count}\n"
-        f"📊 <b>Процент доставки:</b> {delivery_rate}%\n\n"
-        f"📅 <b>Время отправки:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📊 Статистика рассылок", callback_data="stats_mailings")],
-            [InlineKeyboardButton(text="📁 Другие шаблоны", callback_data="admin_templates")],
-            [InlineKeyboardButton(text="🔙 В админ-панель", callback_data="admin_refresh")]
-        ]),
-        parse_mode="HTML"
+    # Рассылка идет в фоне, прогресс и итог обновляются в этом же сообщении
+    await mailing_tasks.start(
+        mailing_id,
+        audience_type,
+        chat_id=callback.message.chat.id,
+        message_id=callback.message.message_id
     )
+    await callback.answer()
 
 @router.callback_query(F.data.startswith("delete_template_"))
-async def delete_template(callback: types.CallbackQuery):
+async def delete_template(callback: types.CallbackQuery, db: AsyncDatabase):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
     template_id = int(callback.data.split("_")[2])
-    template = db.get_template_by_id(template_id)
+    template = await db.get_template_by_id(template_id)
     
     if not template:
         await callback.answer("❌ Шаблон не найден")
         return
 
     # Удаляем шаблон (помечаем как не-шаблон)
-    db.update_template_status(template_id, False)
+    await db.update_template_status(template_id, False)
     
     await callback.answer("✅ Шаблон удален")
-    await show_templates_list(callback)
-
-async def get_audience_count(audience_type):
-    """Получить количество пользователей в выбранной аудитории"""
-    if audience_type == "all":
-        return db.get_user_count()
-    elif audience_type == "active_week":
-        stats = db.get_detailed_stats()
-        return stats['active_users_week']
-    elif audience_type == "new_today":
-        stats = db.get_detailed_stats()
-        return stats['new_users_today']
-    elif audience_type == "new_week":
-        stats = db.get_detailed_stats()
-        return stats['new_users_week']
-    return 0
\ No newline at end of file
+    await show_templates_list(callback, db)
\ No newline at end of file
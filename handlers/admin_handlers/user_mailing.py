@@ -4,13 +4,15 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config.config import Config
-from database.db import Database
-from services.mailing_service import MailingService
+from database.async_db import AsyncDatabase
+from services.mailing_tasks import MailingTaskRegistry
+from services.segment_index import SegmentIndex
+from database.segments import get_audience_title
+from utils.keyboards import get_audience_keyboard
 from datetime import datetime
 
 
 router = Router()
-db = Database()
 
 def is_admin(user_id: int) -> bool:
     return user_id in Config.ADMIN_IDS
@@ -20,21 +22,6 @@ class UserMailing(StatesGroup):
     writing_message = State()
     confirmation = State()
 
-def get_audience_selection_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="👥 Все пользователи", callback_data="audience_all"),
-            InlineKeyboardButton(text="🔥 Активные (неделя)", callback_data="audience_active_week")
-        ],
-        [
-            InlineKeyboardButton(text="🆕 Новые (сегодня)", callback_data="audience_new_today"),
-            InlineKeyboardButton(text="📈 Новые (неделя)", callback_data="audience_new_week")
-        ],
-        [
-            InlineKeyboardButton(text="🔙 Назад", callback_data="admin_refresh")
-        ]
-    ])
-
 @router.callback_query(F.data == "admin_users_management")
 async def user_management_menu(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
@@ -63,59 +50,54 @@ async def user_management_menu(callback: types.CallbackQuery):
     )
 
 @router.callback_query(F.data == "user_mailing_start")
-async def start_user_mailing(callback: types.CallbackQuery, state: FSMContext):
+async def start_user_mailing(callback: types.CallbackQuery, state: FSMContext, segment_index: SegmentIndex):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
     await state.set_state(UserMailing.selecting_audience)
     
-    stats = db.get_detailed_stats()
-    
     await callback.message.edit_text(
         "📨 <b>Рассылка пользователям</b>\n\n"
         f"📊 <b>Статистика аудитории:</b>\n"
-        f"• Всего пользователей: {stats['total_users']}\n"
-        f"• Новых сегодня: {stats['new_users_today']}\n"
-        f"• Активных за неделю: {stats['active_users_week']}\n\n"
+        f"• Всего пользователей: {segment_index.get_audience_count('all')}\n"
+        f"• Новых сегодня: {segment_index.get_audience_count('new_today')}\n"
+        f"• Активных за неделю: {segment_index.get_audience_count('active_week')}\n\n"
         "Выберите целевую аудиторию для рассылки:",
-        reply_markup=get_audience_selection_keyboard(),
+        reply_markup=get_audience_keyboard("audience_", "admin_refresh"),
         parse_mode="HTML"
     )
 
 @router.callback_query(UserMailing.selecting_audience, F.data.startswith("audience_"))
 async def select_audience(callback: types.CallbackQuery, state: FSMContext):
     audience_type = callback.data.replace("audience_", "")
-    audience_names = {
-        "all": "все пользователи",
-        "active_week": "активные за неделю",
-        "new_today": "новые сегодня",
-        "new_week": "новые за неделю"
-    }
     
     await state.update_data(audience_type=audience_type)
     await state.set_state(UserMailing.writing_message)
     
     await callback.message.edit_text(
-        f"🎯 <b>Целевая аудитория:</b> {audience_names.get(audience_type, audience_type)}\n\n"
+        f"🎯 <b>Целевая аудитория:</b> {get_audience_title(audience_type)}\n\n"
         "📝 <b>Введите сообщение для рассылки:</b>\n"
         "Вы можете использовать HTML-разметку.",
         parse_mode="HTML"
     )
 
 @router.message(UserMailing.writing_message)
-async def process_user_mailing_message(message: types.Message, state: FSMContext):
+async def process_user_mailing_message(message: types.Message, state: FSMContext, db: AsyncDatabase):
     await state.update_data(message_text=message.html_text)
     await state.set_state(UserMailing.confirmation)
     
     data = await state.get_data()
     
-    # Получаем количество пользователей в выбранной аудитории
-    user_count = await get_audience_count(data['audience_type'])
+    # Фиксируем получателей: рассылка уйдет ровно тем, кого посчитали в предпросмотре
+    if data.get('draft_job_id'):
+        await db.delete_draft_job(data['draft_job_id'])
+    draft_job_id, user_count = await db.create_recipient_snapshot(data['audience_type'])
+    await state.update_data(draft_job_id=draft_job_id)
     
     await message.answer(
         f"👁️ <b>Предпросмотр рассылки</b>\n\n"
-        f"🎯 <b>Аудитория:</b> {data['audience_type']} ({user_count} пользователей)\n"
+        f"🎯 <b>Аудитория:</b> {get_audience_title(data['audience_type'])} ({user_count} пользователей)\n"
         f"📝 <b>Сообщение:</b>\n{data['message_text']}\n\n"
         "✅ <i>Подтвердите отправку</i>",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -128,16 +110,13 @@ async def process_user_mailing_message(message: types.Message, state: FSMContext
     )
 
 @router.callback_query(UserMailing.confirmation, F.data == "confirm_user_mailing")
-async def confirm_user_mailing(callback: types.CallbackQuery, state: FSMContext):
+async def confirm_user_mailing(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase,
+                               mailing_tasks: MailingTaskRegistry):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа")
         return
 
     data = await state.get_data()
-    
- # Получаем бот из контекста
-    from main import bot
-    mailing_service = MailingService(bot)
         
     # Показываем уведомление о начале рассылки
     await callback.message.edit_text(
@@ -147,7 +126,7 @@ async def confirm_user_mailing(callback: types.CallbackQuery, state: FSMContext)
     )
     
     # Сохраняем рассылку
-    mailing_id = db.save_mailing(
+    mailing_id = await db.save_mailing(
         title=f"Быстрая рассылка - {datetime.now().strftime('%d.%m.%Y %H:%M')}",
         message_text=data['message_text'],
         message_type='text',
@@ -155,36 +134,23 @@ async def confirm_user_mailing(callback: types.CallbackQuery, state: FSMContext)
         is_template=False
     )
     
-    # Отправляем рассылку
-    success_count, total_count = await mailing_service.send_mailing(
-        mailing_id, 
-        data['message_text'],
-        'text',
-        None,
-        None,
-        data['audience_type']
-    )
-    
-    delivery_rate = round((success_count/total_count)*100, 2) if total_count > 0 else 0
-    
-    await callback.message.edit_text(
-        f"✅ <b>Рассылка завершена!</b>\n\n"
-        f"🎯 <b>Аудитория:</b> {data['audience_type']}\n"
-        f"✅ <b>Успешно отправлено:</b> {success_count}/{total_count}\n"
-        f"📊 <b>Процент доставки:</b> {delivery_rate}%\n\n"
-        f"📅 <b>Время отправки:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📊 Статистика рассылок", callback_data="stats_mailings")],
-            [InlineKeyboardButton(text="📨 Новая рассылка", callback_data="user_mailing_start")],
-            [InlineKeyboardButton(text="🔙 В админ-панель", callback_data="admin_refresh")]
-        ]),
-        parse_mode="HTML"
+    # Рассылка идет в фоне, прогресс и итог обновляются в этом же сообщении
+    await mailing_tasks.start(
+        mailing_id,
+        data['audience_type'],
+        chat_id=callback.message.chat.id,
+        message_id=callback.message.message_id,
+        draft_job_id=data.get('draft_job_id')
     )
     
     await state.clear()
+    await callback.answer()
 
 @router.callback_query(UserMailing.confirmation, F.data == "cancel_user_mailing")
-async def cancel_user_mailing(callback: types.CallbackQuery, state: FSMContext):
+async def cancel_user_mailing(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase):
+    data = await state.get_data()
+    if data.get('draft_job_id'):
+        await db.delete_draft_job(data['draft_job_id'])
     await state.clear()
     await callback.message.edit_text(
         "❌ <b>Рассылка отменена</b>",
@@ -192,19 +158,4 @@ async def cancel_user_mailing(callback: types.CallbackQuery, state: FSMContext):
             [InlineKeyboardButton(text="🔙 В админ-панель", callback_data="admin_refresh")]
         ]),
         parse_mode="HTML"
-    )
-
-async def get_audience_count(audience_type):
-    """Получить количество пользователей в выбранной аудитории"""
-    if audience_type == "all":
-        return db.get_user_count()
-    elif audience_type == "active_week":
-        stats = db.get_detailed_stats()
-        return stats['active_users_week']
-    elif audience_type == "new_today":
-        stats = db.get_detailed_stats()
-        return stats['new_users_today']
-    elif audience_type == "new_week":
-        stats = db.get_detailed_stats()
-        return stats['new_users_week']
-    return 0
\ No newline at end of file
+    )
\ No newline at end of file
@@ -3,7 +3,8 @@ from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from config.config import Config
-from services.mailing_service import MailingService
+from database.async_db import AsyncDatabase
+from services.mailing_tasks import MailingTaskRegistry
 
 router = Router()
 
@@ -22,26 +23,22 @@ async def start_new_mailing(callback: types.CallbackQuery, state: FSMContext):
     )
 
 @router.message(MailingStates.waiting_for_message)
-async def process_mailing_message(message: types.Message, state: FSMContext, bot):
+async def process_mailing_message(message: types.Message, state: FSMContext, db: AsyncDatabase,
+                                  mailing_tasks: MailingTaskRegistry):
     if not message.from_user.id in Config.ADMIN_IDS:
         await message.answer("Нет доступа")
         await state.clear()
         return
-
-    mailing_service = MailingService(bot)
-    db = mailing_service.db
     
     # Сохраняем рассылку в базу
-    mailing_id = db.save_mailing(message.text)
-    
-    # Отправляем рассылку
-    success_count, total_count = await mailing_service.send_mailing(
-        mailing_id, message.text
-    )
+    mailing_id = await db.save_mailing(message.text)
     
-    await message.answer(
-        f"✅ Рассылка завершена!\n"
-        f"Успешно отправлено: {success_count}/{total_count}"
+    # Отправляем рассылку в фоне, прогресс показываем в отдельном сообщении
+    progress_message = await message.answer("📨 Рассылка запущена...")
+    await mailing_tasks.start(
+        mailing_id,
+        chat_id=progress_message.chat.id,
+        message_id=progress_message.message_id
     )
     
     await state.clear()
\ No newline at end of file
@@ -1,15 +1,15 @@
 from aiogram import Router, types
 from aiogram.filters import Command
-from database.db import Database
+from database.async_db import AsyncDatabase
+from services.activity_recorder import ActivityRecorder
 
 router = Router()
-db = Database()
 
 @router.message(Command("start"))
-async def start_command(message: types.Message):
+async def start_command(message: types.Message, db: AsyncDatabase, activity_recorder: ActivityRecorder):
     user = message.from_user
-    db.add_user(user.id, user.username, user.first_name, user.last_name)
-    db.record_user_activity(user.id, "start")
+    await db.add_user(user.id, user.username, user.first_name, user.last_name)
+    activity_recorder.record(user.id, "start")
     
     await message.answer(
         "👋 <b>Добро пожаловать!</b>\n\n"
@@ -23,8 +23,8 @@ async def start_command(message: types.Message):
     )
 
 @router.message(Command("help"))
-async def help_command(message: types.Message):
-    db.record_user_activity(message.from_user.id, "help")
+async def help_command(message: types.Message, activity_recorder: ActivityRecorder):
+    activity_recorder.record(message.from_user.id, "help")
     
     await message.answer(
         "ℹ️ <b>Помощь по боту</b>\n\n"
@@ -50,10 +50,10 @@ async def get_my_id(message: types.Message):
     )
 
 @router.message()
-async def track_user_activity(message: types.Message):
+async def track_user_activity(message: types.Message, activity_recorder: ActivityRecorder):
     """Отслеживаем активность пользователей"""
     if message.from_user:
-        db.record_user_activity(message.from_user.id, "message")
+        activity_recorder.record(message.from_user.id, "message")
         
         # Отвечаем на неизвестные команды
         if message.text and message.text.startswith('/'):
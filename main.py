@@ -4,18 +4,27 @@ from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand
 from config.config import Config
 from database.db import Database
+from database.async_db import AsyncDatabase
+from services.activity_recorder import ActivityRecorder
+from services.mailing_tasks import MailingTaskRegistry
+from services.segment_index import SegmentIndex
+from services.stats_snapshots import StatsSnapshotService
+from services.active_users import ActiveUserSketches
+from services.top_users import TopActiveUsers
+from services.activity_timeseries import ActivityTimeSeries
 
 # Заменяем неправильные импорты на правильные
 from handlers.user import router as user_router
-from handlers.debug import router as debug_router
-from admin_handlers.main_menu import router as admin_main_router
-from admin_handlers.admin import router as admin_router
-from admin_handlers.statistics import router as stats_router
-from admin_handlers.excel_reports import router as excel_reports_router
-from admin_handlers.mailing_creator import router as mailing_creator_router
-from admin_handlers.templates_manager import router as templates_router
-from admin_handlers.mailing_history import router as mailing_history_router
-from admin_handlers.user_mailing import router as user_mailing_router
+from handlers.admin_handlers.debug import router as debug_router
+from handlers.admin_handlers.main_menu import router as admin_main_router
+from handlers.admin import router as admin_router
+from handlers.admin_handlers.statistics import router as stats_router
+from handlers.admin_handlers.excel_reports import router as excel_reports_router
+from handlers.admin_handlers.mailing_creator import router as mailing_creator_router
+from handlers.admin_handlers.templates_manager import router as templates_router
+from handlers.admin_handlers.mailing_history import router as mailing_history_router
+from handlers.admin_handlers.user_mailing import router as user_mailing_router
+from handlers.admin_handlers.mailing_control import router as mailing_control_router
 
 # Настройка логирования
 logging.basicConfig(
@@ -46,13 +55,45 @@ async def main():
         logger.error(f"Ошибка конфигурации: {e}")
         return
     
+    # Инициализация базы данных: один пул соединений на весь процесс
+    db = AsyncDatabase(Database())
+    logger.info("База данных инициализирована")
+    
+    # Активность пользователей пишется в базу пачками в фоне
+    activity_recorder = ActivityRecorder(db)
+    
+    # Битовый индекс сегментов аудитории: активность, новые пользователи и
+    # недоступность попадают в него сразу после записи
+    segment_index = SegmentIndex(db)
+    activity_recorder.add_listener(segment_index.on_activity)
+    db.add_listener('users', segment_index.on_users)
+    db.add_listener('unreachable', segment_index.on_unreachable)
+    
+    # Скетчи HyperLogLog активных пользователей за часы и дни
+    active_users = ActiveUserSketches(db)
+    activity_recorder.add_listener(active_users.on_activity)
+    
+    # Самые активные пользователи по дням (Space-Saving)
+    top_users = TopActiveUsers(db)
+    activity_recorder.add_listener(top_users.on_activity)
+    
+    # Почасовые ряды DAU/WAU/MAU и действий для графиков
+    activity_timeseries = ActivityTimeSeries(db, active_users)
+    activity_recorder.add_listener(activity_timeseries.on_activity)
+    
+    # Снимок статистики для админ-панели, пересчитывается по расписанию
+    stats_snapshots = StatsSnapshotService(db, active_users=active_users)
+    
     # Инициализация бота и диспетчера
+    # Сервисы передаются в обработчики по имени аргумента
+    # (db, activity_recorder, mailing_tasks, segment_index, stats_snapshots, active_users, top_users,
+    #  activity_timeseries)
     bot = Bot(token=Config.BOT_TOKEN)
-    dp = Dispatcher()
-    
-    # Инициализация базы данных
-    db = Database()
-    logger.info("База данных инициализирована")
+    mailing_tasks = MailingTaskRegistry(bot, db)
+    dp = Dispatcher(db=db, activity_recorder=activity_recorder, mailing_tasks=mailing_tasks,
+                    segment_index=segment_index, stats_snapshots=stats_snapshots,
+                    active_users=active_users, top_users=top_users,
+                    activity_timeseries=activity_timeseries)
     
     # Регистрируем роутеры в правильном порядке
     # Сначала пользовательские, потом админские
@@ -66,18 +107,37 @@ async def main():
     dp.include_router(templates_router)
     dp.include_router(mailing_history_router)
     dp.include_router(user_mailing_router)
+    dp.include_router(mailing_control_router)
     
     logger.info("Все роутеры зарегистрированы")
     
     # Устанавливаем команды бота
     await set_bot_commands(bot)
     
+    activity_recorder.start()
+    await segment_index.start()
+    await active_users.start()
+    await top_users.start()
+    await activity_timeseries.start()
+    await stats_snapshots.start()
+    
+    # Продолжаем рассылки, прерванные предыдущим перезапуском
+    await mailing_tasks.resume_unfinished()
+    
     try:
         logger.info("Бот запущен и готов к работе")
         await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
+        await mailing_tasks.shutdown()
+        await stats_snapshots.stop()
+        await segment_index.stop()
+        await activity_recorder.stop()
+        # После записи остатка активности, чтобы он попал в сохраненные скетчи
+        await active_users.stop()
+        await top_users.stop()
+        await activity_timeseries.stop()
         db.close()
         await bot.session.close()
         logger.info("Бот остановлен")
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from config.config import Config
+from database.async_db import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Точность HyperLogLog: 2^14 регистров (16 КБ на скетч), стандартная ошибка ~0.8%
+PRECISION = 14
+REGISTERS = 1 << PRECISION
+# Биты хеша после номера регистра; 50 бит точно представимы во float64
+RANK_BITS = 64 - PRECISION
+
+HOUR_FORMAT = '%Y-%m-%d %H'
+DAY_FORMAT = '%Y-%m-%d'
+
+
+def _hash(user_ids):
+    """splitmix64 - перемешивание user_id в равномерный 64-битный хеш"""
+    x = np.asarray(user_ids, dtype=np.int64).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class HyperLogLog:
+    """Приближенное число различных пользователей в фиксированной памяти.
+
+    Скетчи объединяются поэлементным максимумом регистров, поэтому окно
+    из нескольких часов или дней считается без повторного чтения событий,
+    а повторное добавление того же пользователя ничего не меняет.
+    """
+
+    ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+    def __init__(self, registers: np.ndarray = None):
+        self.registers = registers if registers is not None else np.zeros(REGISTERS, dtype=np.uint8)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        return cls(np.frombuffer(data, dtype=np.uint8).copy())
+
+    def to_bytes(self):
+        return self.registers.tobytes()
+
+    def add(self, user_ids):
+        hashes = _hash(user_ids)
+        index = (hashes >> np.uint64(RANK_BITS)).astype(np.intp)
+        rest = hashes & np.uint64((1 << RANK_BITS) - 1)
+        # Номер первой единицы в оставшихся битах (RANK_BITS + 1, если их нет)
+        _, exponent = np.frexp(rest.astype(np.float64))
+        ranks = (RANK_BITS + 1 - exponent).astype(np.uint8)
+        np.maximum.at(self.registers, index, ranks)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @classmethod
+    def union(cls, sketches):
+        sketches = list(sketches)
+        if not sketches:
+            return cls()
+        return cls(np.maximum.reduce([sketch.registers for sketch in sketches]))
+
+    def count(self):
+        registers = self.registers
+        estimate = self.ALPHA * REGISTERS * REGISTERS / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(registers == 0))
+        # Малые значения - линейный подсчет по пустым регистрам
+        if estimate <= 2.5 * REGISTERS and zeros:
+            estimate = REGISTERS * np.log(REGISTERS / zeros)
+        return int(round(estimate))
+
+
+class ActiveUserSketches:
+    """Скетчи активных пользователей по часам и по дням (UTC).
+
+    Часовые скетчи хранятся ACTIVE_USERS_HOURLY_DAYS дней и дают окна
+    «последние N часов» (24 ч, 7 дней), дневные - ACTIVE_USERS_DAILY_DAYS
+    дней для окон по календарным дням и произвольных диапазонов. Окно
+    считается объединением скетчей, без COUNT(DISTINCT) по user_activity.
+
+    Пополняются после записи активности (ActivityRecorder.add_listener) и
+    сохраняются в activity_sketches раз в ACTIVE_USERS_SAVE_INTERVAL
+    секунд. При запуске события после последнего сохраненного часа
+    добавляются заново - добавление идемпотентно.
+    Точные значения для отчетов по-прежнему дает Database.get_detailed_stats().
+    """
+
+    def __init__(self, db: AsyncDatabase, save_interval: float = None,
+                 hourly_days: int = None, daily_days: int = None):
+        self.db = db
+        self.save_interval = save_interval or Config.ACTIVE_USERS_SAVE_INTERVAL
+        self.hourly_days = hourly_days or Config.ACTIVE_USERS_HOURLY_DAYS
+        self.daily_days = daily_days or Config.ACTIVE_USERS_DAILY_DAYS
+
+        self.hourly = {}
+        self.daily = {}
+        self._dirty = set()
+        self._task = None
+
+    def add(self, events):
+        """Учесть события [(user_id, action_type, timestamp), ...]"""
+        hours = {}
+        for user_id, _, timestamp in events:
+            hours.setdefault(timestamp[:13], []).append(user_id)
+        for hour, user_ids in hours.items():
+            self._add_to('hour', hour, user_ids)
+            self._add_to('day', hour[:10], user_ids)
+
+    # Обработчик для ActivityRecorder.add_listener
+    on_activity = add
+
+    def _add_to(self, period: str, bucket: str, user_ids):
+        sketches = self.hourly if period == 'hour' else self.daily
+        sketch = sketches.get(bucket)
+        if sketch is None:
+            sketch = sketches[bucket] = HyperLogLog()
+        sketch.add(user_ids)
+        self._dirty.add((period, bucket))
+
+    # --- Запросы ---
+
+    def count_hours(self, hours: int, now: datetime = None):
+        """Активные за последние hours часовых скетчей, включая текущий час.
+
+        Окно - с начала часа now - (hours - 1) по now, то есть от hours - 1
+        до hours часов: по часовым скетчам точная граница datetime('now',
+        '-1 day') недостижима, и окно не выходит за заданную длину.
+        """
+        now = now or datetime.now(timezone.utc)
+        buckets = [(now - timedelta(hours=offset)).strftime(HOUR_FORMAT) for offset in range(hours)]
+        return HyperLogLog.union(self.hourly[b] for b in buckets if b in self.hourly).count()
+
+    def count_days(self, start: str, end: str = None):
+        """Активные за календарные дни UTC с start по end включительно ('YYYY-MM-DD')"""
+        end = end or datetime.now(timezone.utc).strftime(DAY_FORMAT)
+        return HyperLogLog.union(
+            sketch for day, sketch in self.daily.items() if start <= day <= end
+        ).count()
+
+    def count_last_days(self, days: int):
+        """Активные за последние days календарных дней, включая сегодня"""
+        start = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime(DAY_FORMAT)
+        return self.count_days(start)
+
+    def get_active_counts(self):
+        """Оценки для get_detailed_stats / get_user_segments: 24 ч, 7 и 30 дней"""
+        return {
+            'day': self.count_hours(24),
+            'week': self.count_hours(7 * 24),
+            'month': self.count_last_days(30),
+        }
+
+    # --- Хранение ---
+
+    def _prune(self):
+        now = datetime.now(timezone.utc)
+        hourly_before = (now - timedelta(days=self.hourly_days)).strftime(HOUR_FORMAT)
+        daily_before = (now - timedelta(days=self.daily_days)).strftime(DAY_FORMAT)
+        for bucket in [b for b in self.hourly if b < hourly_before]:
+            del self.hourly[bucket]
+        for bucket in [b for b in self.daily if b < daily_before]:
+            del self.daily[bucket]
+        return hourly_before, daily_before
+
+    async def save(self):
+        """Сохранить измененные скетчи и удалить устаревшие"""
+        hourly_before, daily_before = self._prune()
+        dirty, self._dirty = self._dirty, set()
+        rows = []
+        for period, bucket in dirty:
+            sketch = (self.hourly if period == 'hour' else self.daily).get(bucket)
+            if sketch is not None:
+                rows.append((period, bucket, sketch.to_bytes()))
+        try:
+            await self.db.save_activity_sketches(rows, hourly_before, daily_before)
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+    async def load(self):
+        """Загрузить скетчи и досчитать активность, записанную после последнего сохранения"""
+        started = time.perf_counter()
+        for period, bucket, registers in await self.db.get_activity_sketches():
+            sketches = self.hourly if period == 'hour' else self.daily
+            sketches[bucket] = HyperLogLog.from_bytes(registers)
+
+        now = datetime.now(timezone.utc)
+        hourly_since = (now - timedelta(days=self.hourly_days)).strftime(HOUR_FORMAT)
+        if self.hourly:
+            # Последний сохраненный час мог быть сохранен не полностью
+            since = max(max(self.hourly), hourly_since)
+        else:
+            # Первый запуск: дневные скетчи - по user_daily_activity
+            since = hourly_since
+            daily_since = (now - timedelta(days=self.daily_days)).strftime(DAY_FORMAT)
+            days = {}
+            for day, user_id in await self.db.get_daily_active_users(daily_since):
+                days.setdefault(day, []).append(user_id)
+            for day, user_ids in days.items():
+                self._add_to('day', day, user_ids)
+
+        rows = await self.db.get_hourly_active_users(f'{since}:00:00')
+        self.add([(user_id, None, hour) for hour, user_id in rows])
+        self._prune()
+        logger.info(f"Скетчи активных пользователей загружены за {time.perf_counter() - started:.2f} сек")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить скетчи активных пользователей: {e}")
+
+    async def start(self):
+        await self.load()
+        await self.save()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save()
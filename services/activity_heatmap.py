@@ -0,0 +1,97 @@
+import logging
+import numpy as np
+from datetime import datetime
+from database.async_db import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+# Подписи типов действий из ActivityRecorder.record
+ACTION_TITLES = {
+    'start': '/start',
+    'help': '/help',
+    'message': 'Сообщения',
+}
+
+# Оттенки ячеек текстовой тепловой карты - от пустой к максимальной
+SHADES = ' ░▒▓█'
+
+
+def action_title(action_type: str):
+    return ACTION_TITLES.get(action_type, action_type)
+
+
+def local_utc_offset():
+    """Смещение местного времени сервера от UTC в часах.
+
+    None, если смещение не целое (например, UTC+5:30): ячейки карты -
+    целые часы UTC, и сдвинуть их на полчаса нельзя.
+    """
+    seconds = int(datetime.now().astimezone().utcoffset().total_seconds())
+    if seconds % 3600:
+        return None
+    return seconds // 3600
+
+
+class ActivityHeatmap:
+    """Число действий по дню недели и часу (7x24), всего и по типам действий.
+
+    Строится из activity_heatmap (UTC) и сдвигается в местное время
+    сервера. Если смещение местного времени не кратно часу, карта остается
+    в UTC (utc_offset = 0, local = False) - это видно в подписи time_zone_text.
+    """
+
+    def __init__(self, rows, utc_offset: int = None):
+        """rows - [(action_type, weekday, hour, count), ...] из Database.get_activity_heatmap"""
+        if utc_offset is None:
+            utc_offset = local_utc_offset()
+            if utc_offset is None:
+                logger.warning("Смещение местного времени не кратно часу, карта активности строится в UTC")
+        self.local = utc_offset is not None
+        self.utc_offset = utc_offset or 0
+        self.by_type = {}
+        for action_type, weekday, hour, count in rows:
+            grid = self.by_type.setdefault(action_type, np.zeros(7 * 24, dtype=np.int64))
+            grid[weekday * 24 + hour] += count
+        # Час недели по UTC -> час недели по местному времени
+        for action_type, grid in self.by_type.items():
+            self.by_type[action_type] = np.roll(grid, self.utc_offset).reshape(7, 24)
+
+    @property
+    def time_zone_text(self):
+        """Подпись часового пояса карты"""
+        if self.local:
+            return f"местное (UTC{self.utc_offset:+d})"
+        return "UTC (смещение местного времени не кратно часу)"
+
+    @property
+    def action_types(self):
+        """Типы действий по убыванию числа действий"""
+        return sorted(self.by_type, key=lambda action_type: -int(self.by_type[action_type].sum()))
+
+    def grid(self, action_type: str = None):
+        """Матрица 7x24 [день недели (0 = понедельник), час]"""
+        if action_type is not None:
+            return self.by_type.get(action_type, np.zeros((7, 24), dtype=np.int64))
+        return sum(self.by_type.values(), np.zeros((7, 24), dtype=np.int64))
+
+    def best_hours(self, action_type: str = None, limit: int = 3):
+        """[(weekday, hour, count), ...] - самые активные часы недели"""
+        grid = self.grid(action_type).ravel()
+        order = np.argsort(-grid, kind='stable')[:limit]
+        return [(int(index) // 24, int(index) % 24, int(grid[index])) for index in order if grid[index] > 0]
+
+    def render(self, action_type: str = None):
+        """Текстовая тепловая карта: строка на день недели, символ на час"""
+        grid = self.grid(action_type)
+        peak = grid.max()
+        levels = np.zeros_like(grid) if peak == 0 else np.ceil(grid * (len(SHADES) - 1) / peak).astype(int)
+        lines = ["   " + "".join(f"{hour:<6}" for hour in range(0, 24, 6))]
+        for weekday in range(7):
+            lines.append(f"{WEEKDAYS[weekday]} " + "".join(SHADES[level] for level in levels[weekday]))
+        return "\n".join(lines)
+
+
+async def load_heatmap(db: AsyncDatabase):
+    return ActivityHeatmap(await db.get_activity_heatmap())
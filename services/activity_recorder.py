@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from config.config import Config
+from database.async_db import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+def utc_timestamp():
+    """Текущее время в формате CURRENT_TIMESTAMP SQLite (UTC)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class LastSeenTracker:
+    """In-memory таблица последней активности пользователей.
+
+    Вместо UPDATE users на каждое сообщение хранит последнее время
+    активности каждого пользователя и отдает накопленное не чаще, чем раз
+    в window секунд - сколько бы сообщений пользователь ни прислал.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._pending = {}
+        self._last_drain = time.monotonic()
+
+    def touch(self, user_id: int, timestamp: str):
+        if timestamp > self._pending.get(user_id, ''):
+            self._pending[user_id] = timestamp
+
+    def is_due(self):
+        return bool(self._pending) and time.monotonic() - self._last_drain >= self.window
+
+    def drain(self):
+        """Забрать накопленные обновления [(timestamp, user_id), ...]"""
+        pending, self._pending = self._pending, {}
+        self._last_drain = time.monotonic()
+        return [(timestamp, user_id) for user_id, timestamp in pending.items()]
+
+    def restore(self, updates):
+        """Вернуть обновления, которые не удалось записать"""
+        for timestamp, user_id in updates:
+            self.touch(user_id, timestamp)
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class ActivityRecorder:
+    """Отложенная пакетная запись активности пользователей.
+
+    Обработчики только кладут событие в буфер, а фоновая задача сбрасывает
+    его в базу одной транзакцией каждые flush_interval секунд или сразу,
+    как только накопилось batch_size событий. users.last_activity
+    обновляется через LastSeenTracker не чаще раза в last_seen_window
+    секунд. При остановке бота все сбрасывается полностью.
+    """
+
+    def __init__(self, db: AsyncDatabase, flush_interval: float = None, batch_size: int = None,
+                 last_seen_window: float = None):
+        self.db = db
+        self.flush_interval = flush_interval or Config.ACTIVITY_FLUSH_INTERVAL
+        self.batch_size = batch_size or Config.ACTIVITY_BATCH_SIZE
+        self.last_seen = LastSeenTracker(last_seen_window or Config.LAST_ACTIVITY_WINDOW)
+        # Если база недоступна, буфер не должен расти бесконечно
+        self.max_buffer = self.batch_size * 100
+
+        self._buffer = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._stopping = False
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """callback(events) вызывается после успешной записи каждой пачки событий"""
+        self._listeners.append(callback)
+
+    def record(self, user_id: int, action_type: str = "message"):
+        """Добавить событие в буфер (без обращения к базе)"""
+        timestamp = utc_timestamp()
+        self._buffer.append((user_id, action_type, timestamp))
+        self.last_seen.touch(user_id, timestamp)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self, force: bool = False):
+        """Записать накопленные события одной транзакцией.
+
+        force=True дополнительно сбрасывает last_activity, даже если окно
+        LastSeenTracker еще не истекло.
+        """
+        async with self._flush_lock:
+            last_seen = self.last_seen.drain() if force or self.last_seen.is_due() else []
+            if not self._buffer and not last_seen:
+                return 0
+
+            events, self._buffer = self._buffer, []
+            try:
+                await self.db.record_activity_batch(events, last_seen)
+            except Exception as e:
+                logger.error(f"Не удалось записать активность ({len(events)} событий): {e}")
+                # Возвращаем события в начало буфера, чтобы повторить попытку
+                self._buffer = (events + self._buffer)[-self.max_buffer:]
+                self.last_seen.restore(last_seen)
+                return 0
+
+            for listener in self._listeners:
+                try:
+                    listener(events)
+                except Exception as e:
+                    logger.error(f"Ошибка обработчика записанной активности: {e}")
+
+            return len(events)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+            logger.info("Запись активности запущена")
+
+    async def stop(self):
+        """Остановить фоновую задачу и сбросить остаток буфера"""
+        # Не отменяем задачу, а даем ей закончить текущую запись: иначе
+        # взятая из буфера пачка потеряется или запишется без уведомления
+        # обработчиков (add_listener)
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+        flushed = await self.flush(force=True)
+        logger.info(f"Запись активности остановлена, сброшено событий: {flushed}")
@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import numpy as np
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from config.config import Config
+from database.async_db import AsyncDatabase
+from services.active_users import ActiveUserSketches
+
+logger = logging.getLogger(__name__)
+
+HOUR = 60 * 60
+HOUR_FORMAT = '%Y-%m-%d %H'
+DAY_FORMAT = '%Y-%m-%d'
+
+# Нет данных за час (бот не работал, история еще не накоплена)
+EMPTY = -1
+
+# Представления: (часов в окне, часов в точке, формат подписи, название)
+VIEWS = {
+    '24h': (24, 2, '%H:%M', '24 часа'),
+    '7d': (7 * 24, 12, '%d.%m %H:%M', '7 дней'),
+    '90d': (90 * 24, 7 * 24, '%d.%m', '90 дней'),
+}
+
+
+def hour_index(hour: str):
+    """'YYYY-MM-DD HH' (UTC) -> номер часа от эпохи"""
+    moment = datetime.strptime(hour, HOUR_FORMAT).replace(tzinfo=timezone.utc)
+    return int(moment.timestamp()) // HOUR
+
+
+def hour_start(index: int):
+    """Номер часа -> начало часа (UTC)"""
+    return datetime.fromtimestamp(index * HOUR, timezone.utc)
+
+
+class HourlyRing:
+    """Кольцевой буфер почасовых значений фиксированного размера.
+
+    Значение часа h лежит в ячейке h % size; head - последний записанный
+    час. При переходе на новый час пропущенные ячейки очищаются, так что
+    буфер всегда хранит последние size часов. mode задает прореживание:
+    'sum' - счетчик (значения складываются), 'last' - показатель на конец
+    часа (берется последнее известное значение).
+    """
+
+    def __init__(self, size: int, mode: str, values: np.ndarray = None, head: int = None):
+        self.size = size
+        self.mode = mode
+        self.values = values if values is not None else np.full(size, EMPTY, dtype=np.int32)
+        self.head = head
+
+    @classmethod
+    def from_bytes(cls, size: int, mode: str, head: int, data: bytes):
+        ring = cls(size, mode)
+        stored = np.frombuffer(data, dtype=np.int32)
+        # Размер мог измениться (TIMESERIES_DAYS) - переносим последние часы
+        for hour in range(head - min(len(stored), size) + 1, head + 1):
+            ring.values[hour % size] = stored[hour % len(stored)]
+        ring.head = head
+        return ring
+
+    def to_bytes(self):
+        return self.values.tobytes()
+
+    def _slot(self, hour: int):
+        if self.head is None or hour > self.head:
+            self._advance(hour)
+        if hour <= self.head - self.size:
+            return None
+        return hour % self.size
+
+    def _advance(self, hour: int):
+        if self.head is not None:
+            if hour - self.head >= self.size:
+                self.values[:] = EMPTY
+            else:
+                self.values[np.arange(self.head + 1, hour + 1) % self.size] = EMPTY
+        self.head = hour
+
+    def add(self, hour: int, value: int):
+        slot = self._slot(hour)
+        if slot is not None:
+            self.values[slot] = max(self.values[slot], 0) + value
+
+    def set(self, hour: int, value: int):
+        slot = self._slot(hour)
+        if slot is not None:
+            self.values[slot] = value
+
+    def get(self, hour: int):
+        if self.head is None or hour > self.head or hour <= self.head - self.size:
+            return EMPTY
+        return int(self.values[hour % self.size])
+
+    def clear(self, since: int):
+        """Очистить часы начиная с since (перед повторным подсчетом)"""
+        if self.head is not None:
+            for hour in range(max(since, self.head - self.size + 1), self.head + 1):
+                self.values[hour % self.size] = EMPTY
+
+    def window(self, hours: int, end: int):
+        """Значения часов end - hours + 1 ... end, от старых к новым"""
+        index = np.arange(end - hours + 1, end + 1)
+        result = np.full(hours, EMPTY, dtype=np.int64)
+        if self.head is not None:
+            known = (index <= self.head) & (index > self.head - self.size)
+            result[known] = self.values[index[known] % self.size]
+        return result
+
+    def downsample(self, hours: int, step: int, end: int):
+        """Окно из hours часов, прореженное до точек по step часов.
+
+        Точка заканчивается часом end, end - step, ...; если hours не
+        делится на step, первая точка захватывает часы до начала окна.
+        """
+        hours += -hours % step
+        values = self.window(hours, end).reshape(-1, step)
+        known = values >= 0
+        if self.mode == 'sum':
+            result = np.where(known, values, 0).sum(axis=1)
+        else:
+            # Последнее известное значение в каждой точке
+            last = step - 1 - np.argmax(known[:, ::-1], axis=1)
+            result = values[np.arange(len(values)), last]
+        result[~known.any(axis=1)] = EMPTY
+        return result
+
+
+class ActivityTimeSeries:
+    """Почасовые ряды активности за TIMESERIES_DAYS дней для графиков.
+
+    Ряды:
+    - actions - число действий за час, пополняется после записи
+      активности (ActivityRecorder.add_listener);
+    - dau, wau, mau - активные за 24 часа, 7 и 30 дней на конец часа,
+      раз в TIMESERIES_SAVE_INTERVAL секунд берутся из скетчей
+      ActiveUserSketches.
+
+    Ряды - кольцевые буферы HourlyRing, сохраняются в timeseries и
+    прореживаются для представлений VIEWS, так что графики строятся без
+    запросов к user_activity. При запуске действия за последние часы
+    досчитываются заново, а пропуски dau/wau/mau заполняются по скетчам.
+    """
+
+    METRICS = {'actions': 'sum', 'dau': 'last', 'wau': 'last', 'mau': 'last'}
+
+    def __init__(self, db: AsyncDatabase, active_users: ActiveUserSketches,
+                 days: int = None, save_interval: float = None):
+        self.db = db
+        self.active_users = active_users
+        self.hours = (days or Config.TIMESERIES_DAYS) * 24
+        self.save_interval = save_interval or Config.TIMESERIES_SAVE_INTERVAL
+
+        self.series = {metric: HourlyRing(self.hours, mode) for metric, mode in self.METRICS.items()}
+        self._task = None
+
+    def add(self, events):
+        """Учесть события [(user_id, action_type, timestamp), ...]"""
+        for hour, count in Counter(timestamp[:13] for _, _, timestamp in events).items():
+            self.series['actions'].add(hour_index(hour), count)
+
+    # Обработчик для ActivityRecorder.add_listener
+    on_activity = add
+
+    def sample(self, now: datetime = None):
+        """Записать текущие оценки активных пользователей в текущий час"""
+        now = now or datetime.now(timezone.utc)
+        hour = int(now.timestamp()) // HOUR
+        counts = self.active_users.get_active_counts()
+        self.series['dau'].set(hour, counts['day'])
+        self.series['wau'].set(hour, counts['week'])
+        self.series['mau'].set(hour, counts['month'])
+        # Счетчик тоже переходит на текущий час, даже если действий не было
+        self.series['actions'].add(hour, 0)
+
+    # --- Запросы ---
+
+    def current(self):
+        """{'dau', 'wau', 'mau'} - последние записанные значения (None - еще нет)"""
+        result = {}
+        for metric in ('dau', 'wau', 'mau'):
+            ring = self.series[metric]
+            value = ring.get(ring.head) if ring.head is not None else EMPTY
+            result[metric] = value if value != EMPTY else None
+        return result
+
+    def view(self, name: str, now: datetime = None):
+        """[(конец точки UTC, {'actions', 'dau', 'wau', 'mau'}), ...] для VIEWS[name].
+
+        Значение None - данных за точку нет.
+        """
+        hours, step, _, _ = VIEWS[name]
+        hours = min(hours, self.hours)
+        end = int((now or datetime.now(timezone.utc)).timestamp()) // HOUR
+        columns = {metric: ring.downsample(hours, step, end) for metric, ring in self.series.items()}
+        points = []
+        for i in range(len(columns['actions'])):
+            point_end = hour_start(end - (len(columns['actions']) - 1 - i) * step + 1)
+            values = {metric: int(column[i]) if column[i] >= 0 else None for metric, column in columns.items()}
+            points.append((point_end, values))
+        return points
+
+    # --- Хранение ---
+
+    async def save(self):
+        rows = [(metric, ring.head, ring.to_bytes()) for metric, ring in self.series.items()
+                if ring.head is not None]
+        await self.db.save_timeseries(rows)
+
+    async def load(self):
+        for metric, head, data in await self.db.get_timeseries():
+            if metric in self.series:
+                self.series[metric] = HourlyRing.from_bytes(self.hours, self.METRICS[metric], head, data)
+
+        now = int(datetime.now(timezone.utc).timestamp()) // HOUR
+        actions = self.series['actions']
+        # Последний сохраненный час мог быть сохранен не полностью, а события
+        # конца предыдущего часа - записаны уже после сохранения
+        since = max(actions.head - 1, now - self.hours + 1) if actions.head is not None else now - self.hours + 1
+        actions.clear(since)
+        for hour, count in await self.db.get_hourly_action_counts(hour_start(since).strftime('%Y-%m-%d %H:%M:%S')):
+            actions.add(hour_index(hour), count)
+
+        self._backfill(now)
+
+    def _backfill(self, now: int):
+        """Заполнить пропуски dau/wau/mau по скетчам ActiveUserSketches.
+
+        Для часов, по которым есть часовые скетчи, dau считается по 24
+        часам, wau и mau - по дневным скетчам на весь день; для более
+        старых дней заполняется только последний час дня. Это оценка задним
+        числом: текущие значения записывает sample().
+        """
+        sketches = self.active_users
+        dau, wau, mau = self.series['dau'], self.series['wau'], self.series['mau']
+
+        daily = {}
+
+        def day_counts(day: datetime):
+            key = day.strftime(DAY_FORMAT)
+            if key not in daily:
+                daily[key] = (
+                    sketches.count_days(key, key),
+                    sketches.count_days((day - timedelta(days=6)).strftime(DAY_FORMAT), key),
+                    sketches.count_days((day - timedelta(days=29)).strftime(DAY_FORMAT), key),
+                )
+            return daily[key]
+
+        hourly_since = now - (sketches.hourly_days - 1) * 24
+        for hour in range(now - self.hours + 1, now):
+            moment = hour_start(hour)
+            if hour < hourly_since and moment.hour != 23:
+                continue
+            if dau.get(hour) != EMPTY:
+                continue
+            day_value, week_value, month_value = day_counts(moment)
+            if hour >= hourly_since:
+                day_value = sketches.count_hours(24, moment)
+            dau.set(hour, day_value)
+            wau.set(hour, week_value)
+            mau.set(hour, month_value)
+
+    async def _run(self):
+        while True:
+            try:
+                self.sample()
+                await self.save()
+            except Exception as e:
+                logger.error(f"Не удалось обновить ряды активности: {e}")
+            await asyncio.sleep(self.save_interval)
+
+    async def start(self):
+        """Запускать после ActiveUserSketches.start() - нужны загруженные скетчи"""
+        await self.load()
+        self.sample()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save()
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from config.config import Config
+from database.async_db import AsyncDatabase
+from services.activity_recorder import utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryWriter:
+    """Пакетная запись результатов отправки одного задания рассылки.
+
+    Воркеры только кладут результат в очередь, а фоновая задача пишет
+    sent_mailings, статусы получателей и счетчики задания одной транзакцией
+    каждые flush_interval секунд или как только накопилось batch_size
+    результатов. close() дожидается записи всего остатка.
+
+    При аварийном завершении процесса теряются только результаты последней
+    несохраненной пачки: эти получатели останутся pending и получат
+    сообщение повторно после возобновления задания.
+    """
+
+    def __init__(self, db: AsyncDatabase, job_id: int, mailing_id: int,
+                 flush_interval: float = None, batch_size: int = None):
+        self.db = db
+        self.job_id = job_id
+        self.mailing_id = mailing_id
+        self.flush_interval = flush_interval or Config.DELIVERY_FLUSH_INTERVAL
+        self.batch_size = batch_size or Config.DELIVERY_BATCH_SIZE
+
+        # Буфер не ограничиваем: его размер не превышает числа получателей задания
+        self._buffer = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._closing = False
+
+    def record(self, user_id: int, status: str = 'sent', unreachable_reason: str = None):
+        """Добавить результат отправки в очередь (без обращения к базе)"""
+        self._buffer.append((user_id, status, utc_timestamp(), unreachable_reason))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Записать накопленные результаты одной транзакцией"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+
+            results, self._buffer = self._buffer, []
+            try:
+                await self.db.record_mailing_results(self.job_id, self.mailing_id, results)
+            except Exception as e:
+                logger.error(f"Не удалось записать результаты рассылки ({len(results)} шт.): {e}")
+                # Возвращаем результаты в начало очереди, чтобы повторить попытку
+                self._buffer = results + self._buffer
+                return 0
+
+            return len(results)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Остановить фоновую задачу и записать все, что осталось в очереди"""
+        # Не отменяем задачу, а даем ей закончить текущую запись:
+        # иначе транзакция в потоке базы завершится уже после close()
+        self._closing = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+        await self.flush()
+        if self._buffer:
+            logger.error(f"Результаты рассылки не записаны (задание {self.job_id}): {len(self._buffer)} шт.")
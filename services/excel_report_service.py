@@ -5,12 +5,16 @@ import logging
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill
 from openpyxl.utils import get_column_letter
+from openpyxl.formatting.rule import ColorScaleRule
+from services.activity_heatmap import ActivityHeatmap, WEEKDAYS, action_title
 
 logger = logging.getLogger(__name__)
 
 class ExcelReportService:
-    def __init__(self):
-        self.db = Database()
+    def __init__(self, db: Database, top_users=None):
+        self.db = db
+        # services.top_users.TopActiveUsers; без него топ считается запросом к базе
+        self.top_users = top_users
         self.reports_dir = "reports"
         os.makedirs(self.reports_dir, exist_ok=True)
 
@@ -27,6 +31,7 @@ class ExcelReportService:
             self._create_summary_sheet(wb)
             self._create_users_sheet(wb)
             self._create_activity_sheet(wb)
+            self._create_heatmap_sheet(wb)
             self._create_mailings_sheet(wb)
             self._create_analytics_sheet(wb)
             self._create_segments_sheet(wb)
@@ -99,7 +104,10 @@ class ExcelReportService:
     def _create_activity_sheet(self, wb):
         """Лист с активностью пользователей"""
         ws = wb.create_sheet("Активность")
-        top_users = self.db.get_top_active_users(50)
+        if self.top_users:
+            top_users = self.top_users.get_top_active_users(self.db, 50)
+        else:
+            top_users = self.db.get_top_active_users(50)
         
         # Заголовки
         headers = ['User ID', 'Username', 'Имя', 'Количество действий']
@@ -126,6 +134,31 @@ class ExcelReportService:
         
         self._apply_styles(ws_daily, 1)
 
+    def _create_heatmap_sheet(self, wb):
+        """Лист с активностью по дню недели и часу - всего и по типам действий"""
+        ws = wb.create_sheet("Активность по часам")
+        heatmap = ActivityHeatmap(self.db.get_activity_heatmap())
+
+        ws.append(['День недели'] + [f"{hour:02d}:00" for hour in range(24)] + ['Итого'])
+        blocks = [(None, heatmap.grid())] + [(action_type, heatmap.grid(action_type))
+                                             for action_type in heatmap.action_types]
+        for action_type, grid in blocks:
+            if action_type is not None:
+                ws.append([])
+                ws.append([f"Тип действия: {action_title(action_type)}"])
+            first_row = ws.max_row + 1
+            for weekday in range(7):
+                ws.append([WEEKDAYS[weekday]] + [int(count) for count in grid[weekday]] + [int(grid[weekday].sum())])
+            # Цветовая шкала по часам блока - сама тепловая карта
+            ws.conditional_formatting.add(
+                f"B{first_row}:{get_column_letter(25)}{ws.max_row}",
+                ColorScaleRule(start_type='min', start_color='FFFFFF', end_type='max', end_color='F8696B')
+            )
+        ws.append([])
+        ws.append([f"Время {heatmap.time_zone_text}"])
+
+        self._apply_styles(ws, 1)
+
     def _create_mailings_sheet(self, wb):
         """Лист с данными рассылок"""
         ws = wb.create_sheet("Рассылки")
@@ -1,29 +1,112 @@
-from database.db import Database
+from database.async_db import AsyncDatabase
+from services.rate_limiter import MailingRateLimiter, get_rate_limiter
+from services.delivery_writer import DeliveryWriter
+from config.config import Config
 from aiogram import Bot
 from aiogram.types import Message
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
 import asyncio
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+def get_unreachable_reason(error: Exception):
+    """Причина, по которой пользователь больше не может получать рассылки.
+
+    None - ошибка временная или относится к самому сообщению, пользователь
+    остается в аудитории.
+    """
+    message = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        if 'deactivated' in message:
+            return 'deactivated'
+        if 'blocked' in message:
+            return 'blocked'
+        return 'forbidden'
+    if isinstance(error, TelegramBadRequest) and 'chat not found' in message:
+        return 'chat_not_found'
+    return None
+
+class MailingProgress:
+    """Счетчики выполняемой рассылки для отображения прогресса"""
+
+    def __init__(self):
+        self.total = 0
+        self.sent = 0
+        self.failed = 0
+        self.done = False
+        # Отправки в текущем запуске - по ним считается скорость
+        self.processed_in_run = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def processed(self):
+        return self.sent + self.failed
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started_at
+        return self.processed_in_run / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Оценка оставшегося времени в секундах (None, если скорость еще неизвестна)"""
+        rate = self.rate
+        if rate <= 0:
+            return None
+        return (self.total - self.processed) / rate
+
+    def add(self, status: str):
+        if status == 'sent':
+            self.sent += 1
+        else:
+            self.failed += 1
+        self.processed_in_run += 1
+
+class MailingControl:
+    """Пауза, продолжение и отмена выполняемой рассылки.
+
+    Воркеры проверяют состояние перед каждой отправкой и после ожидания
+    слота в лимитере, поэтому команда срабатывает в пределах одной отправки.
+    """
+
+    def __init__(self, paused: bool = False):
+        self._resumed = asyncio.Event()
+        if not paused:
+            self._resumed.set()
+        self.cancelled = False
+
+    @property
+    def paused(self):
+        return not self._resumed.is_set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def cancel(self):
+        self.cancelled = True
+        # Будим воркеров, стоящих на паузе, чтобы они завершились
+        self._resumed.set()
+
+    async def wait(self):
+        """Дождаться снятия паузы. Возвращает False, если рассылка отменена"""
+        await self._resumed.wait()
+        return not self.cancelled
+
 class MailingService:
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, db: AsyncDatabase, rate_limiter: MailingRateLimiter = None,
+                 workers: int = None):
         self.bot = bot
-        self.db = Database()
-
-    async def send_mailing(self, mailing_id: int, message_text: str, message_type: str = 'text', 
-                          media_type: str = None, media_file_id: str = None, audience_type: str = 'all'):
-        # Получаем пользователей по выбранной аудитории
-        users = self.db.get_users_by_audience(audience_type)
-        success_count = 0
-        total_users = len(users)
-        
-        if total_users == 0:
-            logger.warning(f"Нет пользователей в аудитории: {audience_type}")
-            return 0, 0
-        
+        self.db = db
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.workers = workers or Config.MAILING_WORKERS
+
         # Методы для отправки разных типов сообщений
-        send_methods = {
+        self.send_methods = {
             'photo': self.bot.send_photo,
             'video': self.bot.send_video,
             'document': self.bot.send_document,
@@ -32,46 +115,137 @@ class MailingService:
             'animation': self.bot.send_animation,
             'text': self.bot.send_message
         }
-        
-        for i, user in enumerate(users):
+
+    async def send_message(self, user_id: int, message_text: str, media_type: str = None,
+                           media_file_id: str = None):
+        """Отправить одно сообщение рассылки пользователю"""
+        if media_type and media_file_id and media_type in self.send_methods and media_type != 'text':
+            # Отправляем медиа с текстом как подпись
+            await self.send_methods[media_type](
+                chat_id=user_id,
+                **{media_type: media_file_id},
+                caption=message_text,
+                parse_mode='HTML'
+            )
+        else:
+            # Отправляем только текст
+            await self.send_methods['text'](
+                chat_id=user_id,
+                text=message_text,
+                parse_mode='HTML'
+            )
+
+    async def send_mailing(self, mailing_id: int, audience_type: str = 'all'):
+        """Создать задание для сохраненной рассылки и выполнить его"""
+        job_id = await self.db.create_mailing_job(mailing_id, audience_type)
+        return await self.run_job(job_id)
+
+    async def run_job(self, job_id: int, progress: MailingProgress = None,
+                      control: MailingControl = None):
+        """Отправить рассылку всем получателям задания, которым она еще не отправлена.
+
+        Результат каждой отправки сразу фиксируется в mailing_recipients, поэтому
+        после перезапуска задание продолжается с того же места без повторов.
+        При отмене через control неотправленные получатели остаются в статусе pending.
+        """
+        progress = progress or MailingProgress()
+        control = control or MailingControl()
+        job = await self.db.get_mailing_job(job_id)
+        mailing = await self.db.get_mailing_by_id(job['mailing_id'])
+        mailing_id = mailing['id']
+        message_text = mailing['message_text']
+        media_type = mailing['media_type']
+        media_file_id = mailing['media_file_id']
+
+        if job['total_count'] == 0:
+            logger.warning(f"Нет пользователей в аудитории: {job['audience_type']}")
+
+        # Не перезаписывает задание, отмененное до запуска
+        await self.db.set_mailing_job_paused(job_id, control.paused)
+
+        progress.total = job['total_count']
+        progress.sent = job['sent_count']
+        progress.failed = job['failed_count']
+
+        # Ограниченная очередь получателей: продюсер читает зафиксированный список
+        # порциями, параллельные воркеры разбирают. Скорость ограничивает общий
+        # token bucket, а не число воркеров.
+        queue = asyncio.Queue(maxsize=Config.AUDIENCE_CHUNK_SIZE)
+        # Результаты пишутся пачками в фоне, а не транзакцией на каждого получателя
+        writer = DeliveryWriter(self.db, job_id, mailing_id)
+
+        async def produce():
             try:
-                user_id = user['user_id']
-                
-                if media_type and media_file_id and media_type in send_methods:
-                    # Отправляем медиа с текстом как подпись
-                    if media_type != 'text':
-                        await send_methods[media_type](
-                            chat_id=user_id,
-                            **{media_type: media_file_id},
-                            caption=message_text,
-                            parse_mode='HTML'
-                        )
-                    else:
-                        await send_methods['text'](
-                            chat_id=user_id,
-                            text=message_text,
-                            parse_mode='HTML'
-                        )
-                else:
-                    # Отправляем только текст
-                    await send_methods['text'](
-                        chat_id=user_id,
-                        text=message_text,
-                        parse_mode='HTML'
-                    )
-                
-                self.db.record_sent_mailing(mailing_id, user_id, 'sent')
-                success_count += 1
-                
-                # Небольшая задержка чтобы не превысить лимиты Telegram
-                await asyncio.sleep(0.05)
-                
-            except Exception as e:
-                logger.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
-                self.db.record_sent_mailing(mailing_id, user_id, 'failed')
-        
+                async for user_ids in self.db.iter_pending_recipients(job_id):
+                    for user_id in user_ids:
+                        await queue.put(user_id)
+            finally:
+                # None - сигнал воркеру завершиться
+                for _ in range(self.workers):
+                    await queue.put(None)
+
+        async def deliver(user_id):
+            """Отправить сообщение одному получателю. False - рассылку отменили.
+
+            RetryAfter не считается ошибкой доставки: получатель остается pending
+            и отправка повторяется после паузы лимитера, пока не пройдет или
+            рассылку не отменят.
+            """
+            while True:
+                if not await control.wait():
+                    return False
+                await self.rate_limiter.acquire(user_id)
+                # Пока ждали слот, рассылку могли поставить на паузу или отменить
+                if not await control.wait():
+                    return False
+                try:
+                    started = time.monotonic()
+                    await self.send_message(user_id, message_text, media_type, media_file_id)
+                    self.rate_limiter.report_success(time.monotonic() - started)
+                    writer.record(user_id, 'sent')
+                    progress.add('sent')
+                    return True
+                except TelegramRetryAfter as e:
+                    # Флуд-контроль: тормозим всю рассылку и повторяем после паузы
+                    self.rate_limiter.report_retry_after(e.retry_after)
+                    logger.warning(f"RetryAfter {e.retry_after}с для пользователя {user_id}, повторим позже")
+                    continue
+                except Exception as e:
+                    logger.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
+                    # Заблокировавшие бота исключаются из следующих рассылок
+                    writer.record(user_id, 'failed', get_unreachable_reason(e))
+                    progress.add('failed')
+                    return True
+
+        async def worker():
+            while True:
+                user_id = await queue.get()
+                if user_id is None or not await deliver(user_id):
+                    return
+
+        producer = asyncio.create_task(produce())
+        writer.start()
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.workers)))
+            if not control.cancelled:
+                # Ошибка чтения получателей оставит задание незавершенным
+                await producer
+        finally:
+            producer.cancel()
+            # В том числе при остановке бота: отправленное не должно уйти повторно
+            await writer.close()
+        await self.db.update_mailing_job_status(job_id, 'cancelled' if control.cancelled else 'completed')
+
+        # Итог берем из задания: он учитывает и отправки до перезапуска
+        job = await self.db.get_mailing_job(job_id)
+        success_count, total_users = job['sent_count'], job['total_count']
+
         # Обновляем статистику рассылки
-        self.db.update_mailing_stats(mailing_id, success_count)
-        
-        logger.info(f"Рассылка {mailing_id} завершена. Успешно: {success_count}/{total_users}")
-        return success_count, total_users
\ No newline at end of file
+        await self.db.update_mailing_stats(mailing_id, success_count)
+        progress.done = True
+
+        if control.cancelled:
+            logger.info(f"Рассылка {mailing_id} отменена. Успешно: {success_count}/{total_users}")
+        else:
+            logger.info(f"Рассылка {mailing_id} завершена. Успешно: {success_count}/{total_users}")
+        return success_count, total_users
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+from datetime import datetime
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from config.config import Config
+from database.async_db import AsyncDatabase
+from database.segments import get_audience_title
+from services.mailing_service import MailingService, MailingProgress, MailingControl
+
+logger = logging.getLogger(__name__)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "—"
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} сек"
+    if seconds < 3600:
+        return f"{seconds // 60} мин {seconds % 60} сек"
+    return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+
+
+class MailingTask:
+    """Рассылка, выполняемая в фоне, и сообщение админа с ее прогрессом"""
+
+    def __init__(self, job_id: int, mailing: dict, audience_type: str, chat_id: int = None,
+                 message_id: int = None, paused: bool = False):
+        self.job_id = job_id
+        self.mailing = mailing
+        self.audience_type = audience_type
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.progress = MailingProgress()
+        self.control = MailingControl(paused)
+        self.task = None
+        self._last_text = None
+
+
+class MailingTaskRegistry:
+    """Реестр фоновых рассылок.
+
+    Обработчик только запускает рассылку и сразу освобождает callback, а
+    рассылка идет отдельной задачей. Прогресс редактируется в сообщении
+    админа не чаще, чем раз в MAILING_PROGRESS_INTERVAL секунд.
+    """
+
+    def __init__(self, bot: Bot, db: AsyncDatabase, progress_interval: float = None):
+        self.bot = bot
+        self.db = db
+        self.mailing_service = MailingService(bot, db)
+        self.progress_interval = progress_interval or Config.MAILING_PROGRESS_INTERVAL
+        self._tasks = {}
+
+    def get(self, job_id: int):
+        return self._tasks.get(job_id)
+
+    def active(self):
+        return list(self._tasks.values())
+
+    async def pause(self, job_id: int):
+        """Приостановить рассылку. Возвращает False, если такой активной рассылки нет"""
+        mailing_task = self._tasks.get(job_id)
+        if not mailing_task or mailing_task.control.cancelled:
+            return False
+        mailing_task.control.pause()
+        await self.db.set_mailing_job_paused(job_id, True)
+        await self.refresh(mailing_task)
+        return True
+
+    async def resume(self, job_id: int):
+        """Продолжить приостановленную рассылку"""
+        mailing_task = self._tasks.get(job_id)
+        if not mailing_task or mailing_task.control.cancelled:
+            return False
+        mailing_task.control.resume()
+        await self.db.set_mailing_job_paused(job_id, False)
+        await self.refresh(mailing_task)
+        return True
+
+    async def cancel(self, job_id: int):
+        """Отменить рассылку: уже начатые отправки завершатся, новые не начнутся"""
+        mailing_task = self._tasks.get(job_id)
+        if not mailing_task or mailing_task.control.cancelled:
+            return False
+        mailing_task.control.cancel()
+        await self.db.cancel_mailing_job(job_id)
+        return True
+
+    async def start(self, mailing_id: int, audience_type: str = 'all', chat_id: int = None,
+                    message_id: int = None, draft_job_id: int = None):
+        """Запустить рассылку в фоне. Возвращает job_id.
+
+        draft_job_id - черновик из create_recipient_snapshot: рассылка уйдет
+        зафиксированному в нем списку. Если черновика уже нет, аудитория
+        выбирается заново.
+        """
+        if draft_job_id and await self.db.attach_mailing_to_job(draft_job_id, mailing_id):
+            job_id = draft_job_id
+        else:
+            job_id = await self.db.create_mailing_job(mailing_id, audience_type)
+        await self._launch(job_id, chat_id, message_id)
+        return job_id
+
+    async def resume_unfinished(self):
+        """Запустить в фоне рассылки, прерванные перезапуском бота"""
+        for job in await self.db.get_unfinished_mailing_jobs():
+            if job['id'] not in self._tasks:
+                logger.info(f"Возобновляем рассылку {job['mailing_id']} (задание {job['id']})")
+                await self._launch(job['id'])
+
+    async def _launch(self, job_id: int, chat_id: int = None, message_id: int = None):
+        job = await self.db.get_mailing_job(job_id)
+        mailing = await self.db.get_mailing_by_id(job['mailing_id'])
+
+        mailing_task = MailingTask(job_id, mailing, job['audience_type'], chat_id, message_id,
+                                   paused=job['status'] == 'paused')
+        mailing_task.progress.total = job['total_count']
+        mailing_task.progress.sent = job['sent_count']
+        mailing_task.progress.failed = job['failed_count']
+        mailing_task.task = asyncio.create_task(self._run(mailing_task))
+        self._tasks[job_id] = mailing_task
+        return mailing_task
+
+    async def _run(self, mailing_task: MailingTask):
+        reporter = asyncio.create_task(self._report_progress(mailing_task))
+        try:
+            await self.mailing_service.run_job(mailing_task.job_id, mailing_task.progress,
+                                               mailing_task.control)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка фоновой рассылки (задание {mailing_task.job_id}): {e}")
+        finally:
+            reporter.cancel()
+            self._tasks.pop(mailing_task.job_id, None)
+
+        await self._edit(mailing_task, self.render_finished(mailing_task), get_finished_keyboard())
+
+    async def _report_progress(self, mailing_task: MailingTask):
+        while True:
+            await self.refresh(mailing_task)
+            await asyncio.sleep(self.progress_interval)
+
+    async def refresh(self, mailing_task: MailingTask):
+        """Показать текущий прогресс с кнопками управления"""
+        await self._edit(mailing_task, self.render_progress(mailing_task), get_control_keyboard(mailing_task))
+
+    async def _edit(self, mailing_task: MailingTask, text: str, keyboard: InlineKeyboardMarkup = None):
+        """Обновить сообщение с прогрессом, если оно есть и текст изменился"""
+        if not mailing_task.chat_id or not mailing_task.message_id or text == mailing_task._last_text:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text,
+                chat_id=mailing_task.chat_id,
+                message_id=mailing_task.message_id,
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            )
+            mailing_task._last_text = text
+        except Exception as e:
+            if "message is not modified" not in str(e):
+                logger.warning(f"Не удалось обновить прогресс рассылки: {e}")
+
+    def render_progress(self, mailing_task: MailingTask):
+        progress = mailing_task.progress
+        header = "⏸ <b>Рассылка на паузе</b>" if mailing_task.control.paused else "📨 <b>Рассылка идет...</b>"
+        return (
+            f"{header}\n\n"
+            f"📝 <b>Заголовок:</b> {mailing_task.mailing['title'] or 'Без заголовка'}\n"
+            f"🎯 <b>Аудитория:</b> {get_audience_title(mailing_task.audience_type)}\n"
+            f"✅ <b>Отправлено:</b> {progress.sent}/{progress.total}\n"
+            f"❌ <b>Ошибок:</b> {progress.failed}\n"
+            f"⚡ <b>Скорость:</b> {progress.rate:.1f} сообщ./сек\n"
+            f"⏳ <b>Осталось:</b> ~{format_duration(progress.eta)}"
+        )
+
+    def render_finished(self, mailing_task: MailingTask):
+        progress = mailing_task.progress
+        delivery_rate = round((progress.sent / progress.total) * 100, 2) if progress.total > 0 else 0
+        header = "⛔ <b>Рассылка отменена</b>" if mailing_task.control.cancelled else "✅ <b>Рассылка завершена!</b>"
+        return (
+            f"{header}\n\n"
+            f"📨 <b>Заголовок:</b> {mailing_task.mailing['title'] or 'Без заголовка'}\n"
+            f"🎯 <b>Аудитория:</b> {get_audience_title(mailing_task.audience_type)}\n"
+            f"✅ <b>Успешно отправлено:</b> {progress.sent}/{progress.total}\n"
+            f"📊 <b>Процент доставки:</b> {delivery_rate}%\n\n"
+            f"📅 <b>Время отправки:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+        )
+
+    async def shutdown(self):
+        """Остановить фоновые рассылки (задания останутся незавершенными и продолжатся после запуска)"""
+        tasks = [mailing_task.task for mailing_task in self._tasks.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def get_control_keyboard(mailing_task: MailingTask):
+    """Кнопки управления выполняемой рассылкой"""
+    job_id = mailing_task.job_id
+    if mailing_task.control.paused:
+        toggle = InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"mailing_resume_{job_id}")
+    else:
+        toggle = InlineKeyboardButton(text="⏸ Пауза", callback_data=f"mailing_pause_{job_id}")
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [toggle, InlineKeyboardButton(text="⛔ Отменить", callback_data=f"mailing_cancel_{job_id}")]
+    ])
+
+
+def get_finished_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📊 Статистика рассылок", callback_data="stats_mailings")],
+        [InlineKeyboardButton(text="📨 Новая рассылка", callback_data="admin_create_mailing")],
+        [InlineKeyboardButton(text="🔙 В админ-панель", callback_data="admin_refresh")]
+    ])
@@ -0,0 +1,167 @@
+import asyncio
+import time
+from config.config import Config
+
+
+class TokenBucket:
+    """Асинхронный token bucket: не больше rate операций в секунду с запасом capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        # Запас не больше секундной нормы текущей скорости (и не больше исходного)
+        self.max_capacity = capacity or rate
+        self.capacity = self.max_capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: float):
+        """Изменить скорость на лету.
+
+        Запас уменьшается вместе со скоростью, иначе после снижения бакет
+        все равно отдаст прежний всплеск; с ростом скорости запас растет обратно.
+        """
+        self._refill()
+        self.rate = rate
+        self.capacity = min(self.max_capacity, max(1.0, rate))
+        self._tokens = min(self._tokens, self.capacity)
+
+    def drain(self, until: float = None):
+        """Обнулить запас и не копить токены до момента until (time.monotonic)"""
+        self._tokens = 0.0
+        self._updated = max(time.monotonic(), until or 0.0)
+
+    async def acquire(self):
+        """Дождаться свободного токена (ожидающие обслуживаются по очереди)"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """Минимальный интервал между сообщениями в один и тот же чат"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_allowed = {}
+
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        next_allowed = self._next_allowed.get(chat_id, now)
+        self._next_allowed[chat_id] = max(now, next_allowed) + self.interval
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+
+        # Периодически убираем чаты, для которых ограничение уже истекло
+        if len(self._next_allowed) > 10000:
+            self._next_allowed = {
+                chat: moment for chat, moment in self._next_allowed.items() if moment > now
+            }
+
+
+class AdaptiveRateController:
+    """AIMD-регулятор скорости рассылки.
+
+    - RetryAfter от Telegram: скорость умножается на decrease_factor, а вся
+      рассылка ставится на паузу на retry_after секунд;
+    - рост задержки ответа выше latency_threshold: мягкое снижение;
+    - нормальная задержка: раз в adjust_interval секунд скорость растет
+      на increase_step, но не выше max_rate.
+    """
+
+    def __init__(self, bucket: TokenBucket, max_rate: float, min_rate: float = 1.0,
+                 increase_step: float = 1.0, decrease_factor: float = 0.5,
+                 latency_threshold: float = 1.0, adjust_interval: float = 1.0):
+        self.bucket = bucket
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_threshold = latency_threshold
+        self.adjust_interval = adjust_interval
+
+        self.latency = None
+        self.paused_until = 0.0
+        self._last_adjust = time.monotonic()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def _set_rate(self, rate: float):
+        self.bucket.set_rate(max(self.min_rate, min(self.max_rate, rate)))
+
+    async def wait_if_paused(self):
+        delay = self.paused_until - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.paused_until - time.monotonic()
+
+    def on_success(self, latency: float):
+        # Скользящее среднее задержки ответа Telegram
+        self.latency = latency if self.latency is None else self.latency * 0.9 + latency * 0.1
+
+        now = time.monotonic()
+        if now - self._last_adjust < self.adjust_interval:
+            return
+        self._last_adjust = now
+
+        if self.latency > self.latency_threshold:
+            self._set_rate(self.rate * 0.9)
+        elif self.rate < self.max_rate:
+            self._set_rate(self.rate + self.increase_step)
+
+    def on_retry_after(self, retry_after: float):
+        now = time.monotonic()
+        # Параллельные воркеры получают RetryAfter за одно и то же превышение -
+        # снижаем скорость только один раз за паузу
+        if now >= self.paused_until:
+            self._set_rate(self.rate * self.decrease_factor)
+        self.paused_until = max(self.paused_until, now + retry_after)
+        # За паузу токены не копятся: после нее воркеры не уйдут одним всплеском
+        self.bucket.drain(self.paused_until)
+        # Следующее увеличение - не раньше, чем через интервал после паузы
+        self._last_adjust = self.paused_until
+
+
+class MailingRateLimiter:
+    """Общий лимит отправки для всех рассылок процесса + лимит на каждый чат"""
+
+    def __init__(self, rate: float = None, per_chat_interval: float = None):
+        max_rate = rate or Config.MAILING_RATE_LIMIT
+        self.bucket = TokenBucket(max_rate)
+        self.per_chat = PerChatLimiter(per_chat_interval or Config.MAILING_PER_CHAT_INTERVAL)
+        self.controller = AdaptiveRateController(self.bucket, max_rate)
+
+    async def acquire(self, chat_id: int):
+        await self.controller.wait_if_paused()
+        await self.per_chat.acquire(chat_id)
+        await self.bucket.acquire()
+        # Пауза могла начаться, пока мы ждали токен
+        await self.controller.wait_if_paused()
+
+    def report_success(self, latency: float):
+        self.controller.on_success(latency)
+
+    def report_retry_after(self, retry_after: float):
+        self.controller.on_retry_after(retry_after)
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter():
+    """Лимитер, общий для всех рассылок: параллельные рассылки делят один бюджет Telegram"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = MailingRateLimiter()
+    return _rate_limiter
@@ -0,0 +1,121 @@
+import time
+import numpy as np
+from datetime import datetime, timezone
+from database.async_db import AsyncDatabase
+
+DAY = 24 * 60 * 60
+
+# Стандартные точки удержания: D1, D7, D30
+RETENTION_DAYS = (1, 7, 30)
+
+# За сколько последних дней регистрации показывать когорты по умолчанию
+COHORT_DAYS = 30
+
+
+class RetentionReport:
+    """Матрица удержания: когорта (день регистрации) x день N после регистрации.
+
+    counts[i, n] - сколько пользователей когорты i были активны ровно
+    через n дней после регистрации. Дни - номера суток UTC от эпохи.
+    """
+
+    def __init__(self, cohorts: np.ndarray, sizes: np.ndarray, counts: np.ndarray, today: int):
+        self.cohorts = cohorts
+        self.sizes = sizes
+        self.counts = counts
+        self.today = today
+
+    @property
+    def max_day(self):
+        return self.counts.shape[1] - 1
+
+    def cohort_date(self, index: int):
+        return datetime.fromtimestamp(int(self.cohorts[index]) * DAY, timezone.utc).strftime('%Y-%m-%d')
+
+    def mature(self, day: int):
+        """Когорты, для которых день N уже полностью прошел"""
+        return self.cohorts + day < self.today
+
+    def active(self, day: int):
+        return self.counts[:, day]
+
+    def rate(self, day: int):
+        """Удержание на день N по когортам в %, NaN - день еще не наступил"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = self.active(day) * 100.0 / self.sizes
+        return np.where(self.mature(day) & (self.sizes > 0), rates, np.nan)
+
+    def overall(self, day: int):
+        """Удержание на день N по всем завершенным когортам в % или None"""
+        mature = self.mature(day)
+        size = int(self.sizes[mature].sum())
+        if not size:
+            return None
+        return round(int(self.active(day)[mature].sum()) * 100.0 / size, 2)
+
+    def rows(self, days=RETENTION_DAYS):
+        """[{'cohort_date', 'cohort_size', 'day_N_active', ...}, ...], новые когорты первыми.
+
+        day_N_active = None, если день N для когорты еще не наступил.
+        """
+        result = []
+        for index in range(len(self.cohorts) - 1, -1, -1):
+            row = {'cohort_date': self.cohort_date(index), 'cohort_size': int(self.sizes[index])}
+            for day in days:
+                mature = self.cohorts[index] + day < self.today
+                row[f'day_{day}_active'] = int(self.counts[index, day]) if mature else None
+            result.append(row)
+        return result
+
+
+def compute_retention(user_ids: np.ndarray, join_days: np.ndarray, active_user_ids: np.ndarray,
+                      active_days: np.ndarray, max_day: int = max(RETENTION_DAYS), today: int = None):
+    """Посчитать матрицу удержания векторно.
+
+    user_ids, join_days - пользователи когорт и день их регистрации;
+    active_user_ids, active_days - пары (пользователь, день активности) без
+    повторов. Пары сопоставляются с пользователями через searchsorted и
+    раскладываются по ячейкам матрицы одним bincount.
+    """
+    if today is None:
+        today = int(time.time()) // DAY
+    width = max_day + 1
+
+    cohorts, cohort_of_user = np.unique(join_days, return_inverse=True)
+    sizes = np.bincount(cohort_of_user, minlength=len(cohorts))
+    if not len(user_ids) or not len(active_user_ids):
+        return RetentionReport(cohorts, sizes, np.zeros((len(cohorts), width), dtype=np.int64), today)
+
+    # Пары из user_daily_activity идут в порядке (date, user_id), поэтому
+    # поиск по отсортированным user_id проходит их почти последовательно
+    order = np.argsort(user_ids)
+    sorted_ids = user_ids[order]
+    positions = np.minimum(np.searchsorted(sorted_ids, active_user_ids), len(sorted_ids) - 1)
+    found = sorted_ids[positions] == active_user_ids
+    user_index = order[positions[found]]
+
+    offsets = active_days[found] - join_days[user_index]
+    keep = (offsets >= 0) & (offsets <= max_day)
+    cells = cohort_of_user[user_index[keep]] * width + offsets[keep]
+    counts = np.bincount(cells, minlength=len(cohorts) * width).reshape(len(cohorts), width)
+    return RetentionReport(cohorts, sizes, counts, today)
+
+
+def _to_arrays(rows):
+    """[(user_id, 'YYYY-MM-DD'), ...] -> (user_id, номер дня) массивами int64"""
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    days = np.array([row[1] for row in rows], dtype='datetime64[D]').astype(np.int64)
+    return ids, days
+
+
+def build_retention(users, activity, max_day: int = max(RETENTION_DAYS)):
+    """RetentionReport из строк Database.get_retention_rows"""
+    user_ids, join_days = _to_arrays(users)
+    active_user_ids, active_days = _to_arrays(activity)
+    return compute_retention(user_ids, join_days, active_user_ids, active_days, max_day)
+
+
+async def load_retention(db: AsyncDatabase, cohort_days: int = COHORT_DAYS, days=RETENTION_DAYS):
+    """Удержание когорт за последние cohort_days дней (расчет в потоке БД)"""
+    users, activity = await db.get_retention_rows(cohort_days)
+    return await db.run(build_retention, users, activity, max(days))
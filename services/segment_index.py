@@ -0,0 +1,311 @@
+import asyncio
+import logging
+import time
+import numpy as np
+from config.config import Config
+from database.async_db import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+# Сегменты по времени: имя -> (колонка с временем, окно в днях)
+WINDOW_SEGMENTS = {
+    'new_today': ('joined', 1),
+    'new_week': ('joined', 7),
+    'new_month': ('joined', 30),
+    'active_today': ('last_active', 1),
+    'active_week': ('last_active', 7),
+    'active_month': ('last_active', 30),
+}
+
+
+class Bitmap:
+    """Множество пользователей - упакованный битовый массив (бит = users.id).
+
+    Пересечение, объединение, разность и подсчет выполняются векторно над
+    словами по 64 бита, без обращения к базе.
+    """
+
+    def __init__(self, words: np.ndarray, universe: np.ndarray = None):
+        self.words = words
+        # Все существующие пользователи - нужно для дополнения (~)
+        self.universe = universe if universe is not None else words
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray, universe: np.ndarray = None):
+        """Bitmap из булева массива, индексированного users.id"""
+        packed = np.packbits(mask, bitorder='little')
+        padded = np.zeros((len(packed) + 7) // 8 * 8, dtype=np.uint8)
+        padded[:len(packed)] = packed
+        return cls(padded.view('<u8'), universe)
+
+    def __and__(self, other):
+        return Bitmap(self.words & other.words, self.universe)
+
+    def __or__(self, other):
+        return Bitmap(self.words | other.words, self.universe)
+
+    def __sub__(self, other):
+        return Bitmap(self.words & ~other.words, self.universe)
+
+    def __invert__(self):
+        return Bitmap(self.universe & ~self.words, self.universe)
+
+    def count(self):
+        return int(_popcount(self.words))
+
+    __len__ = count
+
+    def positions(self):
+        """Номера установленных битов (users.id)"""
+        bits = np.unpackbits(self.words.view(np.uint8), bitorder='little')
+        return np.flatnonzero(bits)
+
+
+if hasattr(np, 'bitwise_count'):
+    def _popcount(words):
+        return np.bitwise_count(words).sum()
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        return _POPCOUNT_TABLE[words.view(np.uint8)].sum(dtype=np.int64)
+
+
+class SegmentIndex:
+    """Битовый индекс стандартных сегментов аудитории.
+
+    Ключ - плотный users.id. Для каждого пользователя в памяти хранятся
+    telegram id, время регистрации и последней активности, доступность и
+    наличие username; из них строятся битмапы сегментов (см. AUDIENCES и
+    get_user_segments), и операции над аудиториями отвечают без запросов
+    к users и user_activity.
+
+    Обновление:
+    - активность приходит сразу после записи пачки (ActivityRecorder.add_listener);
+    - новые пользователи, повторный /start и отметки недоступности - сразу
+      после записи (AsyncDatabase.add_listener, события 'users' и 'unreachable');
+    - каждые SEGMENT_INDEX_REFRESH секунд сдвигаются окна времени и
+      подхватываются пользователи, добавленные в обход AsyncDatabase;
+    - раз в SEGMENT_INDEX_REBUILD секунд индекс перестраивается целиком.
+    Изменения, пришедшие, пока refresh/rebuild ждет базу, запоминаются и
+    применяются заново после обновления.
+    """
+
+    def __init__(self, db: AsyncDatabase, refresh_interval: float = None, rebuild_interval: float = None):
+        self.db = db
+        self.refresh_interval = refresh_interval or Config.SEGMENT_INDEX_REFRESH
+        self.rebuild_interval = rebuild_interval or Config.SEGMENT_INDEX_REBUILD
+
+        self._reset()
+        self.built_at = None
+        self._task = None
+        # Пока идет refresh/rebuild - [(обработчик, данные), ...] для повтора
+        self._pending = None
+
+    def _reset(self):
+        self._capacity = 0
+        self._max_id = 0
+        self._positions = {}
+        self.user_ids = np.zeros(0, dtype=np.int64)
+        self.joined = np.zeros(0, dtype=np.int64)
+        self.last_active = np.zeros(0, dtype=np.int64)
+        self.exists = np.zeros(0, dtype=bool)
+        self.reachable = np.zeros(0, dtype=bool)
+        self.has_username = np.zeros(0, dtype=bool)
+        self._recompute()
+
+    def _allocate(self, capacity: int):
+        """Расширить массивы так, чтобы поместился users.id < capacity"""
+        capacity = (capacity + 63) // 64 * 64
+        if capacity <= self._capacity:
+            return
+
+        def grow(array):
+            resized = np.zeros(capacity, dtype=array.dtype)
+            resized[:len(array)] = array
+            return resized
+
+        self.user_ids = grow(self.user_ids)
+        self.joined = grow(self.joined)
+        self.last_active = grow(self.last_active)
+        self.exists = grow(self.exists)
+        self.reachable = grow(self.reachable)
+        self.has_username = grow(self.has_username)
+        self._capacity = capacity
+
+    def _load_users(self, rows):
+        """rows - [(id, user_id, username, joined, is_reachable, last_active), ...]"""
+        if not rows:
+            return
+        data = np.array(
+            [(row_id, user_id, joined or 0, bool(reachable), bool(username), last_active or 0)
+             for row_id, user_id, username, joined, reachable, last_active in rows],
+            dtype=np.int64
+        )
+        positions = data[:, 0]
+        self._allocate(int(positions.max()) + 1)
+
+        self.user_ids[positions] = data[:, 1]
+        self.joined[positions] = data[:, 2]
+        self.reachable[positions] = data[:, 3].astype(bool)
+        self.has_username[positions] = data[:, 4].astype(bool)
+        self.last_active[positions] = np.maximum(self.last_active[positions], data[:, 5])
+        self.exists[positions] = True
+
+        for position, user_id in zip(positions.tolist(), data[:, 1].tolist()):
+            self._positions[user_id] = position
+        self._max_id = max(self._max_id, int(positions.max()))
+
+    def _recompute(self):
+        """Пересобрать битмапы из массивов (сдвигает окна времени)"""
+        now = int(time.time())
+        universe = Bitmap.from_mask(self.exists)
+        bitmaps = {
+            'all': universe,
+            'reachable': Bitmap.from_mask(self.reachable & self.exists, universe.words),
+            'with_username': Bitmap.from_mask(self.has_username & self.exists, universe.words),
+        }
+        for name, (column, days) in WINDOW_SEGMENTS.items():
+            values = getattr(self, column)
+            bitmaps[name] = Bitmap.from_mask(self.exists & (values >= now - days * DAY), universe.words)
+        bitmaps['unreachable'] = ~bitmaps['reachable']
+        bitmaps['inactive_month'] = ~bitmaps['active_month']
+        bitmaps['without_username'] = ~bitmaps['with_username']
+        self._bitmaps = bitmaps
+
+    async def rebuild(self):
+        """Загрузить индекс из базы целиком"""
+        started = time.perf_counter()
+        self._pending = []
+        try:
+            rows = await self.db.get_segment_index_rows()
+            # Дальше без await - состояние заменяется целиком
+            self._reset()
+            self._load_users(rows)
+            self._recompute()
+            self._replay_pending()
+        finally:
+            self._pending = None
+        self.built_at = time.time()
+        logger.info(f"Индекс сегментов построен: {len(rows)} пользователей "
+                    f"за {time.perf_counter() - started:.2f} сек")
+
+    async def refresh(self):
+        """Добавить пользователей, записанных в обход AsyncDatabase, и сдвинуть окна"""
+        self._pending = []
+        try:
+            rows = await self.db.get_segment_index_rows(after_id=self._max_id)
+            # Дальше без await: on_activity не должен увидеть массивы, уже
+            # увеличенные _load_users, вместе со старыми битмапами
+            self._load_users(rows)
+            self._recompute()
+            self._replay_pending()
+        finally:
+            self._pending = None
+
+    def _replay_pending(self):
+        """Повторить изменения, пришедшие во время чтения базы"""
+        pending, self._pending = self._pending, None
+        for handler, payload in pending:
+            handler(payload)
+
+    def _remember(self, handler, payload):
+        if self._pending is not None:
+            self._pending.append((handler, payload))
+
+    def on_users(self, rows):
+        """Новые пользователи или повторный /start - строки get_segment_index_rows"""
+        self._remember(self.on_users, rows)
+        self._load_users(rows)
+        # Массивы могли вырасти - битмапы пересобираются под новый размер
+        self._recompute()
+
+    def on_unreachable(self, user_ids):
+        """Рассылка отметила пользователей недоступными (заблокировали бота и т.п.)"""
+        self._remember(self.on_unreachable, user_ids)
+        for user_id in user_ids:
+            position = self._positions.get(user_id)
+            if position is None:
+                continue
+            self.reachable[position] = False
+            word, bit = position >> 6, np.uint64(1 << (position & 63))
+            self._bitmaps['reachable'].words[word] &= ~bit
+            self._bitmaps['unreachable'].words[word] |= bit
+
+    def on_activity(self, events):
+        """Учесть пачку записанной активности [(user_id, action_type, timestamp), ...]"""
+        self._remember(self.on_activity, events)
+        now = int(time.time())
+        for user_id, _, _ in events:
+            position = self._positions.get(user_id)
+            if position is None:
+                # Новый пользователь попадет в индекс при следующем refresh
+                continue
+            self.last_active[position] = max(self.last_active[position], now)
+            word, bit = position >> 6, np.uint64(1 << (position & 63))
+            for name, (column, _) in WINDOW_SEGMENTS.items():
+                if column == 'last_active':
+                    self._bitmaps[name].words[word] |= bit
+            self._bitmaps['inactive_month'].words[word] &= ~bit
+
+    # --- Запросы ---
+
+    def bitmap(self, name: str) -> Bitmap:
+        """Битмап стандартного сегмента (all, reachable, active_week, new_month, ...)"""
+        return self._bitmaps[name]
+
+    def audience(self, audience_type: str, include_unreachable: bool = False) -> Bitmap:
+        """Аудитория из database.segments.AUDIENCES (по умолчанию только доступные)"""
+        bitmap = self._bitmaps.get(audience_type)
+        if bitmap is None:
+            return Bitmap(np.zeros_like(self._bitmaps['all'].words), self._bitmaps['all'].words)
+        return bitmap if include_unreachable else bitmap & self._bitmaps['reachable']
+
+    def get_audience_count(self, audience_type: str, include_unreachable: bool = False):
+        return self.audience(audience_type, include_unreachable).count()
+
+    def get_user_ids(self, bitmap: Bitmap):
+        """Telegram id пользователей множества"""
+        return self.user_ids[bitmap.positions()]
+
+    def get_user_segments(self):
+        """То же, что Database.get_user_segments, но из индекса"""
+        return {
+            'new_users': self.bitmap('new_week').count(),
+            'active_users': self.bitmap('active_week').count(),
+            'inactive_users': self.bitmap('inactive_month').count(),
+            'users_with_username': self.bitmap('with_username').count(),
+            'users_without_username': self.bitmap('without_username').count(),
+        }
+
+    # --- Фоновое обновление ---
+
+    async def _run(self):
+        last_rebuild = time.monotonic()
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                if time.monotonic() - last_rebuild >= self.rebuild_interval:
+                    await self.rebuild()
+                    last_rebuild = time.monotonic()
+                else:
+                    await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка обновления индекса сегментов: {e}")
+
+    async def start(self):
+        """Построить индекс и запустить фоновое обновление"""
+        await self.rebuild()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
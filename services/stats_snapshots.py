@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from config.config import Config
+from database.async_db import AsyncDatabase
+from services.active_users import ActiveUserSketches
+
+logger = logging.getLogger(__name__)
+
+
+def format_age(seconds):
+    """Возраст снимка для подписи «обновлено ... назад»"""
+    seconds = max(int(seconds), 0)
+    if seconds < 60:
+        return f"{seconds} сек"
+    if seconds < 3600:
+        return f"{seconds // 60} мин"
+    return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+
+
+class StatsSnapshot:
+    """Снимок статистики: поля get_detailed_stats, ряды по дням и сегменты"""
+
+    def __init__(self, created_at: str, data: dict):
+        # created_at - CURRENT_TIMESTAMP SQLite (UTC)
+        self.created_at = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        self.stats = data['stats']
+        self.activity = data['activity']
+        self.growth = data['growth']
+        self.segments = data['segments']
+
+    @property
+    def age(self):
+        """Сколько секунд назад снят"""
+        return (datetime.now(timezone.utc) - self.created_at).total_seconds()
+
+    @property
+    def updated_text(self):
+        """Время снимка (местное) и его возраст для подписи под статистикой"""
+        local_time = self.created_at.astimezone().strftime('%d.%m.%Y %H:%M')
+        return f"{local_time} ({format_age(self.age)} назад)"
+
+    def _since(self, series, days):
+        # Ряды хранятся за 30 дней, короткий период - их хвост
+        since = (self.created_at - timedelta(days=days)).strftime('%Y-%m-%d')
+        return [(date, count) for date, count in series if date >= since]
+
+    def growth_for(self, days: int):
+        """[(дата, новых пользователей), ...] за последние days дней"""
+        return self._since(self.growth, days)
+
+    def activity_for(self, days: int):
+        """[(дата, действий), ...] за последние days дней"""
+        return self._since(self.activity, days)
+
+
+class StatsSnapshotService:
+    """Периодический снимок статистики для админ-панели.
+
+    Фоновая задача раз в STATS_SNAPSHOT_INTERVAL секунд пересчитывает
+    статистику по сырым таблицам и сохраняет ее в stats_snapshots, а
+    дашборд и экраны статистики читают последний снимок из памяти и
+    показывают его возраст. Сколько бы админов ни нажимали «Обновить»,
+    тяжелые запросы выполняются не чаще одного раза за интервал.
+    """
+
+    def __init__(self, db: AsyncDatabase, interval: float = None,
+                 active_users: ActiveUserSketches = None):
+        self.db = db
+        self.interval = interval or Config.STATS_SNAPSHOT_INTERVAL
+        # Если заданы скетчи, активные пользователи в снимке - их оценки
+        self.active_users = active_users
+        self._snapshot = None
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def refresh(self):
+        """Пересчитать статистику и сохранить новый снимок"""
+        async with self._lock:
+            active_counts = self.active_users.get_active_counts() if self.active_users else None
+            data = await self.db.build_stats_snapshot(active_counts)
+            created_at = await self.db.save_stats_snapshot(data)
+            self._snapshot = StatsSnapshot(created_at, data)
+            return self._snapshot
+
+    async def get(self):
+        """Последний снимок; если его еще нет - посчитать сразу"""
+        if self._snapshot is None:
+            async with self._lock:
+                if self._snapshot is None:
+                    latest = await self.db.get_latest_stats_snapshot()
+                    if latest:
+                        self._snapshot = StatsSnapshot(*latest)
+            if self._snapshot is None:
+                return await self.refresh()
+        return self._snapshot
+
+    async def _run(self):
+        # После перезапуска свежий снимок из базы не пересчитывается сразу
+        delay = self.interval - self._snapshot.age if self._snapshot else 0
+        await asyncio.sleep(max(delay, 0))
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка обновления снимка статистики: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        """Подхватить последний сохраненный снимок и запустить пересчет по расписанию"""
+        await self.get()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
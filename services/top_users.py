@@ -0,0 +1,229 @@
+import asyncio
+import heapq
+import json
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from config.config import Config
+from database.async_db import AsyncDatabase
+from database.db import Database
+
+logger = logging.getLogger(__name__)
+
+DAY_FORMAT = '%Y-%m-%d'
+
+
+class SpaceSaving:
+    """Самые активные пользователи потока событий в памяти O(capacity) (Space-Saving).
+
+    Хранится не больше capacity счетчиков. Новый пользователь при
+    заполненной таблице вытесняет пользователя с минимальным счетчиком и
+    наследует его значение как погрешность: count - оценка сверху, count -
+    error - снизу. Любой пользователь, у которого больше N / capacity
+    событий из N, гарантированно в таблице.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Куча (count, user_id) с устаревшими записями - проверяются при вытеснении
+        self._heap = []
+
+    def add(self, user_id: int, weight: int = 1):
+        if user_id in self.counts:
+            self.counts[user_id] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[user_id] = weight
+            self.errors[user_id] = 0
+        else:
+            evicted, minimum = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[user_id] = minimum + weight
+            self.errors[user_id] = minimum
+        heapq.heappush(self._heap, (self.counts[user_id], user_id))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def _pop_min(self):
+        while True:
+            count, user_id = heapq.heappop(self._heap)
+            if self.counts.get(user_id) == count:
+                return user_id, count
+
+    def _rebuild_heap(self):
+        self._heap = [(count, user_id) for user_id, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, limit: int):
+        """[(user_id, count, error), ...] по убыванию count"""
+        best = heapq.nlargest(limit, self.counts.items(), key=lambda item: item[1])
+        return [(user_id, count, self.errors[user_id]) for user_id, count in best]
+
+    @classmethod
+    def merge(cls, summaries, capacity: int):
+        """Объединить сводки (например, за несколько дней): счетчики и погрешности складываются"""
+        counts, errors = Counter(), Counter()
+        for summary in summaries:
+            counts.update(summary.counts)
+            errors.update(summary.errors)
+        merged = cls(capacity)
+        for user_id, count in counts.most_common(capacity):
+            merged.counts[user_id] = count
+            merged.errors[user_id] = errors[user_id]
+        merged._rebuild_heap()
+        return merged
+
+    def to_json(self):
+        return json.dumps([[user_id, count, self.errors[user_id]] for user_id, count in self.counts.items()])
+
+    @classmethod
+    def from_json(cls, data: str, capacity: int):
+        summary = cls(capacity)
+        for user_id, count, error in json.loads(data):
+            summary.counts[user_id] = count
+            summary.errors[user_id] = error
+        summary._rebuild_heap()
+        return summary
+
+
+class TopActiveUsers:
+    """Топ активных пользователей за последние дни без GROUP BY по user_activity.
+
+    На каждый день (UTC) ведется своя сводка SpaceSaving на
+    TOP_USERS_CAPACITY пользователей; топ за день, неделю или месяц -
+    объединение сводок нужных дней. Сводки пополняются после записи
+    активности (ActivityRecorder.add_listener) и сохраняются в
+    top_users_sketches раз в TOP_USERS_SAVE_INTERVAL секунд; при запуске
+    досчитываются события, записанные после последнего сохранения.
+    """
+
+    def __init__(self, db: AsyncDatabase, capacity: int = None, keep_days: int = None,
+                 save_interval: float = None):
+        self.db = db
+        self.capacity = capacity or Config.TOP_USERS_CAPACITY
+        self.keep_days = keep_days or Config.TOP_USERS_KEEP_DAYS
+        self.save_interval = save_interval or Config.TOP_USERS_SAVE_INTERVAL
+
+        self.days = {}
+        # Время последнего учтенного события - с него продолжается досчет после перезапуска
+        self.through = None
+        self._dirty = set()
+        # Excel-отчет читает топ из потока БД
+        self._lock = threading.Lock()
+        self._task = None
+
+    def add(self, events):
+        """Учесть события [(user_id, action_type, timestamp), ...]"""
+        counts = Counter((timestamp[:10], user_id) for user_id, _, timestamp in events)
+        with self._lock:
+            self._add_counts(counts.items())
+            latest = max(timestamp for _, _, timestamp in events) if events else None
+            if latest and (self.through is None or latest > self.through):
+                self.through = latest
+
+    # Обработчик для ActivityRecorder.add_listener
+    on_activity = add
+
+    def _add_counts(self, counts):
+        """counts - [((date, user_id), count), ...]"""
+        for (date, user_id), count in counts:
+            summary = self.days.get(date)
+            if summary is None:
+                summary = self.days[date] = SpaceSaving(self.capacity)
+            summary.add(user_id, count)
+            self._dirty.add(date)
+
+    def top(self, limit: int = 10, days: int = 30):
+        """[(user_id, count, error), ...] за последние days календарных дней, включая сегодня"""
+        since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime(DAY_FORMAT)
+        with self._lock:
+            summaries = [summary for date, summary in self.days.items() if date >= since]
+            if len(summaries) == 1:
+                return summaries[0].top(limit)
+            return SpaceSaving.merge(summaries, self.capacity).top(limit)
+
+    def get_top_active_users(self, db: Database, limit: int = 10, days: int = 30):
+        """То же, что Database.get_top_active_users, но из сводок.
+
+        Синхронный вариант для Excel-отчета: имена читаются из переданной
+        синхронной базы в потоке отчета.
+        """
+        top = self.top(limit, days)
+        return self._with_names(top, db.get_users_by_ids([user_id for user_id, _, _ in top]))
+
+    async def fetch_top_active_users(self, limit: int = 10, days: int = 30):
+        """get_top_active_users для обработчиков (имена читаются в потоке БД)"""
+        top = self.top(limit, days)
+        return self._with_names(top, await self.db.get_users_by_ids([user_id for user_id, _, _ in top]))
+
+    @staticmethod
+    def _with_names(top, users):
+        users = {user['user_id']: user for user in users}
+        return [
+            {
+                'user_id': user_id,
+                'username': users.get(user_id, {}).get('username'),
+                'first_name': users.get(user_id, {}).get('first_name'),
+                'activity_count': count,
+            }
+            for user_id, count, _ in top
+        ]
+
+    # --- Хранение ---
+
+    async def save(self):
+        since = (datetime.now(timezone.utc) - timedelta(days=self.keep_days)).strftime(DAY_FORMAT)
+        with self._lock:
+            for date in [date for date in self.days if date < since]:
+                del self.days[date]
+            dirty, self._dirty = self._dirty, set()
+            rows = [(date, self.days[date].to_json()) for date in dirty if date in self.days]
+            through = self.through
+        try:
+            await self.db.save_top_users_sketches(rows, through, since)
+        except Exception:
+            with self._lock:
+                self._dirty |= dirty
+            raise
+
+    async def load(self):
+        rows, through = await self.db.get_top_users_sketches()
+        with self._lock:
+            for date, data in rows:
+                self.days[date] = SpaceSaving.from_json(data, self.capacity)
+            self.through = through
+
+        # Первый запуск - вся история за keep_days, иначе - после последнего сохранения
+        since = through or (datetime.now(timezone.utc) - timedelta(days=self.keep_days)).strftime(DAY_FORMAT)
+        counts, latest = await self.db.get_activity_counts_after(since)
+        with self._lock:
+            self._add_counts(((date, user_id), count) for date, user_id, count in counts)
+            if latest and (self.through is None or latest > self.through):
+                self.through = latest
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить топ активных пользователей: {e}")
+
+    async def start(self):
+        await self.load()
+        await self.save()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save()
@@ -0,0 +1,44 @@
+import asyncio
+import time
+import unittest
+from services.rate_limiter import MailingRateLimiter
+
+
+class RetryAfterBurstTest(unittest.IsolatedAsyncioTestCase):
+    """После паузы RetryAfter отправки идут со сниженной скоростью, без всплеска"""
+
+    async def test_first_second_after_pause_respects_reduced_rate(self):
+        limiter = MailingRateLimiter(rate=30, per_chat_interval=0.001)
+        limiter.report_retry_after(0.3)
+        reduced_rate = limiter.controller.rate
+        self.assertEqual(reduced_rate, 15)
+
+        acquired = []
+
+        async def worker(chat_id):
+            while True:
+                await limiter.acquire(chat_id)
+                acquired.append(time.monotonic())
+                chat_id += 1000
+
+        workers = [asyncio.create_task(worker(chat_id)) for chat_id in range(30)]
+        await asyncio.sleep(0.3 + 1.0)
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        paused_until = limiter.controller.paused_until
+        self.assertFalse([moment for moment in acquired if moment < paused_until])
+        first_second = [moment for moment in acquired if moment < paused_until + 1.0]
+        self.assertLessEqual(len(first_second), reduced_rate)
+
+    async def test_capacity_follows_rate(self):
+        limiter = MailingRateLimiter(rate=30, per_chat_interval=0.001)
+        limiter.report_retry_after(0)
+        self.assertEqual(limiter.bucket.capacity, 15)
+        limiter.controller._set_rate(40)
+        self.assertEqual(limiter.bucket.capacity, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
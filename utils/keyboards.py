@@ -0,0 +1,15 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from database.segments import AUDIENCES
+
+def get_audience_keyboard(callback_prefix: str, back_callback: str, callback_suffix: str = ''):
+    """Клавиатура выбора аудитории из реестра AUDIENCES (по две кнопки в ряд).
+
+    callback_data кнопки - callback_prefix + ключ аудитории + callback_suffix
+    """
+    buttons = [
+        InlineKeyboardButton(text=audience.title, callback_data=f"{callback_prefix}{audience.key}{callback_suffix}")
+        for audience in AUDIENCES.values()
+    ]
+    rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data=back_callback)])
+    return InlineKeyboardMarkup(inline_keyboard=rows)